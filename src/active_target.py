@@ -0,0 +1,120 @@
+import json
+import os
+import uuid
+from typing import TypedDict
+
+from atomic_file import write_atomic
+from config import INDEX_NAMESPACE, RAG_REPO_ROOT
+from vector_store import StoreType, get_local_store_path
+
+
+class ActiveTarget(TypedDict):
+    # namespace that is queried and updated by normal runs
+    namespace: str
+    # namespace that was active before the last switch, kept for a rollback
+    previous: str | None
+    # changes whenever the indexer wrote to the index, e.g. to invalidate cached query results
+    version: str | None
+    # namespace of a rebuild that was not switched to yet (e.g. failed), the next rebuild resumes it
+    pending: str | None
+
+
+def get_active_target_path(store: StoreType, index_name: str, model: str) -> str:
+    """
+    Pointer file of the active namespace of an index.
+
+    The pinecone one is part of this repo (like the tracked files), the local one is next to its store
+    (of the given embedding model).
+    """
+    if store == "local":
+        return os.path.join(
+            get_local_store_path(index_name, model), "active_target.json"
+        )
+
+    return os.path.join(RAG_REPO_ROOT, f"active_target_{index_name}.json")
+
+
+def load_active_target(path: str) -> ActiveTarget:
+    if not os.path.exists(path):
+        return {
+            "namespace": INDEX_NAMESPACE,
+            "previous": None,
+            "version": None,
+            "pending": None,
+        }
+
+    with open(path, "r", encoding="utf-8") as f:
+        target = json.load(f)
+
+    # pointer files of older versions do not have all fields
+    target.setdefault("version", None)
+    target.setdefault("pending", None)
+    return target
+
+
+def _save_active_target(path: str, target: ActiveTarget) -> None:
+    # swapped in at once, queries either see the old or the new target
+    write_atomic(path, json.dumps(target, indent=2) + "\n")
+
+
+def switch_active_target(path: str, namespace: str) -> ActiveTarget:
+    """Activate the given namespace, the currently active one is kept as previous"""
+    current = load_active_target(path)
+    target: ActiveTarget = {
+        "namespace": namespace,
+        "previous": current["namespace"],
+        "version": current["version"],
+        # the rebuild is complete once it is switched to
+        "pending": None if current["pending"] == namespace else current["pending"],
+    }
+    _save_active_target(path, target)
+
+    return target
+
+
+def rollback_active_target(path: str) -> ActiveTarget:
+    """Swap the active and the previous namespace"""
+    current = load_active_target(path)
+    if not current["previous"]:
+        raise ValueError("There is no previous namespace to roll back to")
+
+    target: ActiveTarget = {
+        "namespace": current["previous"],
+        "previous": current["namespace"],
+        "version": current["version"],
+        "pending": current["pending"],
+    }
+    _save_active_target(path, target)
+
+    return target
+
+
+def get_rebuild_namespace(path: str, namespace: str) -> str:
+    """Namespace of the pending rebuild to resume, otherwise the given one"""
+    return load_active_target(path)["pending"] or namespace
+
+
+def start_rebuild(path: str, namespace: str) -> None:
+    """Register the namespace as the pending rebuild, until it is switched to"""
+    target = load_active_target(path)
+    if target["pending"] != namespace:
+        target["pending"] = namespace
+        _save_active_target(path, target)
+
+
+def bump_index_version(path: str) -> ActiveTarget:
+    """Mark the index as changed by the indexer"""
+    target = load_active_target(path)
+    target["version"] = uuid.uuid4().hex
+    _save_active_target(path, target)
+
+    return target
+
+
+def get_namespace_file(path: str, namespace: str) -> str:
+    """Files (e.g. tracked files) of other namespaces than the default one get the namespace as suffix"""
+    if namespace == INDEX_NAMESPACE:
+        return path
+
+    base, extension = os.path.splitext(path)
+    return f"{base}.{namespace}{extension}"
@@ -0,0 +1,76 @@
+import pytest
+
+from active_target import (
+    bump_index_version,
+    get_rebuild_namespace,
+    get_namespace_file,
+    load_active_target,
+    rollback_active_target,
+    start_rebuild,
+    switch_active_target,
+)
+
+
+def test_switch_and_rollback(tmp_path):
+    path = str(tmp_path / "active_target.json")
+    assert load_active_target(path) == {
+        "namespace": "default",
+        "previous": None,
+        "version": None,
+        "pending": None,
+    }
+
+    with pytest.raises(ValueError):
+        rollback_active_target(path)
+
+    switch_active_target(path, "rebuild-1")
+    assert load_active_target(path) == {
+        "namespace": "rebuild-1",
+        "previous": "default",
+        "version": None,
+        "pending": None,
+    }
+
+    rollback_active_target(path)
+    assert load_active_target(path) == {
+        "namespace": "default",
+        "previous": "rebuild-1",
+        "version": None,
+        "pending": None,
+    }
+
+
+def test_index_version(tmp_path):
+    path = str(tmp_path / "active_target.json")
+    version = bump_index_version(path)["version"]
+    assert version
+    assert load_active_target(path)["namespace"] == "default"
+
+    # kept by switches, the namespace is part of what is queried anyway
+    switch_active_target(path, "rebuild-1")
+    assert load_active_target(path)["version"] == version
+
+    assert bump_index_version(path)["version"] != version
+
+
+def test_pending_rebuild_is_resumed(tmp_path):
+    path = str(tmp_path / "active_target.json")
+    assert get_rebuild_namespace(path, "rebuild-1") == "rebuild-1"
+    # nothing is registered until the rebuild starts
+    assert load_active_target(path)["pending"] is None
+
+    start_rebuild(path, "rebuild-1")
+    # e.g. the first rebuild failed
+    assert get_rebuild_namespace(path, "rebuild-2") == "rebuild-1"
+    assert load_active_target(path)["namespace"] == "default"
+
+    switch_active_target(path, "rebuild-1")
+    assert load_active_target(path)["pending"] is None
+    assert get_rebuild_namespace(path, "rebuild-2") == "rebuild-2"
+
+
+def test_namespace_files():
+    assert get_namespace_file("/a/tracked.txt", "default") == "/a/tracked.txt"
+    assert (
+        get_namespace_file("/a/tracked.txt", "rebuild-1") == "/a/tracked.rebuild-1.txt"
+    )
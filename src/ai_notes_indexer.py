@@ -1,37 +1,138 @@
 import argparse
+import json
+import math
 import os
 import subprocess
 import sys
 import time
-import uuid
+from contextlib import closing, redirect_stdout
+from datetime import datetime
+from functools import partial
 from pathlib import Path
 from typing import Literal, TypedDict
 
-from pinecone import AwsRegion, CloudProvider, EmbedModel, IndexEmbed, Pinecone
-
+from active_target import (
+    bump_index_version,
+    get_active_target_path,
+    get_namespace_file,
+    get_rebuild_namespace,
+    load_active_target,
+    rollback_active_target,
+    start_rebuild,
+    switch_active_target,
+)
+from client_state import ClientState
 from config import (
+    CHUNK_WORKERS,
+    CHUNK_WORKERS_MIN_FILES,
     CYAN,
+    EMBEDDER,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_SIZE,
     GREEN,
     GREY,
     IN_CI,
     INDEX_NAME,
-    INDEX_NAMESPACE,
     MAGENTA,
-    PINECONE_API_KEY,
+    MAX_CHUNK_TOKENS,
+    RAG_REPO_ROOT,
     RED,
     RESET,
     TRACKED_FILE,
+    TRACKED_FILE_CHECKPOINT_INTERVAL,
+    UPLOAD_WORKERS,
+    VECTOR_STORE,
+    WATCH_DEBOUNCE,
+    WATCH_POLL_INTERVAL,
     YELLOW,
 )
-from markdown_chunker import chunk_markdown_by_heading, chunk_markdown_by_list
-from tracked_file_handler import TrackedFileHandler
+from embedder import Embedder, EmbedderType, create_embedder, get_embedder_model
+from git_changes import (
+    get_blob_ids,
+    get_changed_files_since,
+    get_head_commit,
+    get_indexable_files,
+    get_modified_files,
+    get_repo_root,
+)
+from markdown_chunker import SectionMode, estimate_tokens
+from record_builder import (
+    FileChunks,
+    FileTask,
+    RecordProducer,
+    chunk_file,
+    create_records,
+    get_key_of_record,
+    get_record_key,
+)
+from record_purger import (
+    MAX_DELETE_FILES,
+    MAX_DELETE_VALUES,
+    RecordPurger,
+    get_file_filter,
+)
+from record_uploader import BATCH_SIZE, RecordUploader
+from run_journal import JournalEntry, RunJournal
+from run_metrics import RunMetrics
+from tracked_file_handler import HashAlgorithm, TrackedFileHandler
+from vector_store import (
+    StoreType,
+    VectorStore,
+    create_pinecone_client,
+    get_local_store_path,
+    open_vector_store,
+)
+
+ChangeDetection = Literal["stat", "git", "git-diff"]
+
+TESTING_NAME = "testing-index"
+
+
+class RebuildError(Exception):
+    pass
+
+
+class FilePlan(TypedDict):
+    file: str
+    # all chunks of the file, only the new ones are uploaded as records
+    chunks: int
+    records: int
+    characters: int
+    # estimated tokens of the embedding model
+    tokens: int
+
+
+class RequestPlan(TypedDict):
+    upsert: int
+    update: int
+    delete: int
+
+
+class PlanTotals(TypedDict):
+    chunks: int
+    records: int
+    characters: int
+    tokens: int
+    requests: RequestPlan
 
 
-class ChunkMetadata(TypedDict):
-    filename: str
-    path: Path
-    type: Literal["section", "list"]
-    hash: str
+# `from` is a keyword, so the functional syntax is needed
+RenamePlan = TypedDict("RenamePlan", {"from": str, "to": str})
+
+
+# position in the list of all files, path, current hash and the path it was moved from
+ChangedFile = tuple[int, Path, str, str | None]
+
+
+class IndexPlan(TypedDict):
+    index: str
+    namespace: str
+    add: list[FilePlan]
+    update: list[FilePlan]
+    rename: list[RenamePlan]
+    delete: list[str]
+    unchanged: int
+    totals: PlanTotals
 
 
 class NotesIndexer:
@@ -39,153 +140,756 @@ class NotesIndexer:
     This class is used to index my notes by creating vectors in a vector database.
     """
 
-    def __init__(self, notes_path: str, testing=False):
+    def __init__(
+        self,
+        notes_path: str,
+        testing=False,
+        checkpoint_interval: int = 0,
+        change_detection: ChangeDetection = "stat",
+        hash_algorithm: HashAlgorithm = "sha256",
+        section_mode: SectionMode = "nested",
+        max_tokens: int | None = MAX_CHUNK_TOKENS,
+        upload_workers: int = UPLOAD_WORKERS,
+        chunk_workers: int = CHUNK_WORKERS,
+        store: StoreType = "pinecone",
+        embedder: EmbedderType = "pinecone",
+        embedding_cache: bool = True,
+        rebuild: bool = False,
+        offline: bool = False,
+        metrics: RunMetrics | None = None,
+        quiet: bool = False,
+    ):
+        # stat: hash files (cached via stat), git: use git blob ids, git-diff: only check files changed since last run
+        self.change_detection = change_detection
+        self.section_mode: SectionMode = section_mode
+        self.max_tokens = max_tokens
+        self.upload_workers = upload_workers
+        self.chunk_workers = chunk_workers
+        self.metrics = metrics or RunMetrics()
+        # without the progress of every record and skipped file, printing them adds up for many files
+        self.quiet = quiet
+
         # to allow running in both the rag and the notes repo, keep track of the root of both
-        self.rag_repo_root = subprocess.check_output(
-            ["git", "rev-parse", "--show-toplevel"],
-            text=True,
-        ).strip()
+        self.rag_repo_root = RAG_REPO_ROOT
 
         # move to the root of the git repo which was passed, even if moved to a subfolder (notes repo)
-        # via git we will go to the root of it
-        os.chdir(notes_path)
-        self.notes_repo_root = subprocess.check_output(
-            ["git", "rev-parse", "--show-toplevel"],
-            text=True,
-        ).strip()
+        self.notes_repo_root = get_repo_root(notes_path)
         os.chdir(self.notes_repo_root)
 
-        testing_name = "testing-index"
-        self.index_name = INDEX_NAME if not testing else testing_name
+        self.index_name = INDEX_NAME if not testing else TESTING_NAME
         self.tracked_files_path = (
             f"{self.rag_repo_root}/{TRACKED_FILE}"
             if not testing
-            else f"{self.rag_repo_root}/{testing_name}.txt"
+            else f"{self.rag_repo_root}/{TESTING_NAME}.txt"
+        )
+
+        if store == "local":
+            # the local store is tracked on its own, next to its vectors (of the embedding model)
+            self.tracked_files_path = os.path.join(
+                get_local_store_path(self.index_name, get_embedder_model(embedder)),
+                "tracked_files.txt",
+            )
+            os.makedirs(os.path.dirname(self.tracked_files_path), exist_ok=True)
+
+        # a rebuild fills a fresh namespace, while the active one is still queried
+        self.rebuild = rebuild
+        self.active_target_path = get_active_target_path(
+            store, self.index_name, get_embedder_model(embedder)
+        )
+        # an incomplete rebuild is resumed, instead of leaving it behind and starting another one
+        self.namespace = (
+            get_rebuild_namespace(
+                self.active_target_path, f"rebuild-{datetime.now():%Y%m%d-%H%M%S}"
+            )
+            if rebuild
+            else load_active_target(self.active_target_path)["namespace"]
+        )
+        # every namespace is tracked on its own
+        self.base_tracked_files_path = self.tracked_files_path
+        self.tracked_files_path = get_namespace_file(
+            self.base_tracked_files_path, self.namespace
         )
 
-        if not IN_CI:
+        # a plan is computed offline, without any client or confirmation
+        if not offline and not IN_CI:
             self.confirm_execution()
+            # waiting for the answer is not part of the run (e.g. its seconds and rates)
+            self.metrics.start = time.perf_counter()
+        # only a confirmed rebuild is resumed later on, not a cancelled or planned one
+        if rebuild and not offline:
+            start_rebuild(self.active_target_path, self.namespace)
 
-        self.pc = Pinecone(api_key=PINECONE_API_KEY)
-        if not self.pc.has_index(self.index_name):
-            print(
-                f"\n{MAGENTA}Creating{RESET} index{RESET} - {CYAN}{self.index_name}{RESET}"
-            )
-            self.pc.create_index_for_model(
-                name=self.index_name,
-                cloud=CloudProvider.AWS,
-                region=AwsRegion.US_EAST_1,
-                embed=IndexEmbed(
-                    model=EmbedModel.Multilingual_E5_Large,
-                    metric="cosine",
-                    field_map={"text": "text"},
-                ),
-            )
-            time.sleep(1)
-
-        self.index = self.pc.Index(self.index_name)
-        self.f_handler = TrackedFileHandler(self.tracked_files_path)
-
-    def process_markdown_file(self, file_path: Path) -> None:
-        # hash will be used to delete old vectors when notes are updated
-        file_hash = self.f_handler.get_file_hash(str(file_path))
-
-        with open(file_path, "r", encoding="utf-8") as file:
-            markdown = file.read()
-
-        metadata: ChunkMetadata = {
-            "filename": file_path.name,
-            "path": file_path.parent,
-            "type": "section",
+        self.journal = RunJournal(self.tracked_files_path)
+        self.f_handler = TrackedFileHandler(
+            self.tracked_files_path,
+            checkpoint_interval=checkpoint_interval,
+            hash_algorithm=hash_algorithm,
+        )
+
+        # clients are only created once they are needed (e.g. not at all for runs without changes)
+        self.store: StoreType = store
+        self.embedder_type: EmbedderType = embedder
+        self.embedding_cache = embedding_cache
+        self._embedder: Embedder | None = None
+        self._index: VectorStore | None = None
+        self._purger: RecordPurger | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._index is not None
+
+    def connect(self) -> None:
+        """Connect to the embedding model and the db, once the first request needs them"""
+        if self.connected:
+            return
+
+        with self.metrics.stage("connect"):
+            pc = create_pinecone_client(self.store, self.embedder_type)
+            self._embedder = create_embedder(
+                self.embedder_type,
+                pc,
+                cache_path=EMBEDDING_CACHE_PATH if self.embedding_cache else None,
+                cache_size=EMBEDDING_CACHE_SIZE,
+            )
+            self._index = open_vector_store(
+                self.store,
+                self.index_name,
+                self._embedder,
+                pc,
+                create=True,
+                state=ClientState(),
+            )
+            self._purger = RecordPurger(
+                self._index, self.namespace, metrics=self.metrics
+            )
+
+    @property
+    def embedder(self) -> Embedder:
+        self.connect()
+        assert self._embedder is not None
+        return self._embedder
+
+    @property
+    def index(self) -> VectorStore:
+        self.connect()
+        assert self._index is not None
+        return self._index
+
+    @property
+    def purger(self) -> RecordPurger:
+        self.connect()
+        assert self._purger is not None
+        return self._purger
+
+    def process_markdown_file(
+        self,
+        file_path: Path,
+        file_hash: str,
+        existing_ids: list[str] | None = None,
+        used_keys: set[str] | None = None,
+    ) -> tuple[list[dict], list[str]]:
+        """
+        Chunk the file and create the records of all chunks that do not exist yet.
+
+        Returns the records that need to be uploaded and the ids of all records of the file.
+        """
+        file_chunks = chunk_file(
+            self.create_file_task(
+                file_path,
+                file_hash,
+                existing_ids,
+                self.get_record_keys() if used_keys is None else used_keys,
+            ),
+            self.section_mode,
+            self.max_tokens,
+        )
+        return self.use_chunks(file_chunks, existing_ids)
+
+    def get_record_keys(self) -> set[str]:
+        """Keys of the records of all tracked files, see `get_record_key`"""
+        return {
+            get_key_of_record(ids[0])
+            for ids in self.f_handler.chunk_ids.values()
+            if ids
+        }
+
+    def create_file_task(
+        self,
+        file_path: Path,
+        file_hash: str,
+        existing_ids: list[str] | None,
+        used_keys: set[str],
+    ) -> FileTask:
+        """Task to chunk the file, its record key is added to the used ones"""
+        key = get_record_key(str(file_path), existing_ids, used_keys)
+        used_keys.add(key)
+
+        return {
+            "file": str(file_path),
             "hash": file_hash,
+            "key": key,
+            "existing_ids": existing_ids,
         }
 
-        print(f"{GREY}Splitting markdown by sections{RESET}")
-        chunked_markdown = chunk_markdown_by_heading(markdown)
-        records = self.create_records(chunked_markdown, metadata)
-
-        print(f"{GREY}Splitting markdown by lists{RESET}")
-        chunked_lists = chunk_markdown_by_list(markdown)
-
-        # overwrite the metadata type to list, as we want to upload both sections and lists
-        metadata["type"] = "list"
-        records.extend(self.create_records(chunked_lists, metadata))
-
-        if records:
-            print(f"{YELLOW}Uploading {GREEN}{len(records)}{RESET} records")
-            # Pinecone has a max batch size of 96, so we need to split records into batches
-            batch_size = 96
-            for i in range(0, len(records), batch_size):
-                batch = records[i : i + batch_size]
-                batch_num = i // batch_size + 1
-                total_batches = (len(records) + batch_size - 1) // batch_size
-                if total_batches > 1:
-                    print(
-                        f"{GREY}Uploading batch {batch_num}/{total_batches} ({len(batch)} records){RESET}"
-                    )
-                self.index.upsert_records(namespace=INDEX_NAMESPACE, records=batch)
+    def use_chunks(
+        self, file_chunks: FileChunks, existing_ids: list[str] | None
+    ) -> tuple[list[dict], list[str]]:
+        """Records and all record ids of a chunked file (chunked in this or another process)"""
+        for stage, seconds in file_chunks["timings"].items():
+            self.metrics.add_time(stage, seconds)
+        self.metrics.count("files")
+        self.metrics.count("bytes", file_chunks["bytes"])
+
+        if self.section_mode == "flat":
+            print(
+                f"{GREY}Saved {file_chunks['savings']['characters']} characters and {file_chunks['savings']['records']} records compared to nested sections{RESET}"
+            )
 
-    def create_records(
-        self, chunks: list[str], metadata_base: ChunkMetadata
-    ) -> list[dict]:
-        records = []
-        for i, chunk in enumerate(chunks):
+        records = create_records(file_chunks)
+        if not self.quiet:
             print(
-                f"{YELLOW}Create {GREEN}{i + 1}/{len(chunks)}{RESET} records", end="\r"
+                f"{YELLOW}Created {GREEN}{len(file_chunks['chunk_ids'])}{RESET} records from sections and lists"
+            )
+        if existing_ids:
+            print(
+                f"{GREY}Keeping {len(file_chunks['chunk_ids']) - len(records)} unchanged records{RESET}"
             )
 
-            record = {
-                "id": str(uuid.uuid4()),
-                "text": chunk,
-                "filename": metadata_base["filename"],
-                "path": str(metadata_base["path"]),
-                "type": metadata_base["type"],
-                "hash": metadata_base["hash"],
+        return records, file_chunks["chunk_ids"]
+
+    def finish_file(
+        self,
+        file_path: Path,
+        file_hash: str,
+        blob: str | None,
+        old_chunk_ids: list[str] | None,
+        chunk_ids: list[str],
+    ) -> None:
+        """Track a file whose records are uploaded and purge its old records"""
+        print(
+            f"{GREEN}Finished{RESET} upload of {CYAN}{file_path}{RESET} and {GREEN}Track{RESET} it"
+        )
+        # only the chunks that vanished need to be deleted (or all of the old version without chunk ids)
+        self.apply_operation(
+            {
+                "op": "upload",
+                "state": "done",
+                "file": str(file_path),
+                "hash": file_hash,
+                "blob": blob,
+                "chunk_ids": chunk_ids,
+                "purge_ids": sorted(set(old_chunk_ids).difference(chunk_ids))
+                if old_chunk_ids is not None
+                else None,
+                "purge_hash": self.f_handler.index.get(str(file_path)),
             }
+        )
 
-            records.append(record)
+    def apply_operation(self, entry: JournalEntry, resumed: bool = False) -> None:
+        """
+        Apply a done operation to the tracked files and queue its stale records for purging.
 
-        # go to next line, to not overwrite the creating records line
-        print()
+        It is written to the journal first, so an interrupted run can apply it later on (`resumed`).
+        """
+        if not resumed:
+            self.journal.append(entry)
 
-        return records
+        file = entry["file"]
+        if entry["op"] == "upload":
+            if os.path.exists(file):
+                self.f_handler.upsert_tracked_file(file, entry["hash"])
+                self.f_handler.set_chunk_ids(file, entry["chunk_ids"])
+            else:
+                # deleted before the interrupted run was resumed, its new records are stale already
+                self.purge_records(record_ids=entry["chunk_ids"])
+        elif entry["op"] == "move":
+            # when resumed, the tracked files might already contain the move (checkpoint)
+            if entry["old_file"] in self.f_handler.index:
+                self.f_handler.rename_tracked_file(entry["old_file"], file)
+        elif entry["op"] == "delete" and file in self.f_handler.index:
+            self.f_handler.delete_tracked_file(file)
 
-    def run(self) -> None:
-        print(f"\n{GREEN}Starting creation/uploading of new vectors for notes{RESET}\n")
+        if entry.get("blob"):
+            self.f_handler.track_blob(file, entry["blob"])
 
-        # use git ls-files to get all files in the repo, to avoid ignored files like node_modules etc.
-        tracked_files = subprocess.check_output(
-            ["git", "ls-files"],
-            text=True,
-        ).splitlines()
+        # the replaced version always had the path of the operation (e.g. the target of a move)
+        self.purge_records(file, entry.get("purge_hash"), entry.get("purge_ids"))
 
-        files = [Path(f) for f in tracked_files if f.endswith(".md")]
+    def purge_records(
+        self,
+        file: str | None = None,
+        file_hash: str | None = None,
+        record_ids: list[str] | None = None,
+    ) -> None:
+        """
+        Queue records for deletion by their ids, or all records of a file version via its hash and path
+        (for records that were created before ids were derived from their content).
 
-        for i, file_path in enumerate(files):
-            if self.f_handler.should_skip(str(file_path)):
-                # skip because the file and its content has already been processed
-                print(f"{GREY}Skipping: {file_path}{RESET}")
-                continue
+        They are deleted in bulk at the end of the run, see `RecordPurger`.
+        """
+        self.purger.add(file, file_hash, record_ids)
 
-            # add a new line for visual separation and overview of progression
+    def move_records(
+        self,
+        old_file: Path,
+        new_file: Path,
+        file_hash: str,
+        record_ids: list[str] | None = None,
+    ) -> None:
+        """Update the path metadata of all records of a file, without embedding them again"""
+        if record_ids is None:
+            # records can only be listed via a query, as everything is filtered any non zero vector works
+            # the path is part of the filter, as other files with the same content share the hash
+            with self.metrics.request("query"):
+                matches = self.index.query(
+                    namespace=self.namespace,
+                    vector=[1.0] * self.index.dimension,
+                    top_k=10_000,
+                    filter=get_file_filter(file_hash, old_file),
+                )
+            record_ids = [match["id"] for match in matches]
+
+        for i, record_id in enumerate(record_ids):
+            if not self.quiet:
+                print(
+                    f"{YELLOW}Update {GREEN}{i + 1}/{len(record_ids)}{RESET} records",
+                    end="\r",
+                )
+            with self.metrics.request("update"):
+                self.index.update(
+                    id=record_id,
+                    set_metadata={
+                        "filename": new_file.name,
+                        "path": str(new_file.parent),
+                    },
+                    namespace=self.namespace,
+                )
+
+        # go to next line, to not overwrite the updating records line
+        if not self.quiet:
+            print()
+
+    def run(self, only: list[str] | None = None) -> None:
+        """Index all changed files, or only the given ones (deleted and moved files are always handled)"""
+        self.resume_journal()
+        try:
+            self.index_files(only)
+        finally:
+            self.save()
+
+        # the tracked files are saved and all stale records purged, nothing is left to resume
+        self.journal.clear()
+
+        if self.rebuild:
+            self.activate_rebuild()
+
+    def save(self) -> None:
+        try:
+            # records of finished files are stale, even if the run was interrupted
+            if self.connected:
+                self.purger.purge()
+            else:
+                # nothing could have been collected without a connection
+                print(f"{GREY}No old files to purge in db{RESET}")
+        finally:
+            # persist the tracking once per run (and on interruptions) instead of once per file
+            print(f"{GREEN}Save{RESET} current tracking locally")
+            self.f_handler.flush()
+            if self.connected:
+                # e.g. cached query results are stale now
+                bump_index_version(self.active_target_path)
+
+    def watch(
+        self,
+        debounce: float = WATCH_DEBOUNCE,
+        poll: bool = False,
+        poll_interval: float = WATCH_POLL_INTERVAL,
+    ) -> None:
+        """
+        Index files as soon as they are saved, until interrupted.
+
+        The clients, the embedding cache and the tracked files stay in memory between runs,
+        the tracked files are saved after every run.
+        """
+        # only needed when watching
+        from file_watcher import create_watcher, watch_changes
+
+        watcher = create_watcher(
+            self.notes_repo_root, poll=poll, poll_interval=poll_interval
+        )
+        try:
+            # catch up with the changes since the last run first
+            self.run()
+
+            print(
+                f"\n{MAGENTA}Watching{RESET} {CYAN}{self.notes_repo_root}{RESET} for changes ({watcher.name}), stop with Ctrl+C"
+            )
+            rescan = False
+            for changes in watch_changes(watcher, debounce):
+                files = None if rescan or changes is None else sorted(changes)
+                print(
+                    f"\n{MAGENTA}Changed{RESET} {'all files' if files is None else ', '.join(files)}"
+                )
+                try:
+                    self.run(files)
+                    rescan = False
+                except Exception as error:
+                    # e.g. network errors, keep watching and check all files with the next change
+                    print(f"{RED}ERROR:{RESET} Indexing failed: {error}")
+                    rescan = True
+        finally:
+            watcher.close()
+
+    def resume_journal(self) -> None:
+        """Apply the done operations of an interrupted run, unfinished ones are simply redone by this run"""
+        entries = self.journal.load()
+        if not entries:
+            return
+
+        done = [e for e in entries if e["state"] == "done"]
+        finished = {(e["op"], e["file"]) for e in done}
+        unfinished = [
+            e
+            for e in entries
+            if e["state"] == "planned" and (e["op"], e["file"]) not in finished
+        ]
+        print(
+            f"\n{MAGENTA}Resume{RESET} interrupted run: {GREEN}{len(done)}{RESET} done operations are applied, "
+            + f"{YELLOW}{len(unfinished)}{RESET} unfinished ones are redone"
+        )
+
+        for entry in done:
+            self.apply_operation(entry, resumed=True)
+
+        self.save()
+        self.journal.clear()
+
+    def repair(self) -> None:
+        """
+        Reconcile the tracked files with the records in the db, without indexing.
+
+        Tracked files with missing records are untracked (the next run uploads them again)
+        and records that belong to no tracked file (version) are deleted.
+        """
+        self.resume_journal()
+        print(
+            f"\n{GREEN}Repair{RESET} tracked files of namespace {CYAN}{self.namespace}{RESET}"
+        )
+
+        store_ids = set(self.index.list_ids(self.namespace))
+        tracked_ids = {id for ids in self.f_handler.chunk_ids.values() for id in ids}
+
+        def get_version(metadata: dict) -> tuple:
+            return (
+                metadata.get("hash"),
+                metadata.get("filename"),
+                metadata.get("path"),
+            )
+
+        # files without chunk ids own the records of their hash and path (other files can share the hash)
+        tracked_versions = {
+            get_version(get_file_filter(file_hash, file))
+            for file, file_hash in self.f_handler.index.items()
+            if self.f_handler.get_chunk_ids(file) is None
+        }
+
+        # records unknown to the tracked files: stale versions or records without derived ids
+        unknown_records = self.index.fetch_metadata(
+            self.namespace, sorted(store_ids.difference(tracked_ids))
+        )
+        unknown_versions = {get_version(m) for m in unknown_records.values()}
+
+        untracked_files = 0
+        for file, file_hash in list(self.f_handler.index.items()):
+            chunk_ids = self.f_handler.get_chunk_ids(file)
+            complete = (
+                store_ids.issuperset(chunk_ids)
+                if chunk_ids is not None
+                else get_version(get_file_filter(file_hash, file)) in unknown_versions
+            )
+            if not complete:
+                print(
+                    f"{YELLOW}Untrack{RESET} {CYAN}{file}{RESET}, its records are missing in the db"
+                )
+                self.f_handler.delete_tracked_file(file)
+                untracked_files += 1
+
+        orphaned_ids = sorted(
+            id
+            for id, metadata in unknown_records.items()
+            if get_version(metadata) not in tracked_versions
+        )
+        self.purge_records(record_ids=orphaned_ids)
+        self.save()
+
+        print(
+            f"\n{GREEN}Repaired{RESET}: {YELLOW}{untracked_files}{RESET} files untracked, "
+            + f"{RED}{len(orphaned_ids)}{RESET} orphaned records deleted"
+        )
+
+    def activate_rebuild(self, attempts: int = 10) -> None:
+        """Switch queries over to the rebuilt namespace, once the store has all of its records"""
+        expected_count = len(
+            {id for ids in self.f_handler.chunk_ids.values() for id in ids}
+        )
+
+        count = self.index.count(self.namespace)
+        for _ in range(attempts):
+            if count == expected_count:
+                break
+
+            # pinecone updates its stats with a delay
             print(
-                f"\n{MAGENTA}Working{RESET} on file {GREEN}{i + 1}/{len(files)}{RESET} - {CYAN}{file_path}{RESET}"
+                f"{GREY}Namespace has {count}/{expected_count} records, waiting for the db{RESET}"
             )
-            self.process_markdown_file(file_path)
+            time.sleep(2)
+            count = self.index.count(self.namespace)
+
+        if count != expected_count:
+            raise RebuildError(
+                f"Namespace {self.namespace} has {count} records instead of {expected_count}, keeping the active one (--rebuild resumes it)"
+            )
+
+        dropped = load_active_target(self.active_target_path)["previous"]
+        target = switch_active_target(self.active_target_path, self.namespace)
+        print(
+            f"\n{GREEN}Switched{RESET} to namespace {CYAN}{target['namespace']}{RESET}, "
+            + f"the previous one {CYAN}{target['previous']}{RESET} is kept for a rollback (--rollback)"
+        )
 
-            # keep track of the file and its hash to skip it on future runs
+        # only one namespace is kept for a rollback, the one before it would be left behind
+        if dropped and dropped not in {target["namespace"], target["previous"]}:
+            self.delete_namespace(dropped)
+
+    def delete_namespace(self, namespace: str) -> None:
+        """Delete all records of a namespace and its tracking files"""
+        print(
+            f"{RED}Delete{RESET} namespace {CYAN}{namespace}{RESET}, it is not kept for a rollback anymore"
+        )
+        with self.metrics.request("delete"):
+            self.index.delete_namespace(namespace)
+
+        tracked_files_path = get_namespace_file(self.base_tracked_files_path, namespace)
+        for path in [
+            *TrackedFileHandler.get_files(tracked_files_path),
+            RunJournal(tracked_files_path).path,
+        ]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def report_metrics(self, path: str | None = None) -> None:
+        """Print the timings of the run, the full summary is written as json to `path` (`-` for stdout)"""
+        summary = self.metrics.summary()
+        self.metrics.close()
+
+        stages = ", ".join(
+            f"{name} {stage['seconds']}s" for name, stage in summary["stages"].items()
+        )
+        rates = ", ".join(f"{value} {name}" for name, value in summary["rates"].items())
+        print(
+            f"\n{GREY}Took {summary['seconds']}s ({stages or 'no stages'}), {rates or 'nothing indexed'}{RESET}"
+        )
+        for kind, request in summary["requests"].items():
             print(
-                f"{GREEN}Finished{RESET} work on file and {GREEN}Save{RESET} current tracking locally"
+                f"{GREY}{request['count']} {kind} requests, p50 {request['p50']}s, p90 {request['p90']}s, p99 {request['p99']}s{RESET}"
             )
-            old_tracked_file = self.f_handler.upsert_tracked_file(str(file_path))
-            if old_tracked_file:
-                print(f"{RED}Purge{RESET} old index in db")
-                self.index.delete(
-                    namespace=INDEX_NAMESPACE, filter={"hash": old_tracked_file}
+
+        if path == "-":
+            print(json.dumps(summary, indent=2))
+        elif path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(summary, indent=2) + "\n")
+
+    def list_markdown_files(self) -> tuple[list[Path], dict[str, str]]:
+        """
+        Markdown files that need to be checked for changes, and their git blob ids
+        (only in git change detection modes and only for files without uncommitted changes).
+        """
+        if self.change_detection == "stat":
+            # use git ls-files to get all files in the repo, to avoid ignored files like node_modules etc.
+            tracked_files = subprocess.check_output(
+                ["git", "ls-files"],
+                text=True,
+            ).splitlines()
+
+            return [Path(f) for f in tracked_files if f.endswith(".md")], {}
+
+        blobs = {f: blob for f, blob in get_blob_ids().items() if f.endswith(".md")}
+        files = list(blobs)
+
+        # blob ids in the git index do not reflect uncommitted changes, these files need to be hashed
+        modified_files = get_modified_files()
+        for file in modified_files:
+            blobs.pop(file, None)
+
+        if self.change_detection == "git-diff" and self.f_handler.last_commit:
+            changed_files = get_changed_files_since(self.f_handler.last_commit)
+            if changed_files is None:
+                print(
+                    f"{YELLOW}WARNING:{RESET} Last indexed commit {CYAN}{self.f_handler.last_commit}{RESET} is unknown, checking all files"
                 )
+            else:
+                candidates = modified_files.union(changed_files)
+                files = [f for f in files if f in candidates]
 
-            # more visual separation (in case of many skipped files)
-            print()
+        return [Path(f) for f in files], blobs
+
+    def collect_files(
+        self, only: list[str] | None = None
+    ) -> tuple[list[Path], dict[str, str], dict[str, str], dict[str, str]]:
+        """Files to check with their blob ids and (current) hashes, and vanished files by hash"""
+        with self.metrics.stage("git"):
+            if only is None:
+                files, blobs = self.list_markdown_files()
+            else:
+                # e.g. saved files in watch mode, new notes are indexed before they are committed
+                indexable_files = get_indexable_files(only)
+                files, blobs = (
+                    [Path(f) for f in indexable_files if f.endswith(".md")],
+                    {},
+                )
+
+        # files that vanished, but whose content might show up under a new path
+        renamed_candidates = self.f_handler.get_dangling_files_by_hash()
+
+        # check if file exists (in case its not yet committed etc.)
+        # and unchanged blob ids mean unchanged content, no need to read the file at all
+        files_to_hash = [
+            str(f)
+            for f in files
+            if f.exists()
+            and not self.f_handler.is_tracked_blob(str(f), blobs.get(str(f), ""))
+        ]
+
+        # hash once per run and concurrently (unchanged files are served from the stat cache)
+        print(f"{GREY}Hashing {len(files_to_hash)} files{RESET}")
+        with self.metrics.stage("hashing"):
+            hashes = self.f_handler.get_current_hashes(files_to_hash)
+
+        return files, blobs, hashes, renamed_candidates
+
+    def plan(self) -> IndexPlan:
+        """Changes the next run would make, computed offline without the db or embedding anything"""
+        files, _, hashes, renamed_candidates = self.collect_files()
+
+        plan: IndexPlan = {
+            "index": self.index_name,
+            "namespace": self.namespace,
+            "add": [],
+            "update": [],
+            "rename": [],
+            "delete": [],
+            "unchanged": 0,
+            "totals": {
+                "chunks": 0,
+                "records": 0,
+                "characters": 0,
+                "tokens": 0,
+                "requests": {"upsert": 0, "update": 0, "delete": 0},
+            },
+        }
+        totals = plan["totals"]
+        purge_ids = 0
+        purge_files = 0
+        used_keys = self.get_record_keys()
+
+        for file_path in files:
+            file_hash = hashes.get(str(file_path))
+            if file_hash is None or self.f_handler.should_skip(
+                str(file_path), file_hash
+            ):
+                plan["unchanged"] += 1
+                continue
+
+            file_hash = self.f_handler.get_current_hash(
+                str(file_path), self.f_handler.hash_algorithm
+            )
+            renamed = self.f_handler.pop_renamed_file(
+                str(file_path), renamed_candidates
+            )
+            if renamed:
+                old_file = renamed[0]
+                plan["rename"].append({"from": old_file, "to": str(file_path)})
+                # one update per record, records without known ids need a query to be listed first
+                old_chunk_ids = self.f_handler.get_chunk_ids(old_file)
+                totals["requests"]["update"] += (
+                    len(old_chunk_ids) if old_chunk_ids is not None else 1
+                )
+                continue
+
+            old_chunk_ids = self.f_handler.get_chunk_ids(str(file_path))
+            records, chunk_ids = self.process_markdown_file(
+                file_path, file_hash, old_chunk_ids, used_keys
+            )
+            file_plan: FilePlan = {
+                "file": str(file_path),
+                "chunks": len(chunk_ids),
+                "records": len(records),
+                "characters": sum(len(r["text"]) for r in records),
+                "tokens": sum(estimate_tokens(r["text"]) for r in records),
+            }
+            for key in ["chunks", "records", "characters", "tokens"]:
+                totals[key] += file_plan[key]
+
+            if str(file_path) in self.f_handler.index:
+                plan["update"].append(file_plan)
+                if old_chunk_ids is not None:
+                    purge_ids += len(set(old_chunk_ids).difference(chunk_ids))
+                else:
+                    purge_files += 1
+            else:
+                plan["add"].append(file_plan)
+
+        renamed_files = {rename["from"] for rename in plan["rename"]}
+        for file in self.f_handler.get_dangling_files():
+            if file in renamed_files:
+                continue
+
+            plan["delete"].append(file)
+            chunk_ids = self.f_handler.get_chunk_ids(file)
+            if chunk_ids is not None:
+                purge_ids += len(chunk_ids)
+            else:
+                purge_files += 1
+
+        # records of multiple files are packed into batches, deletes are done in bulk
+        totals["requests"]["upsert"] = math.ceil(totals["records"] / BATCH_SIZE)
+        totals["requests"]["delete"] = math.ceil(
+            purge_ids / MAX_DELETE_VALUES
+        ) + math.ceil(purge_files / MAX_DELETE_FILES)
+
+        return plan
+
+    def index_files(self, only: list[str] | None = None) -> None:
+        print(f"\n{GREEN}Starting creation/uploading of new vectors for notes{RESET}\n")
+
+        # only a run over all files indexed everything up to the commit
+        head_commit = (
+            get_head_commit()
+            if self.change_detection != "stat" and only is None
+            else None
+        )
+        files, blobs, hashes, renamed_candidates = self.collect_files(only)
+        changed_files = self.find_changed_files(
+            files, blobs, hashes, renamed_candidates
+        )
+
+        # without changes there is no need to connect to the db at all
+        if changed_files:
+            uploader = RecordUploader(
+                self.index,
+                self.namespace,
+                workers=self.upload_workers,
+                metrics=self.metrics,
+            )
+            try:
+                self.index_changed_files(changed_files, len(files), blobs, uploader)
+            except BaseException:
+                uploader.abort()
+                raise
+
+            # files are only tracked once all their records are uploaded
+            uploader.close()
 
         # check if we have references to dangling files that need to be deleted
         dangling_files = self.f_handler.get_dangling_files()
@@ -194,27 +898,194 @@ class NotesIndexer:
                 f"\n{MAGENTA}Found{RESET} Dangling files, start {RED}Deleting{RESET} them"
             )
             for file in dangling_files:
-                old_tracked_file = self.f_handler.delete_tracked_file(file)
+                chunk_ids = self.f_handler.get_chunk_ids(file)
+                old_tracked_file = self.f_handler.index.get(file)
                 print(f"{RED}Deleting: {CYAN}{file}{RESET}")
-                if old_tracked_file:
-                    print(f"{RED}Purge{RESET} old index in db")
-                    self.index.delete(
-                        namespace=INDEX_NAMESPACE, filter={"hash": old_tracked_file}
-                    )
-                else:
+                self.apply_operation(
+                    {
+                        "op": "delete",
+                        "state": "done",
+                        "file": file,
+                        "purge_ids": chunk_ids,
+                        "purge_hash": old_tracked_file,
+                    }
+                )
+                if chunk_ids is None and not old_tracked_file:
                     print(
                         f"{RED}WARNING:{RESET} Deleted {CYAN}{file}{RESET} but {YELLOW}Ignored{RESET} index in db"
                     )
 
+        if self.connected:
+            from embedding_cache import CachedEmbedder
+
+            if isinstance(self.embedder, CachedEmbedder):
+                print(
+                    f"{GREY}Embedding cache: {self.embedder.hits} hits, {self.embedder.misses} misses{RESET}"
+                )
+
+        # remember until where we indexed, to only check newer changes in the next run
+        if head_commit:
+            self.f_handler.set_last_commit(head_commit)
+
         # check tracked files and delete non existing files
         print(f"\n{GREEN}Finished script{RESET}")
 
+    def find_changed_files(
+        self,
+        files: list[Path],
+        blobs: dict[str, str],
+        hashes: dict[str, str],
+        renamed_candidates: dict[str, str],
+    ) -> list[ChangedFile]:
+        """
+        Changed files with their position, current hash and the file it was moved from (if only moved).
+
+        All of them are found first, so the files to upload can be chunked ahead of the uploads.
+        """
+        changed_files: list[ChangedFile] = []
+        for i, file_path in enumerate(files):
+            blob = blobs.get(str(file_path))
+            file_hash = hashes.get(str(file_path))
+            if file_hash is None or self.f_handler.should_skip(
+                str(file_path), file_hash
+            ):
+                # skip because the file and its content has already been processed
+                if not self.quiet:
+                    print(f"{GREY}Skipping: {file_path}{RESET}")
+                if file_hash and blob:
+                    self.f_handler.track_blob(str(file_path), blob)
+                continue
+
+            # changed files switch over to the configured hash algorithm
+            file_hash = self.f_handler.get_current_hash(
+                str(file_path), self.f_handler.hash_algorithm
+            )
+
+            # same content under a new path -> only the path changed, no need to embed it again
+            # moved files keep the hash of their records (which might use another algorithm)
+            renamed = self.f_handler.pop_renamed_file(
+                str(file_path), renamed_candidates
+            )
+            old_file = None
+            if renamed:
+                old_file, file_hash = renamed
+            changed_files.append((i, file_path, file_hash, old_file))
+
+        return changed_files
+
+    def index_changed_files(
+        self,
+        changed_files: list[ChangedFile],
+        file_count: int,
+        blobs: dict[str, str],
+        uploader: RecordUploader,
+    ) -> None:
+        # new files must not reuse the record keys of other files (e.g. moved away from their path)
+        used_keys = self.get_record_keys()
+        tasks = [
+            self.create_file_task(
+                file_path,
+                file_hash,
+                self.f_handler.get_chunk_ids(str(file_path)),
+                used_keys,
+            )
+            for _, file_path, file_hash, old_file in changed_files
+            if not old_file
+        ]
+        # starting processes only pays off for many files (e.g. rebuilds)
+        producer = RecordProducer(
+            self.section_mode,
+            self.max_tokens,
+            workers=self.chunk_workers if len(tasks) >= CHUNK_WORKERS_MIN_FILES else 1,
+        )
+
+        with closing(producer.map(tasks)) as chunked_files:
+            for i, file_path, file_hash, old_file in changed_files:
+                blob = blobs.get(str(file_path))
+                if old_file:
+                    self.move_file(Path(old_file), file_path, file_hash, blob)
+                    continue
+
+                # add a new line for visual separation and overview of progression
+                print(
+                    f"\n{MAGENTA}Working{RESET} on file {GREEN}{i + 1}/{file_count}{RESET} - {CYAN}{file_path}{RESET}"
+                )
+                old_chunk_ids = self.f_handler.get_chunk_ids(str(file_path))
+                records, chunk_ids = self.use_chunks(next(chunked_files), old_chunk_ids)
+
+                # keep track of the file and its hash to skip it on future runs, once it is uploaded
+                self.metrics.event(
+                    "file",
+                    file=str(file_path),
+                    chunks=len(chunk_ids),
+                    records=len(records),
+                )
+                print(f"{YELLOW}Queue {GREEN}{len(records)}{RESET} records for upload")
+                self.journal.append(
+                    {
+                        "op": "upload",
+                        "state": "planned",
+                        "file": str(file_path),
+                        "hash": file_hash,
+                    }
+                )
+                uploader.add(
+                    str(file_path),
+                    records,
+                    on_done=partial(
+                        self.finish_file,
+                        file_path,
+                        file_hash,
+                        blob,
+                        old_chunk_ids,
+                        chunk_ids,
+                    ),
+                )
+
+                # more visual separation (in case of many skipped files)
+                print()
+
+    def move_file(
+        self, old_file: Path, file_path: Path, file_hash: str, blob: str | None
+    ) -> None:
+        print(
+            f"\n{MAGENTA}Moving{RESET} file {CYAN}{old_file}{RESET} to {CYAN}{file_path}{RESET}"
+        )
+        self.journal.append(
+            {
+                "op": "move",
+                "state": "planned",
+                "file": str(file_path),
+                "old_file": str(old_file),
+            }
+        )
+        self.move_records(
+            old_file,
+            file_path,
+            file_hash,
+            self.f_handler.get_chunk_ids(str(old_file)),
+        )
+        # records of a file that was replaced by the moved one are stale
+        self.apply_operation(
+            {
+                "op": "move",
+                "state": "done",
+                "file": str(file_path),
+                "old_file": str(old_file),
+                "blob": blob,
+                "purge_ids": self.f_handler.get_chunk_ids(str(file_path)),
+                "purge_hash": self.f_handler.index.get(str(file_path)),
+            }
+        )
+        print()
+
     def confirm_execution(self) -> None:
         answer = (
             input(
                 f"""
 This action might {RED}break{RESET} the current connected setup, check if you have the latest changes of this repo:
 DB INDEX:      {MAGENTA}{self.index_name}{RESET}
+NAMESPACE:     {MAGENTA}{self.namespace}{RESET}
 NOTES REPO:    {CYAN}{self.notes_repo_root}{RESET}
 RAG REPO:      {CYAN}{self.rag_repo_root}{RESET}
 TRACKED FILES: {GREY}{self.tracked_files_path}{RESET}
@@ -229,6 +1100,20 @@ Are you sure?{YELLOW} (y/N): {RESET}"""
             exit(1)
 
 
+def rollback(store: StoreType, index_name: str, model: str) -> None:
+    """Switch back to the previously active namespace, no indexing needed"""
+    path = get_active_target_path(store, index_name, model)
+    try:
+        target = rollback_active_target(path)
+    except ValueError as error:
+        print(f"{RED}ERROR:{RESET} {error}")
+        sys.exit(1)
+
+    print(
+        f"{GREEN}Switched{RESET} back to namespace {CYAN}{target['namespace']}{RESET} of {MAGENTA}{index_name}{RESET}"
+    )
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--prod", action="store_true", help="Run in production mode")
@@ -238,10 +1123,170 @@ def main() -> None:
         help="Path to the root of a git repo",
         default=os.path.expanduser("~/Documents/notes"),
     )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        help="Save tracked files after this many changes (0 = only at the end of the run)",
+        default=TRACKED_FILE_CHECKPOINT_INTERVAL,
+    )
+    parser.add_argument(
+        "--change-detection",
+        choices=["stat", "git", "git-diff"],
+        help="Detect changed files by hashing (stat), git blob ids (git) or blob ids of files changed since the last run (git-diff)",
+        default="stat",
+    )
+    parser.add_argument(
+        "--hash-algorithm",
+        choices=["sha256", "blake2b"],
+        help="Hash algorithm for new and changed files, existing entries keep their algorithm",
+        default="sha256",
+    )
+    parser.add_argument(
+        "--section-mode",
+        choices=["nested", "flat"],
+        help="Include child sections in their parents (nested) or only embed leaf sections and parent summaries (flat), changing it needs a fresh index",
+        default="nested",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        help="Split chunks that are estimated to exceed this many tokens of the embedding model (0 = no splitting)",
+        default=MAX_CHUNK_TOKENS,
+    )
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        help="Number of concurrent upload requests",
+        default=UPLOAD_WORKERS,
+    )
+    parser.add_argument(
+        "--chunk-workers",
+        type=int,
+        help=f"Number of processes that read and chunk files, when at least {CHUNK_WORKERS_MIN_FILES} files changed (1 = no extra processes)",
+        default=CHUNK_WORKERS,
+    )
+    parser.add_argument(
+        "--store",
+        choices=["pinecone", "local"],
+        help="Index into the pinecone index or a local store on disk",
+        default=VECTOR_STORE,
+    )
+    parser.add_argument(
+        "--embedder",
+        choices=["pinecone", "hashed"],
+        help="Embed via the pinecone api or locally via hashed n-grams (only with the local store, no network needed)",
+        default=EMBEDDER,
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Index all files into a fresh namespace and switch to it once it is complete, the active one is kept for a rollback",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help="Switch back to the namespace that was active before the last rebuild",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the changes of the next run as json, computed offline (no db connection, no confirmation)",
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="Reconcile the tracked files with the records in the db instead of indexing",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and index files as soon as they are saved",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        help="Seconds to wait for further changes before indexing in watch mode",
+        default=WATCH_DEBOUNCE,
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Check for changes by polling instead of inotify in watch mode (e.g. for network drives)",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        help="Write a json summary of the timings, rates and request latencies of the run to this file (- for stdout)",
+    )
+    parser.add_argument(
+        "--events",
+        type=str,
+        help="Append the processed files and requests of the run as json lines to this file",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Do not print the progress of every record and skipped file",
+    )
+    parser.add_argument(
+        "--no-embedding-cache",
+        action="store_true",
+        help="Do not reuse vectors of already embedded texts (only used when embedding via the pinecone api)",
+    )
 
     try:
         args = parser.parse_args()
-        NotesIndexer(testing=not args.prod, notes_path=args.root).run()
+        if args.store == "pinecone" and args.embedder != "pinecone":
+            parser.error(
+                "the pinecone index holds vectors of the pinecone model, use --store local"
+            )
+        if args.watch and (args.rebuild or args.plan or args.repair):
+            parser.error(
+                "--watch can not be combined with --rebuild, --plan or --repair"
+            )
+
+        if args.rollback:
+            rollback(
+                args.store,
+                INDEX_NAME if args.prod else TESTING_NAME,
+                get_embedder_model(args.embedder),
+            )
+            return
+
+        indexer = NotesIndexer(
+            testing=not args.prod,
+            notes_path=args.root,
+            checkpoint_interval=args.checkpoint_interval,
+            change_detection=args.change_detection,
+            hash_algorithm=args.hash_algorithm,
+            section_mode=args.section_mode,
+            max_tokens=args.max_tokens,
+            upload_workers=args.upload_workers,
+            chunk_workers=args.chunk_workers,
+            store=args.store,
+            embedder=args.embedder,
+            embedding_cache=not args.no_embedding_cache,
+            rebuild=args.rebuild,
+            offline=args.plan,
+            metrics=RunMetrics(args.events),
+            quiet=args.quiet,
+        )
+        if args.plan:
+            # only the plan is printed to stdout, to be used by other tools (e.g. jq)
+            with redirect_stdout(sys.stderr):
+                plan = indexer.plan()
+            print(json.dumps(plan, indent=2))
+        else:
+            try:
+                if args.repair:
+                    indexer.repair()
+                elif args.watch:
+                    indexer.watch(args.debounce, poll=args.poll)
+                else:
+                    indexer.run()
+            finally:
+                # also for failed runs, to see where they spent their time
+                indexer.report_metrics(args.metrics)
     except KeyboardInterrupt:
         print(f"\n{YELLOW}Operation cancelled{RESET}")
         sys.exit(1)
@@ -0,0 +1,372 @@
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+import ai_notes_indexer
+import vector_store
+from active_target import load_active_target
+from ai_notes_indexer import NotesIndexer, RebuildError
+from run_metrics import RunMetrics
+from tracked_file_handler import TrackedFileHandler
+
+
+def git(repo: Path, *args: str) -> None:
+    subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True)
+
+
+def write_note(repo: Path, file: str, content: str) -> None:
+    path = repo / file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+    git(repo, "add", file)
+
+
+def move_note(repo: Path, file: str, new_file: str) -> None:
+    (repo / new_file).parent.mkdir(parents=True, exist_ok=True)
+    git(repo, "mv", file, new_file)
+
+
+def delete_note(repo: Path, file: str) -> None:
+    git(repo, "rm", "-q", "--cached", file)
+    (repo / file).unlink()
+
+
+def create_indexer(repo: Path, **kwargs) -> NotesIndexer:
+    return NotesIndexer(
+        str(repo),
+        store="local",
+        embedder="hashed",
+        upload_workers=1,
+        chunk_workers=1,
+        quiet=True,
+        **kwargs,
+    )
+
+
+def get_store_ids(indexer: NotesIndexer) -> set[str]:
+    return set(indexer.index.list_ids(indexer.namespace))
+
+
+def get_tracked_ids(indexer: NotesIndexer) -> set[str]:
+    return {id for ids in indexer.f_handler.chunk_ids.values() for id in ids}
+
+
+@pytest.fixture
+def notes(tmp_path, monkeypatch) -> Path:
+    """Notes repo, indexed into a local store with the hashed embedder (all in the tmp folder)"""
+    repo = tmp_path / "notes"
+    repo.mkdir()
+    git(repo, "init", "-q")
+
+    monkeypatch.setattr(vector_store, "LOCAL_STORE_PATH", str(tmp_path / "store"))
+    # no confirmation
+    monkeypatch.setattr(ai_notes_indexer, "IN_CI", True)
+    # the indexer moves into the notes repo
+    monkeypatch.chdir(repo)
+
+    return repo
+
+
+def test_renamed_files_keep_the_hash_algorithm_of_their_records(notes):
+    write_note(notes, "new.md", "# Note\n\nsome text\n\n- item\n")
+    create_indexer(notes).run()
+
+    move_note(notes, "new.md", "moved.md")
+    indexer = create_indexer(notes, hash_algorithm="blake2b")
+    indexer.run()
+
+    # moved instead of embedded again
+    requests = indexer.metrics.summary()["requests"]
+    assert "upsert" not in requests
+    assert "update" in requests
+
+    assert list(indexer.f_handler.index) == ["moved.md"]
+    chunk_ids = indexer.f_handler.get_chunk_ids("moved.md")
+    assert chunk_ids
+    metadata = indexer.index.fetch_metadata(indexer.namespace, chunk_ids)
+    assert sorted(metadata) == sorted(chunk_ids)
+    assert {m["filename"] for m in metadata.values()} == {"moved.md"}
+
+
+def test_new_file_at_the_path_of_a_moved_one_keeps_the_moved_records(notes):
+    content = "# Topic\n\nsome text\n\n- item\n"
+    write_note(notes, "topic.md", content)
+    create_indexer(notes).run()
+
+    move_note(notes, "topic.md", "renamed.md")
+    create_indexer(notes).run()
+
+    write_note(notes, "topic.md", content)
+    create_indexer(notes).run()
+
+    delete_note(notes, "topic.md")
+    indexer = create_indexer(notes)
+    indexer.run()
+
+    assert list(indexer.f_handler.index) == ["renamed.md"]
+    chunk_ids = indexer.f_handler.get_chunk_ids("renamed.md")
+    assert chunk_ids
+    metadata = indexer.index.fetch_metadata(indexer.namespace, chunk_ids)
+    assert sorted(metadata) == sorted(chunk_ids)
+    assert {m["filename"] for m in metadata.values()} == {"renamed.md"}
+    assert indexer.index.count(indexer.namespace) == len(chunk_ids)
+
+
+def test_failed_rebuild_is_resumed(notes, monkeypatch):
+    write_note(notes, "a.md", "# A\n\nsome text\n")
+    write_note(notes, "b.md", "# B\n\nother text\n")
+    create_indexer(notes).run()
+
+    # the store never reports all records of the rebuild
+    monkeypatch.setattr(ai_notes_indexer.time, "sleep", lambda _: None)
+    indexer = create_indexer(notes, rebuild=True)
+    monkeypatch.setattr(indexer.index, "count", lambda namespace: 0)
+    with pytest.raises(RebuildError):
+        indexer.run()
+
+    namespace = indexer.namespace
+    target = load_active_target(indexer.active_target_path)
+    assert (target["namespace"], target["pending"]) == ("default", namespace)
+
+    resumed = create_indexer(notes, rebuild=True)
+    assert resumed.namespace == namespace
+    resumed.run()
+
+    # nothing was uploaded again
+    assert "upsert" not in resumed.metrics.summary()["requests"]
+    target = load_active_target(resumed.active_target_path)
+    assert (target["namespace"], target["previous"], target["pending"]) == (
+        namespace,
+        "default",
+        None,
+    )
+
+    # only the namespaces of the first run and the rebuild are tracked
+    store = Path(resumed.tracked_files_path).parent
+    assert sorted(p.name for p in store.glob("tracked_files*.txt")) == [
+        f"tracked_files.{namespace}.txt",
+        "tracked_files.txt",
+    ]
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.parametrize("checkpoint_interval", [0, 1])
+def test_interrupted_run_is_resumed(notes, monkeypatch, checkpoint_interval):
+    write_note(notes, "changed.md", "# Changed\n\nold text\n\n- old item\n")
+    write_note(notes, "moved.md", "# Moved\n\nsome text\n")
+    write_note(notes, "deleted.md", "# Deleted\n\nsome text\n")
+    create_indexer(notes).run()
+
+    write_note(notes, "changed.md", "# Changed\n\nnew text\n\n- old item\n")
+    move_note(notes, "moved.md", "folder/moved.md")
+    delete_note(notes, "deleted.md")
+    write_note(notes, "added.md", "# Added\n\nsome text\n")
+    write_note(notes, "gone.md", "# Gone\n\nsome text\n")
+
+    # crashes after all operations are done, before the stale records are purged and the tracking is saved
+    indexer = create_indexer(notes, checkpoint_interval=checkpoint_interval)
+
+    def crash() -> None:
+        raise Crash()
+
+    monkeypatch.setattr(indexer, "save", crash)
+    with pytest.raises(Crash):
+        indexer.run()
+    assert indexer.journal.load()
+
+    # deleted before the run is resumed
+    delete_note(notes, "gone.md")
+    resumed = create_indexer(notes, checkpoint_interval=checkpoint_interval)
+    resumed.run()
+
+    # the done operations are applied, nothing is uploaded or moved again
+    requests = resumed.metrics.summary()["requests"]
+    assert "upsert" not in requests
+    assert "update" not in requests
+    assert resumed.journal.load() == []
+
+    assert sorted(resumed.f_handler.index) == [
+        "added.md",
+        "changed.md",
+        "folder/moved.md",
+    ]
+    assert sorted(resumed.f_handler.chunk_ids) == sorted(resumed.f_handler.index)
+    # stale records of the changed and deleted files are purged
+    assert get_store_ids(resumed) == get_tracked_ids(resumed)
+    moved_ids = resumed.f_handler.get_chunk_ids("folder/moved.md")
+    assert moved_ids
+    metadata = resumed.index.fetch_metadata(resumed.namespace, moved_ids)
+    assert {m["path"] for m in metadata.values()} == {"folder"}
+
+
+def test_repair_untracks_missing_and_deletes_orphaned_records(notes):
+    write_note(notes, "missing.md", "# Missing\n\nsome text\n")
+    write_note(notes, "complete.md", "# Complete\n\nsome text\n")
+    indexer = create_indexer(notes)
+    indexer.run()
+
+    # e.g. a record was deleted in the db, and one of an untracked version was left behind
+    missing_ids = indexer.f_handler.get_chunk_ids("missing.md")
+    assert missing_ids
+    indexer.index.delete(indexer.namespace, ids=missing_ids[:1])
+    orphan = {
+        "id": "orphan#section#1",
+        "text": "# Old\n\nold text",
+        "filename": "old.md",
+        "path": ".",
+        "type": "section",
+        "hash": "untracked",
+    }
+    indexer.index.upsert_records(indexer.namespace, [orphan])
+
+    repaired = create_indexer(notes)
+    repaired.repair()
+
+    assert list(repaired.f_handler.index) == ["complete.md"]
+    assert "orphan#section#1" not in get_store_ids(repaired)
+
+    # the next run uploads the untracked file again
+    indexer = create_indexer(notes)
+    indexer.run()
+    assert sorted(indexer.f_handler.index) == ["complete.md", "missing.md"]
+    assert get_store_ids(indexer) == get_tracked_ids(indexer)
+
+
+def test_records_without_ids_of_files_with_the_same_content_are_kept(notes):
+    content = "# Same\n\nsome text\n"
+    write_note(notes, "a.md", content)
+    write_note(notes, "folder/b.md", content)
+    indexer = create_indexer(notes)
+    indexer.run()
+
+    # as if both were uploaded before ids were derived from the chunks
+    b_ids = indexer.f_handler.get_chunk_ids("folder/b.md")
+    indexer.f_handler.chunk_ids.clear()
+    indexer.f_handler.chunk_ids_changed = True
+    indexer.f_handler.flush()
+
+    write_note(notes, "a.md", "# Changed\n\nother text\n")
+    indexer = create_indexer(notes)
+    indexer.run()
+
+    # the old version of a.md is purged, b.md shares its hash but keeps its records
+    a_ids = indexer.f_handler.get_chunk_ids("a.md")
+    assert get_store_ids(indexer) == set(a_ids) | set(b_ids)
+
+    repaired = create_indexer(notes)
+    repaired.repair()
+    assert sorted(repaired.f_handler.index) == ["a.md", "folder/b.md"]
+    assert get_store_ids(repaired) == set(a_ids) | set(b_ids)
+
+
+def test_plan_matches_the_next_run_without_connecting(notes):
+    write_note(notes, "updated.md", "# Updated\n\nold text\n\n- item\n")
+    write_note(notes, "renamed.md", "# Renamed\n\nsome text\n\n- item\n")
+    write_note(notes, "deleted.md", "# Deleted\n\nsome text\n")
+    create_indexer(notes).run()
+
+    write_note(notes, "updated.md", "# Updated\n\nnew text\n\n- item\n")
+    move_note(notes, "renamed.md", "folder/renamed.md")
+    delete_note(notes, "deleted.md")
+    write_note(notes, "added.md", "# Added\n\nsome text\n\n- item\n- other item\n")
+
+    indexer = create_indexer(notes, offline=True)
+    plan = indexer.plan()
+    assert not indexer.connected
+
+    assert [f["file"] for f in plan["add"]] == ["added.md"]
+    assert [f["file"] for f in plan["update"]] == ["updated.md"]
+    assert plan["rename"] == [{"from": "renamed.md", "to": "folder/renamed.md"}]
+    assert plan["delete"] == ["deleted.md"]
+    assert plan["unchanged"] == 0
+
+    added, updated = plan["add"][0], plan["update"][0]
+    assert (added["chunks"], added["records"]) == (3, 3)
+    # only the changed section is uploaded again, the list is unchanged
+    assert (updated["chunks"], updated["records"]) == (2, 1)
+    assert plan["totals"]["records"] == 4
+    assert plan["totals"]["requests"] == {"upsert": 1, "update": 2, "delete": 1}
+
+    # the run makes the planned requests
+    indexer = create_indexer(notes)
+    indexer.run()
+    summary = indexer.metrics.summary()
+    assert summary["counters"]["records"] == plan["totals"]["records"]
+    assert {
+        kind: request["count"] for kind, request in summary["requests"].items()
+    } == plan["totals"]["requests"]
+
+
+def test_metrics_start_after_the_confirmation(notes, monkeypatch):
+    monkeypatch.setattr(ai_notes_indexer, "IN_CI", False)
+    confirmed: list[float] = []
+    monkeypatch.setattr(
+        NotesIndexer,
+        "confirm_execution",
+        lambda self: confirmed.append(time.perf_counter()),
+    )
+
+    indexer = create_indexer(notes, metrics=RunMetrics())
+    assert indexer.metrics.start >= confirmed[0]
+
+
+def test_only_confirmed_rebuilds_are_pending(notes, monkeypatch):
+    write_note(notes, "a.md", "# A\n\nsome text\n")
+    create_indexer(notes).run()
+
+    # planned
+    indexer = create_indexer(notes, rebuild=True, offline=True)
+    indexer.plan()
+    assert load_active_target(indexer.active_target_path)["pending"] is None
+
+    # cancelled
+    monkeypatch.setattr(ai_notes_indexer, "IN_CI", False)
+
+    def cancel(self) -> None:
+        raise SystemExit(1)
+
+    monkeypatch.setattr(NotesIndexer, "confirm_execution", cancel)
+    with pytest.raises(SystemExit):
+        create_indexer(notes, rebuild=True)
+    assert load_active_target(indexer.active_target_path)["pending"] is None
+
+    # confirmed
+    monkeypatch.setattr(NotesIndexer, "confirm_execution", lambda self: None)
+    indexer = create_indexer(notes, rebuild=True)
+    assert load_active_target(indexer.active_target_path)["pending"] == (
+        indexer.namespace
+    )
+
+
+def test_namespace_before_the_previous_one_is_deleted(notes, monkeypatch):
+    write_note(notes, "a.md", "# A\n\nsome text\n")
+    create_indexer(notes).run()
+
+    # rebuilds are named by the time they start
+    times = iter([datetime(2024, 1, 1, 10), datetime(2024, 1, 1, 11)])
+    monkeypatch.setattr(
+        ai_notes_indexer, "datetime", type("", (), {"now": lambda: next(times)})
+    )
+    first = create_indexer(notes, rebuild=True)
+    first.run()
+    second = create_indexer(notes, rebuild=True)
+    second.run()
+
+    target = load_active_target(second.active_target_path)
+    assert (target["namespace"], target["previous"]) == (
+        second.namespace,
+        first.namespace,
+    )
+    assert second.index.count("default") == 0
+    assert second.index.count(first.namespace) > 0
+
+    # the tracking files of the default namespace are deleted as well
+    default_files = TrackedFileHandler.get_files(second.base_tracked_files_path)
+    assert not any(Path(file).exists() for file in default_files)
+    assert Path(first.tracked_files_path).exists()
@@ -1,25 +1,36 @@
 import sys
-from datetime import datetime
 from enum import Enum
+from functools import cache
 from string import Template
 from typing import cast
 
-import pyperclip
-import requests
-from pinecone import Pinecone, QueryResponse
-
+from active_target import get_active_target_path, load_active_target
+from client_state import ClientState
 from config import (
     CYAN,
+    EMBEDDER,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_SIZE,
     GREEN,
     GREY,
     INDEX_NAME,
-    INDEX_NAMESPACE,
     MAGENTA,
     OLLAMA_HOST,
-    PINECONE_API_KEY,
+    QUERY_CACHE_PATH,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
     RESET,
+    VECTOR_STORE,
     YELLOW,
 )
+from embedder import Embedder, EmbedderType, create_embedder, get_embedder_model
+from query_cache import QueryCache
+from vector_store import (
+    StoreType,
+    VectorStore,
+    create_pinecone_client,
+    open_vector_store,
+)
 
 result_template = Template(
     """
@@ -34,8 +45,13 @@ $text
 """.strip()
 )
 
-prompt_template = Template(
-    f"""
+
+def get_prompt_template() -> Template:
+    # only formatted when needed, with the date of the question
+    from datetime import datetime
+
+    return Template(
+        f"""
 # Question
 
 $question
@@ -95,10 +111,14 @@ $context
 
 # End of Prompt
 """.strip()
-)
+    )
 
-enhance_question_prompt_template = Template(
-    f"""
+
+def get_enhance_question_prompt_template() -> Template:
+    from datetime import datetime
+
+    return Template(
+        f"""
 # Instructions
 
 You are a helpful assistant that rewrites vague user questions involving time
@@ -120,34 +140,61 @@ Improved: Show notes from 2025-02-25.
 User: What did I do today?
 Improved: What did the user do on 2025-02-28?
 """
-)
+    )
+
+
+@cache
+def connect() -> tuple[Embedder, VectorStore]:
+    """Embedder and store, created on first use instead of on import"""
+    pc = create_pinecone_client(
+        cast(StoreType, VECTOR_STORE), cast(EmbedderType, EMBEDDER)
+    )
+    embedder = create_embedder(
+        cast(EmbedderType, EMBEDDER),
+        pc,
+        cache_path=EMBEDDING_CACHE_PATH,
+        cache_size=EMBEDDING_CACHE_SIZE,
+    )
+    store = open_vector_store(
+        cast(StoreType, VECTOR_STORE), INDEX_NAME, embedder, pc, state=ClientState()
+    )
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(INDEX_NAME)
+    return embedder, store
 
 
-def get_context_from_db(query: str, max_length: int = 20_000) -> str:
-    embedding = pc.inference.embed(
-        model="multilingual-e5-large",
-        inputs=[query],
-        parameters={"input_type": "query"},
+def get_context_from_db(
+    query: str, max_length: int = 20_000, use_cache: bool = True
+) -> str:
+    # the active namespace might be switched by a rebuild of the index
+    model = get_embedder_model(cast(EmbedderType, EMBEDDER))
+    active_target = load_active_target(
+        get_active_target_path(cast(StoreType, VECTOR_STORE), INDEX_NAME, model)
     )
 
-    results = cast(
-        QueryResponse,
-        index.query(
-            vector=embedding[0]["values"],
-            # requesting more context than we need, as we will use not all of them at the end
-            top_k=50,
-            include_values=False,
-            include_metadata=True,
-            namespace=INDEX_NAMESPACE,
-        ),
+    # any write of the indexer or switch of the namespace results in other keys
+    # (the pinecone pointer file is committed by CI, so its writes are only seen after a pull)
+    index_version = f"{VECTOR_STORE}/{INDEX_NAME}/{model}/{active_target['namespace']}/{active_target['version']}"
+    query_cache = QueryCache(QUERY_CACHE_PATH, QUERY_CACHE_TTL, QUERY_CACHE_SIZE)
+    key = QueryCache.get_key(query, max_length, index_version)
+    if use_cache:
+        cached = query_cache.get(key)
+        if cached is not None:
+            print(f"{GREY}Using cached context{RESET}")
+            return cached
+
+    embedder, store = connect()
+    vector = embedder.embed([query], "query")[0]
+
+    matches = store.query(
+        namespace=active_target["namespace"],
+        vector=vector,
+        # requesting more context than we need, as we will use not all of them at the end
+        top_k=50,
     )
 
     context_blocks: list[str] = []
     total_length = 0
-    for result in results["matches"]:
+    for result in matches:
         block = result_template.substitute(
             filename=result["metadata"]["filename"],
             path=result["metadata"]["path"],
@@ -164,10 +211,15 @@ def get_context_from_db(query: str, max_length: int = 20_000) -> str:
         context_blocks.append(block)
         total_length += len(block)
 
-    return "\n\n".join(context_blocks)
+    context = "\n\n".join(context_blocks)
+    query_cache.put(key, context)
+
+    return context
 
 
 def is_ollama_running():
+    import requests
+
     try:
         response = requests.get(OLLAMA_HOST, timeout=1)
         return response.status_code == 200
@@ -223,7 +275,7 @@ def try_enhance_question_for_db(question: str) -> str:
         messages=[
             {
                 "role": "system",
-                "content": enhance_question_prompt_template.substitute(),
+                "content": get_enhance_question_prompt_template().substitute(),
             },
             {"role": "user", "content": question},
         ],
@@ -266,9 +318,26 @@ def try_enhance_question_for_db(question: str) -> str:
 
 
 def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Create a prompt with context of the notes for a question"
+    )
+    # everything after the first word belongs to the question, even words starting with a dash
+    parser.add_argument(
+        "question", nargs=argparse.REMAINDER, help="Question, quotes are optional"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always query the db, instead of using the context of the same question asked before",
+    )
+    # e.g. `-v means what`, unknown options before the question are part of it as well
+    args, leading_words = parser.parse_known_args()
+
     try:
         # allow passing the question without quotes, by using all args
-        question = " ".join(sys.argv[1:])
+        question = " ".join([*leading_words, *args.question])
 
         print(f"{MAGENTA}Provided{RESET} question")
         print(f"{GREY}{question}{RESET}")
@@ -276,12 +345,16 @@ def main() -> None:
         question = try_enhance_question_for_db(question)
 
         print(f"{YELLOW}Retrieve{RESET} context from {CYAN}db{RESET}")
-        context = get_context_from_db(question)
+        context = get_context_from_db(question, use_cache=not args.no_cache)
 
         print(f"{YELLOW}Create{RESET} prompt")
-        prompt_text = prompt_template.substitute(question=question, context=context)
+        prompt_text = get_prompt_template().substitute(
+            question=question, context=context
+        )
 
         print(f"{GREEN}Copied{RESET} prompt into {CYAN}clipboard{RESET}")
+        import pyperclip
+
         pyperclip.copy(prompt_text)
     except KeyboardInterrupt:
         sys.exit(1)
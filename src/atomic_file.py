@@ -0,0 +1,18 @@
+import os
+import tempfile
+
+
+def write_atomic(path: str, content: str) -> None:
+    """
+    Write into a temporary file next to the target and swap it in,
+    so an interrupted run (or a concurrent reader) never sees a half written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from atomic_file import write_atomic
+
+
+def test_file_is_replaced(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("old", encoding="utf-8")
+
+    write_atomic(str(path), "new")
+    assert path.read_text(encoding="utf-8") == "new"
+    assert os.listdir(tmp_path) == ["state.json"]
+
+
+def test_failed_write_keeps_the_old_file(tmp_path, monkeypatch):
+    path = tmp_path / "state.json"
+    path.write_text("old", encoding="utf-8")
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        write_atomic(str(path), "new")
+
+    # no temporary file is left behind
+    assert path.read_text(encoding="utf-8") == "old"
+    assert os.listdir(tmp_path) == ["state.json"]
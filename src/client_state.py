@@ -0,0 +1,40 @@
+import json
+import os
+from typing import TypedDict
+
+from atomic_file import write_atomic
+from config import CLIENT_STATE_FILE
+
+
+class IndexDescription(TypedDict):
+    host: str
+    dimension: int
+
+
+class ClientState:
+    """
+    Local cache of api lookups that rarely change (e.g. the host of an index),
+    to not ask the api for them on every start. Deleting the file refreshes them.
+    """
+
+    def __init__(self, path: str = CLIENT_STATE_FILE):
+        self.path = path
+        self.indexes: dict[str, IndexDescription] = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.indexes = json.load(f).get("indexes", {})
+            except (OSError, json.JSONDecodeError):
+                # only a cache, it is simply filled again
+                pass
+
+    def get_index(self, name: str) -> IndexDescription | None:
+        return self.indexes.get(name)
+
+    def set_index(self, name: str, description: IndexDescription) -> None:
+        self.indexes[name] = description
+        self._save()
+
+    def _save(self) -> None:
+        write_atomic(self.path, json.dumps({"indexes": self.indexes}, indent=2) + "\n")
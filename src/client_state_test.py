@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from client_state import ClientState
+from embedder import HashingEmbedder
+from vector_store import PineconeVectorStore
+
+
+class FakePinecone:
+    def __init__(self):
+        self.describe_calls = 0
+        self.hosts: list[str] = []
+
+    def has_index(self, name: str) -> bool:
+        return True
+
+    def describe_index(self, name: str):
+        self.describe_calls += 1
+        return SimpleNamespace(host=f"{name}-abc.svc.pinecone.io", dimension=1024)
+
+    def Index(self, host: str):
+        self.hosts.append(host)
+        return object()
+
+
+def test_index_lookups_are_cached(tmp_path):
+    path = str(tmp_path / "state.json")
+    pc = FakePinecone()
+
+    store = PineconeVectorStore(
+        pc, "notes", HashingEmbedder(), create=True, state=ClientState(path)
+    )  # type: ignore[arg-type]
+    assert store.dimension == 1024
+    assert pc.describe_calls == 1
+
+    # a new process only reads the state file
+    store = PineconeVectorStore(
+        pc, "notes", HashingEmbedder(), create=True, state=ClientState(path)
+    )  # type: ignore[arg-type]
+    assert store.dimension == 1024
+    assert pc.describe_calls == 1
+    assert pc.hosts == ["notes-abc.svc.pinecone.io"] * 2
+
+
+def test_broken_state_is_ignored(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text('{"indexes": {"no', encoding="utf-8")
+
+    state = ClientState(str(path))
+    assert state.get_index("notes") is None
+
+    state.set_index("notes", {"host": "h", "dimension": 3})
+    assert ClientState(str(path)).get_index("notes") == {"host": "h", "dimension": 3}
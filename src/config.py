@@ -6,9 +6,42 @@ load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 
+# root of this repo, independent of the current working directory
+RAG_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 INDEX_NAME = "notes-v9"
 INDEX_NAMESPACE = "default"
 TRACKED_FILE = f"pinecone_tracked_files_{INDEX_NAME}.txt"
+# lookups of the pinecone api that rarely change (e.g. index hosts), see src/client_state.py
+CLIENT_STATE_FILE = os.path.join(RAG_REPO_ROOT, ".client-state.json")
+# pinecone: hosted index, local: vectors on the local disk (e.g. for offline use and benchmarks)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+# pinecone: multilingual-e5-large via the pinecone api, hashed: local hashed n-grams (only for the local store)
+EMBEDDER = os.getenv("EMBEDDER", "pinecone")
+LOCAL_STORE_PATH = os.path.join(RAG_REPO_ROOT, ".vector-store")
+# vectors of already embedded texts, to not pay for embedding the same text again
+EMBEDDING_CACHE_PATH = os.path.join(RAG_REPO_ROOT, ".embedding-cache")
+# max cached vectors per model (multilingual-e5-large: 2KB each as float16)
+EMBEDDING_CACHE_SIZE = 50_000
+# contexts of already asked questions, invalidated whenever the indexer writes to the index
+QUERY_CACHE_PATH = os.path.join(RAG_REPO_ROOT, ".query-cache")
+# seconds until a cached context expires, and max cached contexts (~20KB each)
+# short, as runs of the indexer in CI are only seen locally after pulling their version of the index
+QUERY_CACHE_TTL = 60 * 60
+QUERY_CACHE_SIZE = 500
+# save the tracked files every n changes, so interrupted runs (e.g. CI timeouts) keep most progress
+TRACKED_FILE_CHECKPOINT_INTERVAL = 50
+# multilingual-e5-large truncates inputs after 507 tokens, longer chunks are split (estimated locally)
+MAX_CHUNK_TOKENS = 480
+# concurrent requests for uploading records
+UPLOAD_WORKERS = 4
+# processes for reading and chunking files, only used when many files changed (e.g. rebuilds)
+CHUNK_WORKERS = os.cpu_count() or 1
+CHUNK_WORKERS_MIN_FILES = 200
+# seconds without further changes before a watch run starts, editors write files multiple times when saving
+WATCH_DEBOUNCE = 2.0
+# seconds between checks for changes, when inotify is not available (e.g. macOS)
+WATCH_POLL_INTERVAL = 1.0
 
 IN_CI = os.getenv("GITHUB_ACTIONS") is not None
 
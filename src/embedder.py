@@ -0,0 +1,143 @@
+import hashlib
+import os
+import re
+from typing import TYPE_CHECKING, Literal, Protocol
+
+if TYPE_CHECKING:
+    # both take a while to import, they are only imported once they are used
+    import numpy as np
+    from pinecone import Pinecone
+
+# passages are embedded for the index, queries for the search (e5 models differ between them)
+InputType = Literal["passage", "query"]
+EmbedderType = Literal["pinecone", "hashed"]
+
+PINECONE_EMBED_MODEL = "multilingual-e5-large"
+PINECONE_EMBED_DIMENSION = 1024
+# Pinecone embeds at most 96 inputs per request with this model
+PINECONE_EMBED_BATCH_SIZE = 96
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class Embedder(Protocol):
+    """Turns texts into vectors, many texts at once"""
+
+    # name of the model, vectors of different models can not be compared
+    model: str
+
+    def embed(self, texts: list[str], input_type: InputType) -> list[list[float]]: ...
+
+
+class PineconeEmbedder:
+    """Embeds via the Pinecone inference api, the model of the Pinecone index"""
+
+    def __init__(self, pc: "Pinecone", batch_size: int = PINECONE_EMBED_BATCH_SIZE):
+        self.pc = pc
+        self.model = PINECONE_EMBED_MODEL
+        self.batch_size = batch_size
+
+    def embed(self, texts: list[str], input_type: InputType) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        for i in range(0, len(texts), self.batch_size):
+            embeddings = self.pc.inference.embed(
+                model=self.model,
+                inputs=texts[i : i + self.batch_size],
+                parameters={"input_type": input_type, "truncate": "END"},
+            )
+            vectors.extend(list(e["values"]) for e in embeddings)
+
+        return vectors
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder, without network or model.
+
+    Words and character n-grams of words are hashed into a fixed number of dimensions
+    (with a sign, so collisions cancel out instead of adding up). The similarity is lexical
+    rather than semantic, good enough for offline use, tests and benchmarks of the pipeline.
+    """
+
+    def __init__(self, dimension: int = 1024, ngram_sizes: tuple[int, ...] = (3, 4, 5)):
+        self.dimension = dimension
+        self.ngram_sizes = ngram_sizes
+        self.model = f"hashed-ngrams-{dimension}"
+
+    def embed(self, texts: list[str], input_type: InputType) -> list[list[float]]:
+        # queries and passages are embedded the same way
+        return [self._embed(text).tolist() for text in texts]
+
+    def _features(self, text: str) -> list[str]:
+        features: list[str] = []
+        for word in WORD_PATTERN.findall(text.lower()):
+            features.append(word)
+
+            # mark the word boundaries, so prefixes and suffixes are features of their own
+            padded = f" {word} "
+            for n in self.ngram_sizes:
+                features.extend(
+                    padded[i : i + n] for i in range(max(len(padded) - n + 1, 0))
+                )
+
+        return features
+
+    def _embed(self, text: str) -> "np.ndarray":
+        import numpy as np
+
+        features = self._features(text)
+        if not features:
+            return np.zeros(self.dimension, dtype=np.float32)
+
+        # the python `hash` is randomized per process, so use a stable one
+        hashes = np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little"
+                )
+                for f in features
+            ],
+            dtype=np.uint64,
+        )
+        indices = (hashes % self.dimension).astype(np.int64)
+        signs = np.where(hashes >> np.uint64(63), 1.0, -1.0)
+
+        vector = np.zeros(self.dimension, dtype=np.float64)
+        np.add.at(vector, indices, signs)
+
+        # dampen frequent features, then normalize for the cosine similarity
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+
+        return (vector / norm if norm else vector).astype(np.float32)
+
+
+def get_embedder_model(embedder: EmbedderType) -> str:
+    return HashingEmbedder().model if embedder == "hashed" else PINECONE_EMBED_MODEL
+
+
+def create_embedder(
+    embedder: EmbedderType,
+    pc: "Pinecone | None" = None,
+    cache_path: str | None = None,
+    cache_size: int = 0,
+) -> Embedder:
+    """The given embedder, api based ones are cached in `cache_path` (if set)"""
+    if embedder == "hashed":
+        # embedding locally is cheaper than reading the cache
+        return HashingEmbedder()
+
+    if pc is None:
+        raise ValueError("The pinecone embedder needs a pinecone client")
+
+    pinecone_embedder = PineconeEmbedder(pc)
+    if not cache_path:
+        return pinecone_embedder
+
+    # imported here, as the cache depends on this module
+    from embedding_cache import CachedEmbedder, EmbeddingCache
+
+    return CachedEmbedder(
+        pinecone_embedder,
+        EmbeddingCache(os.path.join(cache_path, pinecone_embedder.model), cache_size),
+    )
@@ -0,0 +1,53 @@
+from embedder import HashingEmbedder, PineconeEmbedder
+
+
+def cosine(a: list[float], b: list[float]) -> float:
+    return sum(x * y for x, y in zip(a, b))
+
+
+def test_hashing_embedder_is_deterministic_and_lexical():
+    embedder = HashingEmbedder(dimension=256)
+    vectors = embedder.embed(
+        [
+            "Vacation planning for the summer",
+            "planning the summer vacation",
+            "Database migration of the backend",
+            "",
+        ],
+        "passage",
+    )
+
+    assert len(vectors[0]) == 256
+    assert (
+        vectors[0]
+        == HashingEmbedder(dimension=256).embed(
+            ["Vacation planning for the summer"], "query"
+        )[0]
+    )
+    assert cosine(vectors[0], vectors[1]) > cosine(vectors[0], vectors[2])
+    assert abs(cosine(vectors[0], vectors[0]) - 1) < 1e-5
+    assert vectors[3] == [0.0] * 256
+
+
+class FakeInference:
+    def __init__(self):
+        self.requests: list[list[str]] = []
+
+    def embed(self, model: str, inputs: list[str], parameters: dict) -> list[dict]:
+        self.requests.append(inputs)
+        return [{"values": [float(len(text))]} for text in inputs]
+
+
+class FakePinecone:
+    def __init__(self):
+        self.inference = FakeInference()
+
+
+def test_pinecone_embedder_batches_inputs():
+    pc = FakePinecone()
+    embedder = PineconeEmbedder(pc, batch_size=2)  # type: ignore[arg-type]
+
+    vectors = embedder.embed(["a", "bb", "ccc"], "passage")
+
+    assert vectors == [[1.0], [2.0], [3.0]]
+    assert pc.inference.requests == [["a", "bb"], ["ccc"]]
@@ -0,0 +1,198 @@
+import fcntl
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from embedder import Embedder, InputType
+
+# slots that are allocated at once, it grows by doubling up to the max entries
+INITIAL_CAPACITY = 1024
+KEY_BYTES = 32
+EMPTY_KEY = bytes(KEY_BYTES)
+
+
+class EmbeddingCache:
+    """
+    On disk cache of the vectors of one model, keyed by the input type and the sha256 of the text.
+
+    Every entry has a slot (offset) in three memory-mapped arrays:
+    `vectors.npy` (float16, half the size of float32 and precise enough for the cosine similarity),
+    `keys.npy` (key of the slot, an empty key marks a free slot) and `last_used.npy` for the
+    LRU eviction once `max_entries` is reached.
+
+    The key is cleared before its vector is overwritten and only set again afterwards,
+    so an interrupted write never returns a wrong vector. Other processes (e.g. the indexer while
+    asking a question) can reuse a slot at any time, writes are serialized via a lock file
+    and reads check the key of the slot before and after copying its vector.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        self.vectors: np.memmap | None = None
+        self.keys: np.memmap | None = None
+        self.last_used: np.memmap | None = None
+        # key -> slot, ordered from the least to the most recently used
+        self.slots: OrderedDict[bytes, int] = OrderedDict()
+        self.free_slots: list[int] = []
+        self.tick = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.lock_file = open(os.path.join(path, "lock"), "a")
+        self._load()
+
+    @staticmethod
+    def get_key(text: str, input_type: InputType) -> bytes:
+        text_hash = hashlib.sha256(text.encode("utf-8")).digest()
+        return hashlib.sha256(input_type.encode("utf-8") + b"\0" + text_hash).digest()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.npy")
+
+    def _load(self) -> None:
+        if not os.path.exists(self._file("keys")):
+            return
+
+        self.vectors = np.load(self._file("vectors"), mmap_mode="r+")
+        self.keys = np.load(self._file("keys"), mmap_mode="r+")
+        self.last_used = np.load(self._file("last_used"), mmap_mode="r+")
+
+        if not len(self.keys):
+            return
+
+        # from the least to the most recently used slot, in a single pass over the arrays
+        order = np.argsort(self.last_used, kind="stable")
+        empty = ~self.keys[order].any(axis=1)
+        used_slots = order[~empty]
+        keys = np.ascontiguousarray(self.keys[used_slots]).tobytes()
+
+        self.slots = OrderedDict(
+            (keys[i * KEY_BYTES : (i + 1) * KEY_BYTES], slot)
+            for i, slot in enumerate(used_slots.tolist())
+        )
+        # free slots are taken from the end
+        self.free_slots = order[empty][::-1].tolist()
+        self.tick = int(self.last_used.max())
+
+    def _grow(self, dimension: int) -> bool:
+        """Allocate more slots, false if the cache already has the max entries"""
+        capacity = len(self.keys) if self.keys is not None else 0
+        if capacity >= self.max_entries:
+            return False
+
+        new_capacity = min(max(capacity * 2, INITIAL_CAPACITY), self.max_entries)
+        arrays = {
+            "vectors": (np.float16, (new_capacity, dimension), self.vectors),
+            "keys": (np.uint8, (new_capacity, KEY_BYTES), self.keys),
+            "last_used": (np.uint64, (new_capacity,), self.last_used),
+        }
+
+        # grow by copying into new files, which replace the old ones
+        for name, (dtype, shape, old) in arrays.items():
+            tmp_path = os.path.join(self.path, f"{name}.tmp.npy")
+            array = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=dtype, shape=shape
+            )
+            if old is not None:
+                array[:capacity] = old
+            array.flush()
+            del array
+
+        # the keys are replaced last, they decide which slots are valid
+        self.vectors = self.keys = self.last_used = None
+        for name in ["vectors", "last_used", "keys"]:
+            os.replace(os.path.join(self.path, f"{name}.tmp.npy"), self._file(name))
+
+        self.vectors = np.load(self._file("vectors"), mmap_mode="r+")
+        self.keys = np.load(self._file("keys"), mmap_mode="r+")
+        self.last_used = np.load(self._file("last_used"), mmap_mode="r+")
+        self.free_slots.extend(reversed(range(capacity, new_capacity)))
+
+        return True
+
+    def _has_key(self, slot: int, key: bytes) -> bool:
+        assert self.keys is not None
+        return self.keys[slot].tobytes() == key
+
+    def get(self, key: bytes) -> list[float] | None:
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None or self.vectors is None:
+                return None
+
+            valid = self._has_key(slot, key)
+            vector = self.vectors[slot].astype(np.float32)
+            # the key is cleared before a vector is written, so checking it again catches writes while copying
+            if not (valid and self._has_key(slot, key)):
+                # evicted and reused by another process, the slot is not free for this one
+                del self.slots[key]
+                return None
+
+            self.slots.move_to_end(key)
+            self.tick += 1
+            self.last_used[slot] = self.tick  # type: ignore[index]
+
+            return vector.tolist()
+
+    def put(self, key: bytes, vector: list[float]) -> None:
+        with self.lock:
+            if key in self.slots:
+                return
+
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            try:
+                self._put(key, vector)
+            finally:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _put(self, key: bytes, vector: list[float]) -> None:
+        if self.vectors is not None and self.vectors.shape[1] != len(vector):
+            # a different dimension means a different model, do not cache it
+            return
+
+        if not self.free_slots and not self._grow(len(vector)):
+            # evict the least recently used entry
+            _, slot = self.slots.popitem(last=False)
+            self.free_slots.append(slot)
+
+        slot = self.free_slots.pop()
+        assert self.vectors is not None and self.keys is not None
+        self.keys[slot] = np.frombuffer(EMPTY_KEY, dtype=np.uint8)
+        self.vectors[slot] = vector
+        self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+
+        self.tick += 1
+        self.last_used[slot] = self.tick  # type: ignore[index]
+        self.slots[key] = slot
+
+
+class CachedEmbedder:
+    """Embedder that only embeds texts which are not yet in the cache, in a single batch"""
+
+    def __init__(self, embedder: Embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model = embedder.model
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, texts: list[str], input_type: InputType) -> list[list[float]]:
+        keys = [EmbeddingCache.get_key(text, input_type) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            embedded = self.embedder.embed([texts[i] for i in missing], input_type)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+
+        return vectors  # type: ignore[return-value]
@@ -0,0 +1,66 @@
+import embedding_cache
+from embedding_cache import CachedEmbedder, EmbeddingCache
+
+
+class CountingEmbedder:
+    model = "counting"
+
+    def __init__(self):
+        self.requests: list[list[str]] = []
+
+    def embed(self, texts: list[str], input_type: str) -> list[list[float]]:
+        self.requests.append(texts)
+        return [[float(len(text)), 0.5] for text in texts]
+
+
+def test_only_missing_texts_are_embedded(tmp_path):
+    embedder = CountingEmbedder()
+    cached = CachedEmbedder(embedder, EmbeddingCache(str(tmp_path), max_entries=10))
+
+    assert cached.embed(["a", "bb"], "passage") == [[1.0, 0.5], [2.0, 0.5]]
+    assert cached.embed(["bb", "ccc"], "passage") == [[2.0, 0.5], [3.0, 0.5]]
+    # the input type is part of the key
+    cached.embed(["a"], "query")
+
+    assert embedder.requests == [["a", "bb"], ["ccc"], ["a"]]
+    assert (cached.hits, cached.misses) == (1, 4)
+
+    # reopened from disk
+    reopened = CachedEmbedder(embedder, EmbeddingCache(str(tmp_path), max_entries=10))
+    assert reopened.embed(["ccc", "a"], "passage") == [[3.0, 0.5], [1.0, 0.5]]
+    assert reopened.misses == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "INITIAL_CAPACITY", 2)
+    cache = EmbeddingCache(str(tmp_path), max_entries=3)
+    keys = [EmbeddingCache.get_key(text, "passage") for text in "abcd"]
+
+    for i, key in enumerate(keys[:3]):
+        cache.put(key, [float(i)])
+    # "a" is used again, so "b" is the least recently used one
+    assert cache.get(keys[0]) == [0.0]
+    cache.put(keys[3], [3.0])
+
+    assert cache.get(keys[1]) is None
+    assert len(cache.keys) == 3  # type: ignore[arg-type]
+
+    reopened = EmbeddingCache(str(tmp_path), max_entries=3)
+    assert [reopened.get(key) for key in keys] == [[0.0], None, [2.0], [3.0]]
+    assert list(reopened.slots) == [keys[0], keys[2], keys[3]]
+
+
+def test_slots_reused_by_another_process_are_misses(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "INITIAL_CAPACITY", 1)
+    keys = [EmbeddingCache.get_key(text, "passage") for text in "ab"]
+
+    indexer = EmbeddingCache(str(tmp_path), max_entries=1)
+    indexer.put(keys[0], [1.0])
+    ask = EmbeddingCache(str(tmp_path), max_entries=1)
+    assert ask.get(keys[0]) == [1.0]
+
+    # evicts "a" and writes "b" into the same slot
+    indexer.put(keys[1], [2.0])
+
+    assert ask.get(keys[0]) is None
+    assert keys[0] not in ask.slots
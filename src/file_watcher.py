@@ -0,0 +1,228 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from typing import Iterator, Protocol
+
+# see `man inotify`
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# wd, mask, cookie, length of the name that follows
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class FileWatcher(Protocol):
+    """
+    Reports changed files (relative to the watched root) with a given suffix.
+
+    `None` means the changes are unknown (e.g. a moved folder) and everything needs to be checked.
+    """
+
+    name: str
+
+    def read(self, timeout: float | None) -> set[str] | None:
+        """Changes until the timeout (empty if nothing changed), blocks until any change without one"""
+        ...
+
+    def close(self) -> None: ...
+
+
+def _is_hidden(name: str) -> bool:
+    # e.g. .git or .obsidian, their files are never indexed
+    return name.startswith(".")
+
+
+class InotifyWatcher:
+    """Watcher via the inotify api of linux, every folder of the tree is watched on its own"""
+
+    name = "inotify"
+
+    def __init__(self, root: str, suffix: str = ".md"):
+        self.root = root
+        self.suffix = suffix
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # watch descriptor -> folder
+        self.folders: dict[int, str] = {}
+        try:
+            self._watch_tree(root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _watch_tree(self, folder: str) -> set[str]:
+        """Watch the folder and its subfolders, returns the files already in them"""
+        files: set[str] = set()
+        for path, folders, names in os.walk(folder):
+            folders[:] = [f for f in folders if not _is_hidden(f)]
+
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOENT:
+                    # already deleted again
+                    continue
+                # e.g. the limit of watches is reached (fs.inotify.max_user_watches)
+                raise OSError(error, f"Watching {path} failed")
+            self.folders[wd] = path
+
+            files.update(
+                os.path.relpath(os.path.join(path, n), self.root)
+                for n in names
+                if n.endswith(self.suffix)
+            )
+
+        return files
+
+    def read(self, timeout: float | None) -> set[str] | None:
+        changes: set[str] = set()
+        rescan = False
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        while ready:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = os.fsdecode(
+                    data[
+                        offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length
+                    ].rstrip(b"\0")
+                )
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    # events were dropped
+                    rescan = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.folders.pop(wd, None)
+                    continue
+
+                folder = self.folders.get(wd)
+                if folder is None:
+                    continue
+
+                path = os.path.join(folder, name)
+                if mask & IN_ISDIR:
+                    if _is_hidden(name):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # files can be written before the new folder is watched
+                        changes.update(self._watch_tree(path))
+                    if mask & (IN_MOVED_FROM | IN_MOVED_TO):
+                        # files of moved folders have no events of their own
+                        rescan = True
+                elif name.endswith(self.suffix):
+                    changes.add(os.path.relpath(path, self.root))
+
+        return None if rescan else changes
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Watcher that compares the size and mtime of all files every `interval` seconds"""
+
+    name = "polling"
+
+    def __init__(self, root: str, suffix: str = ".md", interval: float = 1.0):
+        self.root = root
+        self.suffix = suffix
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self) -> dict[str, tuple[int, int]]:
+        snapshot: dict[str, tuple[int, int]] = {}
+        for path, folders, names in os.walk(self.root):
+            folders[:] = [f for f in folders if not _is_hidden(f)]
+            for name in names:
+                if not name.endswith(self.suffix):
+                    continue
+
+                file = os.path.join(path, name)
+                try:
+                    stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                snapshot[os.path.relpath(file, self.root)] = (
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                )
+
+        return snapshot
+
+    def read(self, timeout: float | None) -> set[str] | None:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval
+            if deadline is not None:
+                wait = max(min(wait, deadline - time.monotonic()), 0)
+            time.sleep(wait)
+
+            snapshot = self._snapshot()
+            changes = {
+                file
+                for file in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(file) != self.snapshot.get(file)
+            }
+            self.snapshot = snapshot
+
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self) -> None:
+        pass
+
+
+def create_watcher(
+    root: str, suffix: str = ".md", poll: bool = False, poll_interval: float = 1.0
+) -> FileWatcher:
+    """Inotify watcher on linux, polling everywhere else or if inotify is not usable"""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, suffix)
+        except (OSError, AttributeError):
+            pass
+
+    return PollingWatcher(root, suffix, poll_interval)
+
+
+def watch_changes(watcher: FileWatcher, debounce: float) -> Iterator[set[str] | None]:
+    """
+    Changes in batches, once no file changed for `debounce` seconds.
+
+    Editors tend to write a file multiple times when saving it (e.g. backup, swap and the file itself).
+    """
+    while True:
+        batch = watcher.read(None)
+        if batch == set():
+            # only events of other files
+            continue
+
+        while (changes := watcher.read(debounce)) != set():
+            batch = None if batch is None or changes is None else batch | changes
+
+        yield batch
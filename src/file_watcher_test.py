@@ -0,0 +1,74 @@
+import sys
+
+import pytest
+
+from file_watcher import InotifyWatcher, PollingWatcher, watch_changes
+
+
+class FakeWatcher:
+    name = "fake"
+
+    def __init__(self, reads: list[set[str] | None]):
+        self.reads = reads
+
+    def read(self, timeout: float | None) -> set[str] | None:
+        return self.reads.pop(0)
+
+    def close(self) -> None:
+        pass
+
+
+def test_changes_are_debounced():
+    watcher = FakeWatcher(
+        [set(), {"a.md"}, {"a.md", "b.md"}, set(), {"c.md"}, None, set()]
+    )
+    changes = watch_changes(watcher, debounce=0)
+
+    assert next(changes) == {"a.md", "b.md"}
+    # unknown changes win over known ones
+    assert next(changes) is None
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / "a.md").write_text("a", encoding="utf-8")
+    (tmp_path / ".git").mkdir()
+    watcher = PollingWatcher(str(tmp_path), interval=0)
+
+    assert watcher.read(0) == set()
+
+    (tmp_path / "a.md").write_text("changed", encoding="utf-8")
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.md").write_text("b", encoding="utf-8")
+    (tmp_path / "c.txt").write_text("c", encoding="utf-8")
+    (tmp_path / ".git" / "d.md").write_text("d", encoding="utf-8")
+    assert watcher.read(0) == {"a.md", "sub/b.md"}
+
+    (tmp_path / "a.md").unlink()
+    assert watcher.read(None) == {"a.md"}
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is linux only"
+)
+def test_inotify_watcher(tmp_path):
+    (tmp_path / "a.md").write_text("a", encoding="utf-8")
+    watcher = InotifyWatcher(str(tmp_path))
+    try:
+        assert watcher.read(0) == set()
+
+        (tmp_path / "a.md").write_text("changed", encoding="utf-8")
+        (tmp_path / "c.txt").write_text("c", encoding="utf-8")
+        assert watcher.read(1) == {"a.md"}
+
+        # files of new folders are reported, even if written before the folder is watched
+        (tmp_path / "sub").mkdir()
+        (tmp_path / "sub" / "b.md").write_text("b", encoding="utf-8")
+        assert watcher.read(1) == {"sub/b.md"}
+
+        (tmp_path / "sub" / "b.md").rename(tmp_path / "sub" / "e.md")
+        assert watcher.read(1) == {"sub/b.md", "sub/e.md"}
+
+        (tmp_path / "sub").rename(tmp_path / "moved")
+        assert watcher.read(1) is None
+    finally:
+        watcher.close()
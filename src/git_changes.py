@@ -0,0 +1,94 @@
+import os
+import subprocess
+
+
+def _git(*args: str) -> str:
+    return subprocess.check_output(["git", *args], text=True)
+
+
+def get_repo_root(path: str) -> str:
+    """Root of the git repo of the path, found via its `.git` without starting git"""
+    current = os.path.abspath(path)
+    while True:
+        # `.git` is a file for worktrees and submodules
+        if os.path.exists(os.path.join(current, ".git")):
+            return current
+
+        parent = os.path.dirname(current)
+        if parent == current:
+            # let git report why it is not a repo
+            return subprocess.check_output(
+                ["git", "rev-parse", "--show-toplevel"], cwd=path, text=True
+            ).strip()
+        current = parent
+
+
+def get_head_commit() -> str:
+    return _git("rev-parse", "HEAD").strip()
+
+
+def get_blob_ids() -> dict[str, str]:
+    """
+    Map of all files in the git index to their blob id (git's own content hash).
+
+    Reading the index is enough, no file content has to be read for this.
+    """
+    blobs: dict[str, str] = {}
+    # `-z` to get raw paths, otherwise git quotes paths with special characters
+    for entry in _git("ls-files", "--stage", "-z").split("\0"):
+        if not entry:
+            continue
+
+        # format: <mode> <blob> <stage>\t<path>
+        info, path = entry.split("\t", 1)
+        _, blob, stage = info.split(" ")
+        # ignore conflicting versions of a file during merges
+        if stage == "0":
+            blobs[path] = blob
+
+    return blobs
+
+
+def get_modified_files() -> set[str]:
+    """Files where the working tree differs from the index (blob id would be outdated)"""
+    return {f for f in _git("ls-files", "--modified", "-z").split("\0") if f}
+
+
+def get_changed_files_since(commit: str) -> list[str] | None:
+    """
+    All files that were added, modified or deleted between the given commit and HEAD.
+
+    Returns `None` if the commit is unknown (e.g. rewritten history), so callers can fall back to a full scan.
+    """
+    exists = subprocess.run(
+        ["git", "cat-file", "-e", f"{commit}^{{commit}}"], capture_output=True
+    )
+    if exists.returncode != 0:
+        return None
+
+    output = _git("diff", "--name-status", "--no-renames", "-z", f"{commit}..HEAD")
+    # format: <status>\0<path>\0<status>\0<path>...
+    entries = [e for e in output.split("\0") if e]
+    return entries[1::2]
+
+
+def get_indexable_files(paths: list[str]) -> list[str]:
+    """
+    The given files that exist and are committed or at least not ignored by git (e.g. new notes).
+    """
+    if not paths:
+        # without paths git would list all files
+        return []
+
+    # literal, as paths could contain glob characters
+    output = _git(
+        "--literal-pathspecs",
+        "ls-files",
+        "--cached",
+        "--others",
+        "--exclude-standard",
+        "-z",
+        "--",
+        *paths,
+    )
+    return sorted({f for f in output.split("\0") if f and os.path.exists(f)})
@@ -0,0 +1,77 @@
+import subprocess
+
+from git_changes import (
+    get_blob_ids,
+    get_changed_files_since,
+    get_head_commit,
+    get_indexable_files,
+    get_modified_files,
+    get_repo_root,
+)
+
+
+def git(*args: str) -> str:
+    return subprocess.check_output(["git", *args], text=True).strip()
+
+
+def commit_all(message: str) -> None:
+    git("add", "-A")
+    git("-c", "user.name=test", "-c", "user.email=test@test", "commit", "-qm", message)
+
+
+def test_git_change_detection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    git("init", "-q")
+
+    (tmp_path / "a.md").write_text("a", encoding="utf-8")
+    (tmp_path / "b.md").write_text("b", encoding="utf-8")
+    commit_all("initial")
+    initial_commit = get_head_commit()
+
+    blobs = get_blob_ids()
+    assert sorted(blobs) == ["a.md", "b.md"]
+    assert blobs["a.md"] == git("hash-object", "a.md")
+    assert get_modified_files() == set()
+    assert get_changed_files_since(initial_commit) == []
+
+    (tmp_path / "a.md").write_text("changed", encoding="utf-8")
+    assert get_modified_files() == {"a.md"}
+
+    (tmp_path / "b.md").unlink()
+    (tmp_path / "c.md").write_text("c", encoding="utf-8")
+    commit_all("change")
+
+    assert sorted(get_changed_files_since(initial_commit) or []) == [
+        "a.md",
+        "b.md",
+        "c.md",
+    ]
+    assert get_changed_files_since("0" * 40) is None
+
+
+def test_indexable_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    git("init", "-q")
+
+    (tmp_path / ".gitignore").write_text("ignored.md\n", encoding="utf-8")
+    (tmp_path / "a.md").write_text("a", encoding="utf-8")
+    commit_all("initial")
+    (tmp_path / "new.md").write_text("new", encoding="utf-8")
+    (tmp_path / "ignored.md").write_text("ignored", encoding="utf-8")
+
+    assert get_indexable_files([]) == []
+    assert get_indexable_files(["a.md", "new.md", "ignored.md", "gone.md"]) == [
+        "a.md",
+        "new.md",
+    ]
+    # not a glob
+    assert get_indexable_files(["*.md"]) == []
+
+
+def test_repo_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    git("init", "-q")
+    (tmp_path / "daily" / "2025").mkdir(parents=True)
+
+    assert get_repo_root(str(tmp_path / "daily" / "2025")) == str(tmp_path)
+    assert get_repo_root(str(tmp_path)) == str(tmp_path)
@@ -0,0 +1,315 @@
+import json
+import os
+import threading
+from typing import Any
+
+import numpy as np
+
+from embedder import Embedder
+from vector_store import Match
+
+# rows of the vector matrix that are allocated at once, it grows by doubling
+INITIAL_CAPACITY = 1024
+
+
+def matches_filter(metadata: dict[str, Any], filter: dict[str, Any] | None) -> bool:
+    """Subset of the Pinecone metadata filter syntax: `$eq`, `$ne`, `$in`, `$nin`, `$and` and `$or`"""
+    if not filter:
+        return True
+
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, f) for f in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_filter(metadata, f) for f in condition):
+                return False
+            continue
+
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$ne" and value == operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$nin" and value in operand:
+                return False
+
+    return True
+
+
+class LocalVectorStore:
+    """
+    Vector store on the local disk, meant for offline use, tests and benchmarks.
+
+    Vectors are normalized and stored in a memory-mapped matrix (`vectors.npy`), so the cosine
+    similarity is a single matrix-vector product. The metadata of the rows is kept in memory and
+    persisted as an append only log (`records.jsonl`), which is compacted when it is loaded.
+    """
+
+    def __init__(self, path: str, embedder: Embedder):
+        self.path = path
+        self.embedder = embedder
+        self.vectors_path = os.path.join(path, "vectors.npy")
+        self.records_path = os.path.join(path, "records.jsonl")
+        self.lock = threading.Lock()
+
+        # row -> (namespace, id, metadata), deleted rows are None and reused
+        self.rows: list[tuple[str, str, dict[str, Any]] | None] = []
+        self.row_ids: dict[tuple[str, str], int] = {}
+        self.free_rows: list[int] = []
+        # active rows of every namespace, to search without looking at the metadata
+        self.active: dict[str, np.ndarray] = {}
+        self.vectors: np.memmap | None = None
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1] if self.vectors is not None else 0
+
+    def _load(self) -> None:
+        if os.path.exists(self.vectors_path):
+            self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+        if not os.path.exists(self.records_path):
+            return
+
+        log_lines = 0
+        with open(self.records_path, "r", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                log_lines += 1
+                if entry.get("deleted"):
+                    self._set_row(entry["row"], None)
+                else:
+                    self._set_row(
+                        entry["row"],
+                        (entry["namespace"], entry["id"], entry["metadata"]),
+                    )
+
+        self.free_rows = [i for i, row in enumerate(self.rows) if row is None]
+        self.free_rows.reverse()
+
+        # drop overwritten and deleted entries from the log
+        if log_lines > 2 * (len(self.rows) - len(self.free_rows)) + 100:
+            self._compact()
+
+    def _compact(self) -> None:
+        tmp_path = f"{self.records_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for i, row in enumerate(self.rows):
+                if row is not None:
+                    f.write(self._log_entry(i, row) + "\n")
+        os.replace(tmp_path, self.records_path)
+
+    @staticmethod
+    def _log_entry(row: int, record: tuple[str, str, dict[str, Any]] | None) -> str:
+        if record is None:
+            return json.dumps({"row": row, "deleted": True})
+
+        namespace, id, metadata = record
+        return json.dumps(
+            {"row": row, "namespace": namespace, "id": id, "metadata": metadata},
+            ensure_ascii=False,
+        )
+
+    def _append_log(self, entries: list[str]) -> None:
+        with open(self.records_path, "a", encoding="utf-8") as f:
+            f.write("".join(e + "\n" for e in entries))
+
+    def _set_row(self, row: int, record: tuple[str, str, dict[str, Any]] | None):
+        while len(self.rows) <= row:
+            self.rows.append(None)
+
+        old_record = self.rows[row]
+        if old_record is not None:
+            self.row_ids.pop((old_record[0], old_record[1]), None)
+            self._active_mask(old_record[0])[row] = False
+
+        self.rows[row] = record
+        if record is not None:
+            self.row_ids[(record[0], record[1])] = row
+            self._active_mask(record[0])[row] = True
+
+    def _active_mask(self, namespace: str) -> np.ndarray:
+        mask = self.active.get(namespace)
+        capacity = max(
+            len(self.rows), self.vectors.shape[0] if self.vectors is not None else 0
+        )
+        if mask is None or len(mask) < capacity:
+            new_mask = np.zeros(capacity, dtype=bool)
+            if mask is not None:
+                new_mask[: len(mask)] = mask
+            mask = self.active[namespace] = new_mask
+
+        return mask
+
+    def _ensure_capacity(self, rows: int, dimension: int) -> None:
+        if self.vectors is not None and self.vectors.shape[1] != dimension:
+            raise ValueError(
+                f"Dimension {dimension} does not match the store dimension {self.vectors.shape[1]}"
+            )
+        if self.vectors is not None and self.vectors.shape[0] >= rows:
+            return
+
+        capacity = (
+            self.vectors.shape[0] if self.vectors is not None else INITIAL_CAPACITY
+        )
+        while capacity < rows:
+            capacity *= 2
+
+        # grow by copying into a new file, which replaces the old one at once
+        tmp_path = os.path.join(self.path, "vectors.tmp.npy")
+        vectors = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dimension)
+        )
+        if self.vectors is not None:
+            vectors[: self.vectors.shape[0]] = self.vectors
+        vectors.flush()
+        del vectors
+
+        self.vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+    def upsert_records(self, namespace: str, records: list[dict]) -> None:
+        if not records:
+            return
+
+        vectors = np.asarray(
+            self.embedder.embed([r["text"] for r in records], "passage"),
+            dtype=np.float32,
+        )
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        with self.lock:
+            rows: list[int] = []
+            for record in records:
+                row = self.row_ids.get((namespace, record["id"]))
+                if row is None:
+                    row = self.free_rows.pop() if self.free_rows else len(self.rows)
+                    # reserve the row, so following records do not get the same one
+                    while len(self.rows) <= row:
+                        self.rows.append(None)
+                rows.append(row)
+
+            self._ensure_capacity(max(rows) + 1, vectors.shape[1])
+            assert self.vectors is not None
+            self.vectors[rows] = vectors
+            self.vectors.flush()
+
+            entries: list[str] = []
+            for row, record in zip(rows, records):
+                metadata = {k: v for k, v in record.items() if k != "id"}
+                self._set_row(row, (namespace, record["id"], metadata))
+                entries.append(self._log_entry(row, self.rows[row]))
+            self._append_log(entries)
+
+    def update(self, id: str, set_metadata: dict[str, Any], namespace: str) -> None:
+        with self.lock:
+            row = self.row_ids.get((namespace, id))
+            if row is None:
+                return
+
+            _, _, metadata = self.rows[row] or ("", "", {})
+            self._set_row(row, (namespace, id, {**metadata, **set_metadata}))
+            self._append_log([self._log_entry(row, self.rows[row])])
+
+    def delete(
+        self,
+        namespace: str,
+        ids: list[str] | None = None,
+        filter: dict[str, Any] | None = None,
+    ) -> None:
+        with self.lock:
+            if ids is not None:
+                rows = [
+                    self.row_ids[(namespace, id)]
+                    for id in ids
+                    if (namespace, id) in self.row_ids
+                ]
+            else:
+                rows = [
+                    i
+                    for i in np.flatnonzero(self._active_mask(namespace)).tolist()
+                    if matches_filter(self.rows[i][2], filter)  # type: ignore[index]
+                ]
+
+            for row in rows:
+                self._set_row(row, None)
+            self.free_rows.extend(reversed(rows))
+            self._append_log([self._log_entry(row, None) for row in rows])
+
+    def delete_namespace(self, namespace: str) -> None:
+        # without ids and filter all records of the namespace are deleted
+        self.delete(namespace)
+
+    def query(
+        self,
+        namespace: str,
+        vector: list[float],
+        top_k: int,
+        filter: dict[str, Any] | None = None,
+    ) -> list[Match]:
+        with self.lock:
+            if self.vectors is None:
+                return []
+
+            rows = min(len(self.rows), self.vectors.shape[0])
+            mask = self._active_mask(namespace)[:rows].copy()
+            if filter:
+                for i in np.flatnonzero(mask).tolist():
+                    mask[i] = matches_filter(self.rows[i][2], filter)  # type: ignore[index]
+
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+
+            query = np.asarray(vector, dtype=np.float32)
+            query = query / (np.linalg.norm(query) or 1)
+            # vectors are normalized, so the dot product is the cosine similarity
+            scores = (self.vectors[:rows] @ query)[candidates]
+
+            # only sort the best results
+            k = min(top_k, len(candidates))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            matches: list[Match] = []
+            for i in best.tolist():
+                _, id, metadata = self.rows[candidates[i]]  # type: ignore[misc]
+                matches.append(
+                    {"id": id, "score": float(scores[i]), "metadata": metadata}
+                )
+
+            return matches
+
+    def count(self, namespace: str) -> int:
+        with self.lock:
+            return int(self._active_mask(namespace).sum())
+
+    def list_ids(self, namespace: str) -> list[str]:
+        with self.lock:
+            return [
+                self.rows[i][1]  # type: ignore[index]
+                for i in np.flatnonzero(self._active_mask(namespace)).tolist()
+            ]
+
+    def fetch_metadata(
+        self, namespace: str, ids: list[str]
+    ) -> dict[str, dict[str, Any]]:
+        with self.lock:
+            return {
+                id: self.rows[self.row_ids[(namespace, id)]][2]  # type: ignore[index]
+                for id in ids
+                if (namespace, id) in self.row_ids
+            }
@@ -0,0 +1,65 @@
+import local_vector_store
+from local_vector_store import LocalVectorStore, matches_filter
+
+
+class LetterEmbedder:
+    model = "letters"
+
+    def embed(self, texts: list[str], input_type: str) -> list[list[float]]:
+        # counts of a few letters, enough to have distinct directions
+        return [[float(text.count(c)) for c in "abc"] for text in texts]
+
+
+embedder = LetterEmbedder()
+
+
+def record(id: str, text: str, hash: str = "h1") -> dict:
+    return {"id": id, "text": text, "hash": hash, "filename": f"{id}.md"}
+
+
+def test_query_returns_the_most_similar_records(tmp_path):
+    store = LocalVectorStore(str(tmp_path), embedder)
+    store.upsert_records(
+        "default",
+        [record("a", "aaa"), record("b", "bbb"), record("ab", "aab", hash="h2")],
+    )
+    store.upsert_records("other", [record("a2", "aaa")])
+
+    matches = store.query("default", vector=[1.0, 0.0, 0.0], top_k=2)
+    assert [m["id"] for m in matches] == ["a", "ab"]
+    assert matches[0]["score"] == 1.0
+    assert matches[0]["metadata"]["text"] == "aaa"
+
+    filtered = store.query(
+        "default", vector=[1.0, 0.0, 0.0], top_k=5, filter={"hash": {"$in": ["h2"]}}
+    )
+    assert [m["id"] for m in filtered] == ["ab"]
+
+
+def test_changes_are_persisted(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_vector_store, "INITIAL_CAPACITY", 2)
+
+    store = LocalVectorStore(str(tmp_path), embedder)
+    store.upsert_records(
+        "default", [record("a", "a"), record("b", "b"), record("c", "c")]
+    )
+    store.update("b", {"filename": "moved.md"}, namespace="default")
+    store.delete("default", ids=["a"])
+    store.delete("default", filter={"filename": "c.md"})
+    # deleted rows are reused
+    store.upsert_records("default", [record("d", "aab")])
+
+    reopened = LocalVectorStore(str(tmp_path), embedder)
+    assert reopened.dimension == 3
+    matches = reopened.query("default", vector=[1.0, 1.0, 1.0], top_k=10)
+    assert sorted(m["id"] for m in matches) == ["b", "d"]
+    assert {m["id"]: m["metadata"]["filename"] for m in matches}["b"] == "moved.md"
+    assert len(reopened.rows) == 3
+
+
+def test_matches_filter():
+    metadata = {"hash": "h1", "type": "list"}
+    assert matches_filter(metadata, None)
+    assert matches_filter(metadata, {"hash": "h1", "type": {"$ne": "section"}})
+    assert not matches_filter(metadata, {"hash": {"$nin": ["h1"]}})
+    assert matches_filter(metadata, {"$or": [{"hash": "h2"}, {"type": "list"}]})
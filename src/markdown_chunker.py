@@ -1,106 +1,389 @@
 import re
-from typing import TypedDict
+from collections import deque
+from typing import Literal, TypedDict
 
+# match headings beginning with repeated `#`
+HEADING_PATTERN = re.compile(r"^(#{1,6}) (.+)")
+# match `- [ ]` or `- [x]` or `- [/]` or `- `
+LIST_ITEM_PATTERN = re.compile(r"^- (\[[xX/ ]\] )?(.+)")
 
-def chunk_markdown_by_heading(markdown: str) -> list[str]:
-    """
-    Splits the given markdown string into sections based on headings.
-    Each section is a string with the content of the section.
+# nested: parents include all their children, flat: leaf sections and short parent summaries
+SectionMode = Literal["nested", "flat"]
+# lines of the own content of a parent section, that are part of its summary in the flat mode
+SUMMARY_LINES = 3
 
-    Child sections are included in their parent section.
+# words (as a whole) and single punctuation characters, used for a rough token estimation
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# words with their trailing whitespace, to split overlong lines
+WORD_PATTERN = re.compile(r"\S+\s*")
+
+
+class Section(TypedDict):
+    heading: str
+    level: int
+    result: str | None
+
+
+class ChunkSavings(TypedDict):
+    characters: int
+    records: int
+
+
+class MarkdownChunks(TypedDict):
+    sections: list[str]
+    lists: list[str]
+    # compared to the nested section mode
+    savings: ChunkSavings
+
+
+def chunk_markdown(
+    markdown: str,
+    section_mode: SectionMode = "nested",
+    summary_lines: int = SUMMARY_LINES,
+    max_tokens: int | None = None,
+) -> MarkdownChunks:
     """
+    Splits the given markdown string into section and list chunks.
+
+    Every line is only looked at once, both chunk types are collected in the same pass.
+    See `chunk_markdown_by_heading` and `chunk_markdown_by_list` for the resulting chunks.
 
-    class Section(TypedDict):
-        heading: str
-        level: int
-        result: str | None
+    The flat section mode does not repeat child sections in their parents, instead it returns
+    leaf sections with their heading path and summaries (heading path and first lines) of parents.
+
+    With `max_tokens` chunks that are (estimated to be) longer, are split into multiple chunks.
+    """
 
-    lines = markdown.splitlines()
     sections: list[Section] = []
-    current: Section | None = None
-    temporary_content: list[str] = []
-
-    # build a list with all direct data of the given sections (meaning parent headings have no child content)
-    for line in lines:
-        # match headings beginning with repeated `#`
-        match = re.match(r"^(#{1,6}) (.+)", line)
-        if match:
-            if current:
-                current["result"] = "\n".join(temporary_content).strip()
-                sections.append(current)
-
-            # store initial heading and clear previous temporary content
-            temporary_content = [line]
-            current = {
-                "heading": match[2].strip(),
-                "level": len(match[1]),
+    current_section: Section | None = None
+    section_content: list[str] = []
+
+    markdown_lists: list[str] = []
+    current_list: list[str] | None = None
+    current_heading: str = ""
+
+    for line in markdown.splitlines():
+        heading_match = HEADING_PATTERN.match(line)
+        if heading_match:
+            # sections: store the previous section and start a new one with the heading
+            if current_section:
+                current_section["result"] = "\n".join(section_content).strip()
+                sections.append(current_section)
+
+            section_content = [line]
+            current_section = {
+                "heading": heading_match[2].strip(),
+                "level": len(heading_match[1]),
                 "result": None,
             }
-        elif current:
-            temporary_content.append(line)
 
-    # add the last section
-    if current:
-        current["result"] = "\n".join(temporary_content).strip()
-        sections.append(current)
+            # lists: update the current heading to add as information
+            current_heading = line + "\n"
+            continue
 
-    # enhance lists, to let parents include their children, based on ordering
-    chunked_markdown: list[str] = []
-    for i, section in enumerate(sections):
-        initial_level = section["level"]
-        current_section: list[Section] = []
+        if current_section:
+            section_content.append(line)
+
+        if LIST_ITEM_PATTERN.match(line):
+            if current_list:
+                markdown_lists.append("\n".join(current_list))
 
-        # only iterate over following sections, as children can not exist before their parents
-        for n, sub_section in enumerate(sections[i:]):
-            # if we reach the same heading level (which is not the original one), we are done
-            if n != 0 and sub_section["level"] <= initial_level:
-                break
+            current_list = [current_heading, line]
+        # only add sub list items and continuation lines of multi-line list items,
+        # meaning it starts with at least one space
+        elif current_list and line[:1].isspace():
+            current_list.append(line)
 
-            current_section.append(sub_section)
+    # add the last section and list
+    if current_section:
+        current_section["result"] = "\n".join(section_content).strip()
+        sections.append(current_section)
 
-        joined_sections = [
-            s["result"] for s in current_section if s["result"] is not None
+    if current_list:
+        markdown_lists.append("\n".join(current_list))
+
+    lists = [list.strip() for list in markdown_lists]
+    if section_mode == "nested":
+        chunks: MarkdownChunks = {
+            "sections": _include_child_sections(sections),
+            "lists": lists,
+            "savings": {"characters": 0, "records": 0},
+        }
+    else:
+        flat_sections = _flatten_sections(sections, summary_lines)
+        chunks = {
+            "sections": flat_sections,
+            "lists": lists,
+            "savings": {
+                "characters": sum(_get_nested_section_lengths(sections))
+                - sum(len(s) for s in flat_sections),
+                "records": len(sections) - len(flat_sections),
+            },
+        }
+
+    if max_tokens:
+        chunks["sections"] = [
+            part for s in chunks["sections"] for part in split_chunk(s, max_tokens)
+        ]
+        chunks["lists"] = [
+            part for s in chunks["lists"] for part in split_chunk(s, max_tokens)
         ]
-        chunked_markdown.append("\n\n".join(joined_sections))
 
-    return chunked_markdown
+    return chunks
 
 
-def chunk_markdown_by_list(markdown: str) -> list[str]:
+def estimate_tokens(text: str) -> int:
     """
-    Return a list of all lists, tasks, todos with its main heading
+    Cheap local estimation of the tokens of the embedding model (sentencepiece based).
+
+    Every word and punctuation character is at least one token, longer words are split further.
+    It is meant to be on the safe side, rather than exact.
     """
+    return sum(1 + len(token) // 6 for token in TOKEN_PATTERN.findall(text))
 
-    lines = markdown.splitlines()
-    markdown_lists: list[str] = []
-    current: list[str] | None = None
-    current_heading: str = ""
 
-    # build a list with all direct data of the given sections (meaning parent headings have no child content)
-    for line in lines:
-        # match `- [ ]` or `- [x]` or `- [/]` or `- `
-        match = re.match(r"^- (\[[xX/ ]\] )?(.+)", line)
-        if match:
-            if current:
-                markdown_lists.append("\n".join(current))
+def split_chunk(chunk: str, max_tokens: int) -> list[str]:
+    """
+    Split a chunk that exceeds the token budget at paragraph or list item boundaries.
+
+    Every part starts with the heading path (parent headings) of its first block, to keep the context.
+    The heading path takes at most half of the budget, outer headings are dropped first.
+    Blocks that do not fit are split by lines, then by words and as a last resort by characters.
+    """
+    if estimate_tokens(chunk) <= max_tokens:
+        return [chunk]
+
+    parts: list[str] = []
+    current = ""
+    current_tokens = 0
+    # do not split directly after headings, they belong to the following content
+    current_has_content = False
+    heading_path: list[tuple[int, str]] = []
+
+    # (text, separator to the previous block, continues the previous block)
+    blocks = deque((text, separator, False) for text, separator in _split_blocks(chunk))
+    while blocks:
+        block, separator, continued = blocks.popleft()
+        heading_match = None if continued else HEADING_PATTERN.match(block)
+        if heading_match:
+            level = len(heading_match[1])
+            while heading_path and heading_path[-1][0] >= level:
+                heading_path.pop()
+
+        block_tokens = estimate_tokens(block)
+        # a part of only headings is kept as well, if nothing else fits next to them
+        if current and current_tokens + block_tokens > max_tokens:
+            if current_has_content or current_tokens >= max_tokens:
+                parts.append(current)
+
+                current = _get_heading_prefix(heading_path, max_tokens // 2)
+                current_tokens = estimate_tokens(current)
+                current_has_content = False
+                # the heading path is always followed by an empty line
+                separator = "\n\n"
+
+        # words are separated by whitespace, so the tokens of joined texts add up
+        available = max_tokens - current_tokens
+        if block_tokens > available:
+            block, rest = _split_text(block, available)
+            if rest:
+                blocks.appendleft((rest, "\n", True))
+            block_tokens = estimate_tokens(block)
+
+        current = f"{current}{separator}{block}" if current else block
+        current_tokens += block_tokens
+        current_has_content = (
+            current_has_content or continued or "\n" in block or not heading_match
+        )
+
+        if heading_match:
+            heading_path.append((len(heading_match[1]), block.split("\n", 1)[0]))
+
+    parts.append(current)
+    return parts
+
+
+def _get_heading_prefix(heading_path: list[tuple[int, str]], max_tokens: int) -> str:
+    """Innermost headings of the path that fit into the budget"""
+    headings: list[str] = []
+    tokens = 0
+    for _, heading in reversed(heading_path):
+        tokens += estimate_tokens(heading)
+        if tokens > max_tokens:
+            break
+        headings.insert(0, heading)
+
+    return "\n".join(headings)
+
+
+def _split_text(text: str, max_tokens: int) -> tuple[str, str]:
+    """
+    Longest start of the text (and the rest) within the budget, split at a line, word or character.
+
+    The start is never empty, to always make progress (a single character is at most one token).
+    """
+    lines = text.split("\n")
+    head_tokens = 0
+    for i, line in enumerate(lines):
+        head_tokens += estimate_tokens(line)
+        if head_tokens > max_tokens:
+            if i:
+                return "\n".join(lines[:i]), "\n".join(lines[i:])
+            break
+
+    line, rest = lines[0], "\n".join(lines[1:])
+    end = 0
+    for word in WORD_PATTERN.finditer(line):
+        if estimate_tokens(line[: word.end()]) > max_tokens:
+            break
+        end = word.end()
+
+    if not end:
+        # a single word (e.g. a long url) does not fit
+        end = 1
+        while end < len(line) and estimate_tokens(line[: end + 1]) <= max_tokens:
+            end += 1
 
-            current = [current_heading, line]
+    head = line[:end].rstrip()
+    tail = line[end:].lstrip()
+    return head, f"{tail}\n{rest}" if tail and rest else tail or rest
+
+
+def _split_blocks(chunk: str) -> list[tuple[str, str]]:
+    """
+    Paragraphs and top level list items (with their sub items).
+
+    Each block comes with the separator to its previous block, to keep lists together.
+    """
+    blocks: list[tuple[str, str]] = []
+    current: list[str] = []
+    separator = "\n"
+    for line in chunk.splitlines():
+        if not line.strip():
+            if current:
+                blocks.append(("\n".join(current), separator))
+            current = []
+            separator = "\n\n"
+        elif LIST_ITEM_PATTERN.match(line):
+            if current:
+                blocks.append(("\n".join(current), separator))
+                separator = "\n"
+            current = [line]
         else:
-            # update the current heading to add as information
-            if re.match(r"^(#{1,6}) (.+)", line):
-                current_heading = line + "\n"
-                continue
-
-            # only add when its some sub list item, meaning it has at least one space
-            match = re.match(r"\s+- (\[[xX/ ]\] )?(.+)", line)
-            if current and match:
-                current.append(line)
-            # handle continuation lines that are part of a multi-line list item
-            elif current and re.match(r"\s+", line):
-                current.append(line)
-
-    # add the last list
+            current.append(line)
+
     if current:
-        markdown_lists.append("\n".join(current))
+        blocks.append(("\n".join(current), separator))
+
+    return blocks
+
+
+def _get_section_tree(sections: list[Section]) -> tuple[list[int], list[int | None]]:
+    """
+    Index of the last child (or the section itself) and the parent of every section.
+
+    Found in a single pass via a stack of open (not yet closed) sections.
+    """
+    last_child = list(range(len(sections)))
+    parent: list[int | None] = [None] * len(sections)
+    open_sections: list[int] = []
+    for i, section in enumerate(sections):
+        # reaching the same or a higher heading level closes the open sections
+        while (
+            open_sections and sections[open_sections[-1]]["level"] >= section["level"]
+        ):
+            last_child[open_sections.pop()] = i - 1
+
+        parent[i] = open_sections[-1] if open_sections else None
+        open_sections.append(i)
+
+    for i in open_sections:
+        last_child[i] = len(sections) - 1
+
+    return last_child, parent
+
+
+def _get_section_offsets(results: list[str]) -> tuple[list[int], list[int]]:
+    """Start and end offsets of every section, when joined with an empty line"""
+    starts: list[int] = []
+    ends: list[int] = []
+    offset = 0
+    for result in results:
+        starts.append(offset)
+        ends.append(offset + len(result))
+        offset += len(result) + 2
+
+    return starts, ends
+
+
+def _include_child_sections(sections: list[Section]) -> list[str]:
+    """
+    Let parents include their children, based on ordering.
+
+    All sections are joined once, each chunk is then a slice from the start of its section
+    to the end of its last child.
+    """
+    results = [s["result"] or "" for s in sections]
+    joined = "\n\n".join(results)
+    starts, ends = _get_section_offsets(results)
+    last_child, _ = _get_section_tree(sections)
+
+    return [joined[starts[i] : ends[last_child[i]]] for i in range(len(sections))]
+
+
+def _get_nested_section_lengths(sections: list[Section]) -> list[int]:
+    """Lengths of the chunks of `_include_child_sections`, without building them"""
+    starts, ends = _get_section_offsets([s["result"] or "" for s in sections])
+    last_child, _ = _get_section_tree(sections)
+
+    return [ends[last_child[i]] - starts[i] for i in range(len(sections))]
+
+
+def _flatten_sections(sections: list[Section], summary_lines: int) -> list[str]:
+    last_child, parent = _get_section_tree(sections)
+
+    # heading path of every section, parents always come before their children
+    heading_paths: list[str] = []
+    chunks: list[str] = []
+    for i, section in enumerate(sections):
+        heading_line, _, content = (section["result"] or "").partition("\n")
+        parent_index = parent[i]
+        heading_path = (
+            f"{heading_paths[parent_index]}\n{heading_line}"
+            if parent_index is not None
+            else heading_line
+        )
+        heading_paths.append(heading_path)
+
+        content = content.strip()
+        if last_child[i] == i:
+            chunks.append(f"{heading_path}\n\n{content}" if content else heading_path)
+            continue
+
+        # parents without own content are already represented by the heading path of their children
+        summary = [line for line in content.splitlines() if line.strip()][
+            :summary_lines
+        ]
+        if summary:
+            chunks.append(heading_path + "\n\n" + "\n".join(summary))
+
+    return chunks
+
+
+def chunk_markdown_by_heading(markdown: str) -> list[str]:
+    """
+    Splits the given markdown string into sections based on headings.
+    Each section is a string with the content of the section.
+
+    Child sections are included in their parent section.
+    """
+
+    return chunk_markdown(markdown)["sections"]
+
+
+def chunk_markdown_by_list(markdown: str) -> list[str]:
+    """
+    Return a list of all lists, tasks, todos with its main heading
+    """
 
-    return [list.strip() for list in markdown_lists]
+    return chunk_markdown(markdown)["lists"]
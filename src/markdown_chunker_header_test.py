@@ -1,4 +1,9 @@
-from markdown_chunker import chunk_markdown_by_heading
+from markdown_chunker import (
+    chunk_markdown,
+    chunk_markdown_by_heading,
+    chunk_markdown_by_list,
+    estimate_tokens,
+)
 
 example_markdown = """
 # 2025-04-17 (Thursday)
@@ -81,3 +86,114 @@ def test_markdown_chunks():
     assert result[2] == example_markdown_repeating_section
     assert result[3] == example_markdown_normal_section
     assert result[4] == example_markdown_private_section
+
+
+def test_combined_chunks():
+    # see markdown_chunker_reference_test.py for the comparison with the original chunkers
+    result = chunk_markdown(example_markdown)
+
+    assert result["sections"] == [
+        example_markdown,
+        example_markdown_work_section,
+        example_markdown_repeating_section,
+        example_markdown_normal_section,
+        example_markdown_private_section,
+    ]
+    assert result["lists"] == [
+        "### repeating tasks\n\n- [x] test 1",
+        "### repeating tasks\n\n- [x] test 2\n  - [/] test 2.1",
+        "### repeating tasks\n\n- [x] test 3",
+        "### normal tasks\n\n- [x] task 1",
+        "### normal tasks\n\n- [x] task 2\n  - [x] task 2.1\n    - note 2.1.1\n    - [x] task 2.1.2\n  - note 2.2",
+        "## private\n\n- [x] private task 1",
+    ]
+
+
+def test_flat_section_chunks():
+    result = chunk_markdown(example_markdown, section_mode="flat")
+
+    # only leaf sections with their heading path, the parents have no own content
+    assert result["sections"] == [
+        "# 2025-04-17 (Thursday)\n## work\n" + example_markdown_repeating_section,
+        "# 2025-04-17 (Thursday)\n## work\n" + example_markdown_normal_section,
+        "# 2025-04-17 (Thursday)\n" + example_markdown_private_section,
+    ]
+    assert result["lists"] == chunk_markdown_by_list(example_markdown)
+
+    nested_sections = chunk_markdown_by_heading(example_markdown)
+    assert result["savings"] == {
+        "characters": sum(len(s) for s in nested_sections)
+        - sum(len(s) for s in result["sections"]),
+        "records": 2,
+    }
+
+
+def test_flat_section_summaries():
+    markdown = """
+# Topic
+
+intro line 1
+intro line 2
+
+## Details
+
+some details
+""".strip()
+
+    result = chunk_markdown(markdown, section_mode="flat", summary_lines=1)
+
+    assert result["sections"] == [
+        "# Topic\n\nintro line 1",
+        "# Topic\n## Details\n\nsome details",
+    ]
+
+
+def test_oversized_chunks_are_split_with_heading_path():
+    tasks = [f"- task {i} with some more words" for i in range(10)]
+    first_tasks = "\n".join(tasks[:5])
+    last_tasks = "\n".join(tasks[5:])
+    markdown = (
+        f"# Day\n\n## work\n\n{first_tasks}\n{last_tasks}\n\n## private\n\nshort note"
+    )
+
+    sections = chunk_markdown(markdown, max_tokens=40)["sections"]
+
+    assert sections == [
+        f"# Day\n\n## work\n\n{first_tasks}",
+        f"# Day\n## work\n\n{last_tasks}",
+        "# Day\n\n## private\n\nshort note",
+        f"## work\n\n{first_tasks}",
+        f"## work\n\n{last_tasks}",
+        "## private\n\nshort note",
+    ]
+    assert all(estimate_tokens(s) <= 40 for s in sections)
+
+    # chunks within the budget are not touched
+    assert chunk_markdown(markdown, max_tokens=10_000)["sections"] == (
+        chunk_markdown_by_heading(markdown)
+    )
+
+
+def test_split_chunks_stay_within_the_budget():
+    tasks = "\n".join(f"- task {i} with some more words" for i in range(10))
+    paragraph = " ".join(f"word{i}" for i in range(200))
+    long_word = "x" * 500
+    markdown = (
+        "# Day\n\n## work\n\n### project with a longer heading\n\n"
+        + f"{tasks}\n\n{paragraph}\n\n{long_word}\n\n#### details\n\n{tasks}"
+    )
+
+    for max_tokens in [10, 40, 100]:
+        sections = chunk_markdown(markdown, max_tokens=max_tokens)["sections"]
+        assert all(estimate_tokens(s) <= max_tokens for s in sections)
+
+        # nothing is lost, only headings are repeated
+        words = {w for s in sections for w in s.split() if not w.startswith("#")}
+        assert {f"word{i}" for i in range(200)} <= words
+
+    sections = chunk_markdown(markdown, max_tokens=40)["sections"]
+    # follow-up parts keep the heading path
+    assert any(
+        s.startswith("# Day\n## work\n### project with a longer heading\n\nword")
+        for s in sections
+    )
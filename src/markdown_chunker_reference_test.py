@@ -0,0 +1,149 @@
+import random
+import re
+from typing import TypedDict
+
+from markdown_chunker import chunk_markdown
+
+# frozen copies of the original chunkers (one pass per chunk type, quadratic nesting of sections),
+# the single pass chunker has to produce the same chunks
+
+
+def reference_chunk_markdown_by_heading(markdown: str) -> list[str]:
+    class Section(TypedDict):
+        heading: str
+        level: int
+        result: str | None
+
+    lines = markdown.splitlines()
+    sections: list[Section] = []
+    current: Section | None = None
+    temporary_content: list[str] = []
+
+    for line in lines:
+        match = re.match(r"^(#{1,6}) (.+)", line)
+        if match:
+            if current:
+                current["result"] = "\n".join(temporary_content).strip()
+                sections.append(current)
+
+            temporary_content = [line]
+            current = {
+                "heading": match[2].strip(),
+                "level": len(match[1]),
+                "result": None,
+            }
+        elif current:
+            temporary_content.append(line)
+
+    if current:
+        current["result"] = "\n".join(temporary_content).strip()
+        sections.append(current)
+
+    chunked_markdown: list[str] = []
+    for i, section in enumerate(sections):
+        initial_level = section["level"]
+        current_section: list[Section] = []
+
+        for n, sub_section in enumerate(sections[i:]):
+            if n != 0 and sub_section["level"] <= initial_level:
+                break
+
+            current_section.append(sub_section)
+
+        joined_sections = [
+            s["result"] for s in current_section if s["result"] is not None
+        ]
+        chunked_markdown.append("\n\n".join(joined_sections))
+
+    return chunked_markdown
+
+
+def reference_chunk_markdown_by_list(markdown: str) -> list[str]:
+    lines = markdown.splitlines()
+    markdown_lists: list[str] = []
+    current: list[str] | None = None
+    current_heading: str = ""
+
+    for line in lines:
+        match = re.match(r"^- (\[[xX/ ]\] )?(.+)", line)
+        if match:
+            if current:
+                markdown_lists.append("\n".join(current))
+
+            current = [current_heading, line]
+        else:
+            if re.match(r"^(#{1,6}) (.+)", line):
+                current_heading = line + "\n"
+                continue
+
+            match = re.match(r"\s+- (\[[xX/ ]\] )?(.+)", line)
+            if current and match:
+                current.append(line)
+            elif current and re.match(r"\s+", line):
+                current.append(line)
+
+    if current:
+        markdown_lists.append("\n".join(current))
+
+    return [list.strip() for list in markdown_lists]
+
+
+# lines that are (almost) headings, list items, continuations and plain text
+LINES = [
+    "# Day",
+    "## work",
+    "### tasks",
+    "#### details",
+    "###### deepest",
+    "####### too deep",
+    "#no space",
+    "# ",
+    "#  extra space",
+    "- item",
+    "- [ ] open task",
+    "- [x] done task",
+    "- [X] done task",
+    "- [/] cancelled task",
+    "- [?] unknown state",
+    "-no space",
+    "- ",
+    "* star item",
+    "  - sub item",
+    "    - [x] sub sub task",
+    "  continuation",
+    "\tindented with a tab",
+    "   ",
+    "",
+    "",
+    "some text",
+    "more text with `code`",
+    "```",
+]
+
+EXAMPLES = [
+    "",
+    "no headings at all\n- but a list",
+    "- list before\n# Heading\n- list after",
+    "### deep first\n# then top\n## and middle",
+    "# a\n\n\n# b\n\n  - orphan sub item\n- item\n\n  continued after empty line",
+    "## same\n## same\n## same",
+]
+
+
+def assert_same_chunks(markdown: str) -> None:
+    chunks = chunk_markdown(markdown)
+    assert chunks["sections"] == reference_chunk_markdown_by_heading(markdown)
+    assert chunks["lists"] == reference_chunk_markdown_by_list(markdown)
+
+
+def test_examples_match_the_reference_chunkers():
+    for markdown in EXAMPLES:
+        assert_same_chunks(markdown)
+
+
+def test_random_markdown_matches_the_reference_chunkers():
+    # seeded, to always check the same documents
+    rng = random.Random(42)
+    for _ in range(500):
+        lines = rng.choices(LINES, k=rng.randint(0, 40))
+        assert_same_chunks("\n".join(lines))
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import time
+
+from atomic_file import write_atomic
+
+
+class QueryCache:
+    """
+    On disk cache of the context of questions, one json file per question.
+
+    Entries expire after `ttl` seconds and only the `max_entries` most recently used ones are kept
+    (the mtime of a file is its last use). The index version is part of the key,
+    so every write of the indexer invalidates all entries at once.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        """Same question with different casing, whitespace or trailing punctuation"""
+        return " ".join(question.lower().split()).rstrip("?!. ")
+
+    @staticmethod
+    def get_key(question: str, max_length: int, index_version: str) -> str:
+        key = json.dumps([QueryCache.normalize(question), max_length, index_version])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        file = self._file(key)
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        if time.time() - entry["created"] > self.ttl:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                # e.g. removed by another process at the same time
+                pass
+            return None
+
+        try:
+            # mark it as recently used
+            os.utime(file)
+        except FileNotFoundError:
+            # evicted since it was read, the context is still valid
+            pass
+        return entry["context"]
+
+    def put(self, key: str, context: str) -> None:
+        write_atomic(
+            self._file(key), json.dumps({"created": time.time(), "context": context})
+        )
+        self._evict()
+
+    def _evict(self) -> None:
+        files = [
+            entry
+            for entry in os.scandir(self.path)
+            if entry.name.endswith(".json") and entry.is_file()
+        ]
+        if len(files) <= self.max_entries:
+            return
+
+        files.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in files[: len(files) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # e.g. evicted by another process at the same time
+                pass
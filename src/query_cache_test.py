@@ -0,0 +1,64 @@
+import json
+import os
+
+from query_cache import QueryCache
+
+
+def test_similar_questions_share_an_entry(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl=60, max_entries=10)
+    key = QueryCache.get_key("What did I do today?", 100, "v1")
+    assert cache.get(key) is None
+
+    cache.put(key, "context")
+    assert (
+        cache.get(QueryCache.get_key("  what did i do   TODAY ", 100, "v1"))
+        == "context"
+    )
+
+    # another index version or context length is another entry
+    assert cache.get(QueryCache.get_key("what did i do today", 100, "v2")) is None
+    assert cache.get(QueryCache.get_key("what did i do today", 200, "v1")) is None
+
+
+def test_entries_expire(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl=60, max_entries=10)
+    cache.put("old", "context")
+
+    file = tmp_path / "old.json"
+    entry = json.loads(file.read_text(encoding="utf-8"))
+    file.write_text(json.dumps({**entry, "created": entry["created"] - 61}))
+
+    assert cache.get("old") is None
+    assert not file.exists()
+
+
+def test_entries_removed_by_another_process_are_misses(tmp_path, monkeypatch):
+    cache = QueryCache(str(tmp_path), ttl=60, max_entries=10)
+    cache.put("old", "context")
+    file = tmp_path / "old.json"
+    entry = json.loads(file.read_text(encoding="utf-8"))
+    file.write_text(json.dumps({**entry, "created": entry["created"] - 61}))
+
+    # removed after it was read
+    remove = os.remove
+
+    def remove_twice(path):
+        remove(path)
+        remove(path)
+
+    monkeypatch.setattr(os, "remove", remove_twice)
+    assert cache.get("old") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl=60, max_entries=2)
+    cache.put("a", "a")
+    cache.put("b", "b")
+    os.utime(tmp_path / "a.json", ns=(1, 1))
+    os.utime(tmp_path / "b.json", ns=(2, 2))
+
+    # using `a` makes `b` the least recently used one
+    assert cache.get("a") == "a"
+    cache.put("c", "c")
+
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "c.json"]
@@ -0,0 +1,173 @@
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, Literal, TypedDict
+
+from markdown_chunker import ChunkSavings, SectionMode, chunk_markdown
+
+ChunkType = Literal["section", "list"]
+
+
+class FileTask(TypedDict):
+    file: str
+    hash: str
+    # first part of the ids of all records of the file, see `get_record_key`
+    key: str
+    # ids of the records that already exist, their chunks do not need to be uploaded again
+    existing_ids: list[str] | None
+
+
+class FileChunks(TypedDict):
+    """
+    New chunks of a file and the ids of all of its chunks.
+
+    The metadata is shared by all chunks instead of being part of every record,
+    to keep it compact when it is sent between processes.
+    """
+
+    filename: str
+    path: str
+    hash: str
+    # (id, type, text) of the chunks that need to be uploaded
+    chunks: list[tuple[str, ChunkType, str]]
+    chunk_ids: list[str]
+    bytes: int
+    savings: ChunkSavings
+    # seconds spent in the stages reading, chunking and records
+    timings: dict[str, float]
+
+
+def get_record_id(key: str, chunk_type: ChunkType, chunk: str) -> str:
+    """Deterministic id of a record, derived from the key of its file, chunk type and chunk content"""
+    chunk_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:32]
+
+    return f"{key}#{chunk_type}#{chunk_hash}"
+
+
+def get_key_of_record(record_id: str) -> str:
+    return record_id.split("#", 1)[0]
+
+
+def get_record_key(file: str, record_ids: list[str] | None, used_keys: set[str]) -> str:
+    """
+    Key of the records of a file, the first part of their ids.
+
+    Files keep the key of their existing records, which stays the same when a file is moved.
+    New files use the hash of their path, unless another file uses it already
+    (e.g. a new file at the old path of a moved one), as their records would share ids.
+    """
+    if record_ids:
+        return get_key_of_record(record_ids[0])
+
+    key = hashlib.sha256(file.encode("utf-8")).hexdigest()[:16]
+    attempt = 0
+    while key in used_keys:
+        attempt += 1
+        key = hashlib.sha256(f"{file}#{attempt}".encode("utf-8")).hexdigest()[:16]
+
+    return key
+
+
+def chunk_file(
+    task: FileTask, section_mode: SectionMode, max_tokens: int | None
+) -> FileChunks:
+    """Read and chunk a file, only cpu and file io to be run in any process"""
+    start = time.perf_counter()
+    file_path = Path(task["file"])
+    with open(file_path, "r", encoding="utf-8") as file:
+        markdown = file.read()
+    read = time.perf_counter()
+
+    chunks = chunk_markdown(markdown, section_mode=section_mode, max_tokens=max_tokens)
+    chunked = time.perf_counter()
+
+    # same chunks result in the same id, keep only one of them
+    new_chunks: dict[str, tuple[str, ChunkType, str]] = {}
+    chunk_type: ChunkType
+    for chunk_type, texts in [
+        ("section", chunks["sections"]),
+        ("list", chunks["lists"]),
+    ]:
+        for text in texts:
+            record_id = get_record_id(task["key"], chunk_type, text)
+            new_chunks.setdefault(record_id, (record_id, chunk_type, text))
+
+    # unchanged chunks already exist with the same id, only new ones need to be embedded
+    existing = set(task["existing_ids"] or [])
+
+    return {
+        "filename": file_path.name,
+        "path": str(file_path.parent),
+        "hash": task["hash"],
+        "chunks": [c for id, c in new_chunks.items() if id not in existing],
+        "chunk_ids": list(new_chunks),
+        "bytes": len(markdown.encode("utf-8")),
+        "savings": chunks["savings"],
+        "timings": {
+            "reading": read - start,
+            "chunking": chunked - read,
+            "records": time.perf_counter() - chunked,
+        },
+    }
+
+
+def create_records(file_chunks: FileChunks) -> list[dict]:
+    return [
+        {
+            "id": record_id,
+            "text": text,
+            "filename": file_chunks["filename"],
+            "path": file_chunks["path"],
+            "type": chunk_type,
+            "hash": file_chunks["hash"],
+        }
+        for record_id, chunk_type, text in file_chunks["chunks"]
+    ]
+
+
+class RecordProducer:
+    """
+    Chunks files in a pool of processes (or in this one with a single worker).
+
+    Results are returned in the order of the files. Only `max_pending` files are processed ahead
+    of the consumer, so a slow consumer (e.g. the uploader waiting for the db) keeps memory flat.
+    """
+
+    def __init__(
+        self,
+        section_mode: SectionMode,
+        max_tokens: int | None,
+        workers: int = 1,
+        max_pending: int | None = None,
+    ):
+        self.section_mode: SectionMode = section_mode
+        self.max_tokens = max_tokens
+        self.workers = workers
+        self.max_pending = max_pending or workers * 4
+
+    def map(self, tasks: Iterable[FileTask]) -> Iterator[FileChunks]:
+        if self.workers <= 1:
+            for task in tasks:
+                yield chunk_file(task, self.section_mode, self.max_tokens)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending: deque[Future[FileChunks]] = deque()
+            try:
+                for task in tasks:
+                    pending.append(
+                        executor.submit(
+                            chunk_file, task, self.section_mode, self.max_tokens
+                        )
+                    )
+                    if len(pending) >= self.max_pending:
+                        yield pending.popleft().result()
+
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # e.g. the consumer failed, do not process the remaining files
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,72 @@
+from record_builder import (
+    RecordProducer,
+    chunk_file,
+    create_records,
+    get_key_of_record,
+    get_record_key,
+)
+
+
+def write_notes(tmp_path, count: int) -> list[str]:
+    files = []
+    for i in range(count):
+        file = tmp_path / "daily" / f"{i}.md"
+        file.parent.mkdir(exist_ok=True)
+        file.write_text(f"# Note {i}\n\n- item {i}\n- other\n", encoding="utf-8")
+        files.append(str(file))
+    return files
+
+
+def test_chunk_file_skips_existing_chunks(tmp_path):
+    [file] = write_notes(tmp_path, 1)
+    file_chunks = chunk_file(
+        {"file": file, "hash": "h", "key": "k", "existing_ids": None}, "nested", None
+    )
+    records = create_records(file_chunks)
+
+    assert {r["type"] for r in records} == {"section", "list"}
+    assert [r["id"] for r in records] == file_chunks["chunk_ids"]
+    assert records[0]["filename"] == "0.md"
+    assert records[0]["path"] == str(tmp_path / "daily")
+    assert records[0]["hash"] == "h"
+    assert {get_key_of_record(r["id"]) for r in records} == {"k"}
+
+    existing = chunk_file(
+        {
+            "file": file,
+            "hash": "h",
+            "key": "k",
+            "existing_ids": file_chunks["chunk_ids"][:1],
+        },
+        "nested",
+        None,
+    )
+    assert existing["chunk_ids"] == file_chunks["chunk_ids"]
+    assert [c[0] for c in existing["chunks"]] == file_chunks["chunk_ids"][1:]
+
+
+def test_processes_return_the_same_chunks_in_order(tmp_path):
+    tasks = [
+        {"file": file, "hash": str(i), "key": str(i), "existing_ids": None}
+        for i, file in enumerate(write_notes(tmp_path, 20))
+    ]
+
+    serial = list(RecordProducer("nested", None).map(tasks))
+    parallel = list(RecordProducer("nested", None, workers=2, max_pending=3).map(tasks))
+
+    assert [c["chunks"] for c in parallel] == [c["chunks"] for c in serial]
+    assert [c["hash"] for c in parallel] == [str(i) for i in range(20)]
+
+
+def test_record_keys_are_unique_and_stay_with_their_records():
+    key = get_record_key("daily/a.md", None, set())
+    assert get_record_key("daily/a.md", None, set()) == key
+    assert get_record_key("daily/b.md", None, set()) != key
+
+    # e.g. a new file at the path of a moved one
+    other_key = get_record_key("daily/a.md", None, {key})
+    assert other_key != key
+    assert get_record_key("daily/a.md", None, {key, other_key}) not in {key, other_key}
+
+    # moved files keep the key of their records
+    assert get_record_key("daily/moved.md", [f"{key}#list#abc"], {key}) == key
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+from config import GREY, RED, RESET
+from run_metrics import RunMetrics
+from vector_store import VectorStore
+
+# Pinecone deletes at most 1000 ids per request, the same limit is used for `$in` filters
+MAX_DELETE_VALUES = 1000
+# a file version is matched by its hash, filename and path, all of them count towards the limit
+FILE_FILTER_VALUES = 3
+MAX_DELETE_FILES = MAX_DELETE_VALUES // FILE_FILTER_VALUES
+
+
+def get_file_filter(file_hash: str, file: str | Path) -> dict[str, str]:
+    """Filter for the records of one file version, other files with the same content share the hash"""
+    file = Path(file)
+    return {"hash": file_hash, "filename": file.name, "path": str(file.parent)}
+
+
+class RecordPurger:
+    """
+    Collects stale records during a run and deletes them in bulk,
+    instead of sending one delete request per changed or deleted file.
+
+    Records are either known by their ids or (for records with random ids) by the hash and path
+    of their file.
+    Full requests are sent right away, the rest on `purge`.
+    """
+
+    def __init__(
+        self,
+        index: VectorStore,
+        namespace: str,
+        max_values: int = MAX_DELETE_VALUES,
+        metrics: RunMetrics | None = None,
+    ):
+        self.index = index
+        self.metrics = metrics or RunMetrics()
+        self.namespace = namespace
+        self.max_values = max_values
+        self.ids: list[str] = []
+        self.files: list[tuple[str, str]] = []
+
+    def add(
+        self,
+        file: str | None = None,
+        file_hash: str | None = None,
+        record_ids: list[str] | None = None,
+    ):
+        """Collect records by their ids, or all records of a file version via its hash and path"""
+        if record_ids is not None:
+            self.ids.extend(record_ids)
+        elif file and file_hash:
+            self.files.append((file_hash, file))
+
+        self._delete_ids(full_only=True)
+
+    def _delete_ids(self, full_only: bool = False) -> None:
+        while len(self.ids) >= (self.max_values if full_only else 1):
+            ids = self.ids[: self.max_values]
+            self.ids = self.ids[self.max_values :]
+
+            print(f"{RED}Purge{RESET} {len(ids)} old records in db")
+            with self.metrics.request("delete", len(ids)):
+                self.index.delete(namespace=self.namespace, ids=ids)
+
+    def purge(self) -> None:
+        """Delete all collected records"""
+        self._delete_ids()
+
+        files = sorted(set(self.files))
+        self.files = []
+        max_files = max(1, self.max_values // FILE_FILTER_VALUES)
+        for i in range(0, len(files), max_files):
+            chunk = files[i : i + max_files]
+            print(f"{RED}Purge{RESET} old index of {len(chunk)} files in db")
+            with self.metrics.request("delete", len(chunk)):
+                self.index.delete(
+                    namespace=self.namespace,
+                    filter={"$or": [get_file_filter(*file) for file in chunk]},
+                )
+
+        if not files:
+            print(f"{GREY}No old files to purge in db{RESET}")
@@ -0,0 +1,37 @@
+from record_purger import RecordPurger
+
+
+class FakeIndex:
+    def __init__(self):
+        self.deletes: list[dict] = []
+
+    def delete(self, namespace: str, **kwargs) -> None:
+        self.deletes.append(kwargs)
+
+
+def test_records_are_deleted_in_bulk():
+    index = FakeIndex()
+    purger = RecordPurger(index, "default", max_values=3)
+
+    purger.add(record_ids=["a", "b"])
+    purger.add("a.md", "hash-a")
+    assert index.deletes == []
+
+    # full requests are sent right away
+    purger.add(record_ids=["c", "d"])
+    assert index.deletes == [{"ids": ["a", "b", "c"]}]
+
+    # files with the same content share the hash, only the given file version is deleted
+    purger.add("folder/b.md", "hash-a")
+    purger.add(record_ids=[])
+    purger.purge()
+
+    assert index.deletes[1:] == [
+        {"ids": ["d"]},
+        {"filter": {"$or": [{"hash": "hash-a", "filename": "a.md", "path": "."}]}},
+        {"filter": {"$or": [{"hash": "hash-a", "filename": "b.md", "path": "folder"}]}},
+    ]
+
+    # nothing is left to delete
+    purger.purge()
+    assert len(index.deletes) == 4
@@ -0,0 +1,150 @@
+import json
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, TypedDict
+
+from config import CYAN, GREY, RED, RESET
+from run_metrics import RunMetrics
+from vector_store import VectorStore
+
+# Pinecone has a max batch size of 96 records and 2MB per upsert
+BATCH_SIZE = 96
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class PendingFile(TypedDict):
+    file: str
+    # records that are still waiting in the buffer for a batch
+    buffered_records: int
+    futures: list[Future]
+    on_done: Callable[[], None]
+
+
+class RecordUploader:
+    """
+    Uploads records with a bounded pool of workers, to not wait on every request one after another.
+
+    Records of multiple files are packed into full batches (by count and size), as most
+    files only result in a few records.
+
+    Files are finished (their `on_done` is called) in the order they were added and only once
+    all batches with their records are acknowledged. Errors are reported in the same order.
+    """
+
+    def __init__(
+        self,
+        index: VectorStore,
+        namespace: str,
+        workers: int = 4,
+        batch_size: int = BATCH_SIZE,
+        max_batch_bytes: int = MAX_BATCH_BYTES,
+        metrics: RunMetrics | None = None,
+    ):
+        self.index = index
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.metrics = metrics or RunMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # limit the batches in flight, so memory stays flat no matter how many files are added
+        self.in_flight = threading.BoundedSemaphore(workers * 2)
+        self.pending: deque[PendingFile] = deque()
+        self.failed_files: list[str] = []
+
+        self.buffer: list[tuple[dict, PendingFile]] = []
+        self.buffer_bytes = 0
+        self.uploaded_batches = 0
+
+    def add(self, file: str, records: list[dict], on_done: Callable[[], None]) -> None:
+        pending: PendingFile = {
+            "file": file,
+            "buffered_records": 0,
+            "futures": [],
+            "on_done": on_done,
+        }
+        self.pending.append(pending)
+
+        for record in records:
+            record_bytes = len(json.dumps(record).encode("utf-8"))
+            if self.buffer and self.buffer_bytes + record_bytes > self.max_batch_bytes:
+                self.flush()
+
+            self.buffer.append((record, pending))
+            self.buffer_bytes += record_bytes
+            pending["buffered_records"] += 1
+
+            if len(self.buffer) >= self.batch_size:
+                self.flush()
+
+        self.finish_uploaded()
+
+    def flush(self) -> None:
+        """Upload the buffered records, even if they do not fill a whole batch"""
+        if not self.buffer:
+            return
+
+        batch = [record for record, _ in self.buffer]
+        files = {pending["file"]: pending for _, pending in self.buffer}
+        for _, pending in self.buffer:
+            pending["buffered_records"] -= 1
+        self.buffer = []
+        self.buffer_bytes = 0
+
+        self.uploaded_batches += 1
+        print(
+            f"{GREY}Uploading batch {self.uploaded_batches} ({len(batch)} records of {len(files)} files){RESET}"
+        )
+
+        self.in_flight.acquire()
+        future = self.executor.submit(self._upload, batch)
+        future.add_done_callback(lambda _: self.in_flight.release())
+
+        # files are only done, once all batches with their records are done
+        for pending in files.values():
+            pending["futures"].append(future)
+
+    def _upload(self, batch: list[dict]) -> None:
+        with self.metrics.request("upsert", len(batch)):
+            self.index.upsert_records(namespace=self.namespace, records=batch)
+        self.metrics.count("records", len(batch))
+
+    def finish_uploaded(self, wait: bool = False) -> None:
+        """Finish all files (in order) whose batches are acknowledged, optionally wait for all of them"""
+        while self.pending:
+            pending = self.pending[0]
+            if pending["buffered_records"]:
+                break
+            if not wait and not all(f.done() for f in pending["futures"]):
+                break
+
+            self.pending.popleft()
+            errors = [f.exception() for f in pending["futures"] if f.exception()]
+            if errors:
+                # the file is not finished, so it will be retried on the next run
+                print(
+                    f"{RED}ERROR:{RESET} Uploading {CYAN}{pending['file']}{RESET} failed: {errors[0]}"
+                )
+                self.failed_files.append(pending["file"])
+                continue
+
+            pending["on_done"]()
+
+    def close(self) -> None:
+        """Wait for all uploads and finish their files, raises if any file failed"""
+        self.flush()
+        self.finish_uploaded(wait=True)
+        self.executor.shutdown()
+
+        if self.failed_files:
+            raise UploadError(
+                f"Uploading {len(self.failed_files)} files failed: {', '.join(self.failed_files)}"
+            )
+
+    def abort(self) -> None:
+        """Stop without finishing files, unfinished files will be uploaded again on the next run"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from record_uploader import RecordUploader, UploadError
+
+
+class FakeIndex:
+    def __init__(self, failing_ids: set[str] | None = None):
+        self.failing_ids = failing_ids or set()
+        self.batches: list[list[str]] = []
+        self.lock = threading.Lock()
+
+    def upsert_records(self, namespace: str, records: list[dict]) -> None:
+        ids = [r["id"] for r in records]
+        # let earlier batches finish later, to check that files are still finished in order
+        time.sleep(0.01 * (len(ids) % 3))
+        if self.failing_ids.intersection(ids):
+            raise RuntimeError("upload failed")
+
+        with self.lock:
+            self.batches.append(ids)
+
+
+def create_records(file: str, count: int) -> list[dict]:
+    return [{"id": f"{file}-{i}", "text": "text"} for i in range(count)]
+
+
+def test_files_are_finished_in_order_after_upload():
+    index = FakeIndex()
+    uploader = RecordUploader(index, "default", workers=4, batch_size=2)
+
+    finished: list[str] = []
+    for file, count in [("a", 5), ("b", 1), ("c", 0), ("d", 4)]:
+        uploader.add(
+            file, create_records(file, count), lambda f=file: finished.append(f)
+        )
+
+    uploader.close()
+
+    assert finished == ["a", "b", "c", "d"]
+    assert sorted(id for batch in index.batches for id in batch) == sorted(
+        r["id"] for f, c in [("a", 5), ("b", 1), ("d", 4)] for r in create_records(f, c)
+    )
+    # records of multiple files are packed into full batches
+    assert [len(batch) for batch in index.batches] == [2, 2, 2, 2, 2]
+
+
+def test_failed_files_are_not_finished():
+    index = FakeIndex(failing_ids={"b-0"})
+    uploader = RecordUploader(index, "default", workers=2, batch_size=2)
+
+    finished: list[str] = []
+    for file in ["a", "b", "c"]:
+        uploader.add(file, create_records(file, 3), lambda f=file: finished.append(f))
+
+    with pytest.raises(UploadError):
+        uploader.close()
+
+    # the failing batch contains the last record of "a" and the first of "b"
+    assert finished == ["c"]
+    assert uploader.failed_files == ["a", "b"]
+
+
+def test_batches_are_limited_by_size():
+    index = FakeIndex()
+    uploader = RecordUploader(index, "default", workers=1, max_batch_bytes=60)
+
+    finished: list[str] = []
+    uploader.add("a", create_records("a", 5), lambda: finished.append("a"))
+    uploader.close()
+
+    assert finished == ["a"]
+    assert [len(batch) for batch in index.batches] == [2, 2, 1]
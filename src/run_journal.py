@@ -0,0 +1,54 @@
+import json
+import os
+from typing import Literal, TypedDict
+
+
+class JournalEntry(TypedDict, total=False):
+    op: Literal["upload", "move", "delete"]
+    state: Literal["planned", "done"]
+    file: str
+    # only for moves, `file` is the new path
+    old_file: str
+    hash: str
+    blob: str | None
+    chunk_ids: list[str]
+    # records that are stale once the operation is done
+    purge_ids: list[str] | None
+    purge_hash: str | None
+
+
+class RunJournal:
+    """
+    Write-ahead journal of a run, next to the tracked files (`<tracked files>.journal.jsonl`).
+
+    Operations are written before the tracked files are changed, so an interrupted run
+    (e.g. CI timeout or network drop) can be resumed by the next run: done operations are
+    applied to the tracked files and their stale records purged, planned ones are simply redone.
+    The journal is removed once a run saved its tracked files and purged all stale records.
+    """
+
+    def __init__(self, tracked_file_path: str):
+        self.path = f"{os.path.splitext(tracked_file_path)[0]}.journal.jsonl"
+
+    def load(self) -> list[JournalEntry]:
+        if not os.path.exists(self.path):
+            return []
+
+        entries: list[JournalEntry] = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # the last line might be cut off by the interruption
+                    break
+
+        return entries
+
+    def append(self, entry: JournalEntry) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,20 @@
+from run_journal import RunJournal
+
+
+def test_journal_survives_a_cut_off_line(tmp_path):
+    journal = RunJournal(str(tmp_path / "tracked.txt"))
+    assert journal.path == str(tmp_path / "tracked.journal.jsonl")
+    assert journal.load() == []
+
+    journal.append({"op": "upload", "state": "planned", "file": "a.md", "hash": "h"})
+    journal.append({"op": "delete", "state": "done", "file": "b.md"})
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"op": "upl')
+
+    assert [(e["op"], e["state"]) for e in journal.load()] == [
+        ("upload", "planned"),
+        ("delete", "done"),
+    ]
+
+    journal.clear()
+    assert journal.load() == []
@@ -0,0 +1,128 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, TypedDict
+
+
+class StageSummary(TypedDict):
+    seconds: float
+    calls: int
+
+
+class RequestSummary(TypedDict):
+    count: int
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+class MetricsSummary(TypedDict):
+    seconds: float
+    stages: dict[str, StageSummary]
+    counters: dict[str, int]
+    # per second of the whole run
+    rates: dict[str, float]
+    # latencies in seconds
+    requests: dict[str, RequestSummary]
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class RunMetrics:
+    """
+    Timings of the stages of a run (e.g. hashing, chunking), counters and request latencies.
+
+    Stages and requests can be measured from multiple threads (e.g. the upload workers).
+    Events are optionally written as json lines, the summary is available at the end.
+    """
+
+    def __init__(self, events_path: str | None = None):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stages: dict[str, StageSummary] = {}
+        self.counters: dict[str, int] = {}
+        self.latencies: dict[str, list[float]] = {}
+        self.events = open(events_path, "a", encoding="utf-8") if events_path else None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """Add time that was measured elsewhere (e.g. in another process) to a stage"""
+        with self.lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += seconds
+            stage["calls"] += 1
+
+    @contextmanager
+    def request(self, kind: str, size: int = 0) -> Iterator[None]:
+        """Measure a request to the db, its time also counts to the stage of the same name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.latencies.setdefault(kind, []).append(seconds)
+            self.add_time(kind, seconds)
+            self.event("request", kind=kind, size=size, seconds=round(seconds, 6))
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def event(self, name: str, **fields: Any) -> None:
+        if not self.events:
+            return
+
+        line = json.dumps({"event": name, "time": time.time(), **fields})
+        with self.lock:
+            self.events.write(line + "\n")
+
+    def summary(self) -> MetricsSummary:
+        seconds = time.perf_counter() - self.start
+        with self.lock:
+            requests: dict[str, RequestSummary] = {}
+            for kind, latencies in self.latencies.items():
+                values = sorted(latencies)
+                requests[kind] = {
+                    "count": len(values),
+                    "p50": round(percentile(values, 50), 6),
+                    "p90": round(percentile(values, 90), 6),
+                    "p99": round(percentile(values, 99), 6),
+                    "max": round(values[-1], 6),
+                }
+
+            return {
+                "seconds": round(seconds, 3),
+                "stages": {
+                    name: {"seconds": round(s["seconds"], 6), "calls": s["calls"]}
+                    for name, s in self.stages.items()
+                },
+                "counters": dict(self.counters),
+                "rates": {
+                    f"{name}_per_second": round(value / seconds, 2) if seconds else 0.0
+                    for name, value in self.counters.items()
+                },
+                "requests": requests,
+            }
+
+    def close(self) -> None:
+        if self.events:
+            self.events.close()
+            self.events = None
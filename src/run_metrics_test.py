@@ -0,0 +1,39 @@
+import json
+
+from run_metrics import RunMetrics, percentile
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([3.0], 90) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summary_and_events(tmp_path):
+    events_path = tmp_path / "events.jsonl"
+    metrics = RunMetrics(str(events_path))
+
+    with metrics.stage("chunking"):
+        pass
+    with metrics.stage("chunking"):
+        pass
+    for _ in range(3):
+        with metrics.request("upsert", size=96):
+            pass
+    metrics.count("records", 288)
+    metrics.event("file", file="a.md", records=2)
+    summary = metrics.summary()
+    metrics.close()
+
+    assert summary["stages"]["chunking"]["calls"] == 2
+    assert summary["stages"]["upsert"]["calls"] == 3
+    assert summary["requests"]["upsert"]["count"] == 3
+    assert summary["counters"] == {"records": 288}
+    assert summary["rates"]["records_per_second"] > 0
+
+    events = [json.loads(line) for line in events_path.read_text().splitlines()]
+    assert [e["event"] for e in events] == ["request"] * 3 + ["file"]
+    assert events[0]["size"] == 96
+    assert events[-1]["file"] == "a.md"
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import TypedDict
+
+from config import CYAN, GREEN, GREY, MAGENTA, RED, RESET
+
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# arguments of every entry point, that print something without doing any work
+ENTRY_POINTS: dict[str, list[str]] = {
+    # killed after the first output, before the question is enhanced or embedded
+    "ai_request": ["startup benchmark"],
+    "ai_notes_indexer": ["--help"],
+    "evaluator": ["--help"],
+}
+
+# slower than this (relative to the compared results) counts as a regression, single runs vary by ~20%
+REGRESSION_THRESHOLD = 0.5
+
+
+class StartupResult(TypedDict):
+    # cumulative import time of the module itself
+    import_seconds: float
+    # from starting the process until its first output
+    first_output_seconds: float
+
+
+def parse_import_time(output: str, module: str) -> float:
+    """Cumulative seconds of the module from the output of `python -X importtime`"""
+    for line in output.splitlines():
+        # format: import time: <self us> | <cumulative us> | <module>
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module and parts[2][1] != " ":
+            return int(parts[1]) / 1_000_000
+
+    raise ValueError(f"No import time of {module} found")
+
+
+def measure_import(module: str) -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_import_time(result.stderr, module)
+
+
+def measure_first_output(module: str, args: list[str]) -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, f"{module}.py", *args],
+        cwd=SRC_PATH,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        # otherwise the output is only flushed at exit
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+    )
+    assert process.stdout is not None
+    process.stdout.read(1)
+    seconds = time.perf_counter() - start
+
+    process.kill()
+    process.wait()
+
+    return seconds
+
+
+def benchmark(runs: int) -> dict[str, StartupResult]:
+    results: dict[str, StartupResult] = {}
+    for module, args in ENTRY_POINTS.items():
+        print(f"{GREY}Measuring {module} ({runs} runs){RESET}")
+        # the median, as single runs are noisy (e.g. cold disk caches)
+        results[module] = {
+            "import_seconds": statistics.median(
+                measure_import(module) for _ in range(runs)
+            ),
+            "first_output_seconds": statistics.median(
+                measure_first_output(module, args) for _ in range(runs)
+            ),
+        }
+
+    return results
+
+
+def find_regressions(
+    results: dict[str, StartupResult],
+    baseline: dict[str, StartupResult],
+    threshold: float = REGRESSION_THRESHOLD,
+) -> list[str]:
+    """`<module> <metric>` of every measurement that got slower than the threshold"""
+    regressions: list[str] = []
+    for module, result in results.items():
+        if module not in baseline:
+            continue
+
+        for metric, seconds in result.items():
+            before = baseline[module].get(metric)
+            if before and seconds > before * (1 + threshold):
+                regressions.append(f"{module} {metric}")
+
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of the cli entry points"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement")
+    parser.add_argument("--save", help="Save the results as json to this file")
+    parser.add_argument(
+        "--compare",
+        help="Compare with results saved before, exits with 1 on regressions",
+    )
+    args = parser.parse_args()
+
+    results = benchmark(args.runs)
+    baseline: dict[str, StartupResult] = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print()
+    for module, result in results.items():
+        print(f"{MAGENTA}{module}{RESET}")
+        for metric, seconds in result.items():
+            before = baseline.get(module, {}).get(metric)
+            change = f" ({(seconds / before - 1) * 100:+.0f}%)" if before else ""
+            print(f"  {metric}: {CYAN}{seconds * 1000:.1f}ms{RESET}{change}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.write(json.dumps(results, indent=2) + "\n")
+        print(f"\n{GREEN}Saved{RESET} results to {CYAN}{args.save}{RESET}")
+
+    regressions = find_regressions(results, baseline)
+    if regressions:
+        print(
+            f"\n{RED}Regression{RESET} of more than {REGRESSION_THRESHOLD:.0%}: {', '.join(regressions)}"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from startup_benchmark import find_regressions, parse_import_time
+
+IMPORT_TIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       358 |      16334 |   active_target
+import time:      2720 |      28579 | ai_request
+import time:       100 |        200 |   ai_request
+"""
+
+
+def test_parse_import_time():
+    # only the top level import of the module counts
+    assert parse_import_time(IMPORT_TIME_OUTPUT, "ai_request") == 0.028579
+
+
+def test_find_regressions():
+    baseline = {
+        "ai_request": {"import_seconds": 0.1, "first_output_seconds": 0.2},
+    }
+    results = {
+        "ai_request": {"import_seconds": 0.11, "first_output_seconds": 0.35},
+        "evaluator": {"import_seconds": 1.0, "first_output_seconds": 1.0},
+    }
+
+    assert find_regressions(results, baseline) == ["ai_request first_output_seconds"]  # type: ignore[arg-type]
@@ -1,67 +1,363 @@
 import os
 import hashlib
-from typing import List
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Literal
+
+from atomic_file import write_atomic
+
+HashAlgorithm = Literal["sha256", "blake2b"]
+
+# sha256 hashes are stored without prefix, as the manifest started out with them
+HASH_PREFIXES: Dict[HashAlgorithm, str] = {"sha256": "", "blake2b": "blake2b:"}
+HASHERS: Dict[HashAlgorithm, Callable] = {
+    "sha256": hashlib.sha256,
+    "blake2b": lambda: hashlib.blake2b(digest_size=32),
+}
 
 
 class TrackedFileHandler:
-    def __init__(self, tracked_file_path: str):
+    """
+    Keeps track of which files (and which version of them) were already indexed.
+
+    Entries are kept in memory as a `path -> hash` index and only written to disk
+    on `flush` (or every `checkpoint_interval` changes), to avoid rewriting the
+    whole manifest for every processed file.
+
+    Next to the manifest a local stat cache (size, mtime, inode -> hash) is kept,
+    so unchanged files do not need to be read and hashed again.
+
+    For git based change detection the blob ids of the tracked files and the last
+    indexed commit are stored as well, this state is stable across clones (e.g. CI).
+
+    Hashes are prefixed with their algorithm (except sha256), so entries created with
+    different algorithms can coexist and are always compared with their own algorithm.
+
+    The ids of the records of every file are stored as well, to only upload new chunks
+    and only delete vanished ones when a file changes.
+    """
+
+    def __init__(
+        self,
+        tracked_file_path: str,
+        checkpoint_interval: int = 0,
+        hash_algorithm: HashAlgorithm = "sha256",
+    ):
         self.tracked_file_path = tracked_file_path
+        self.hash_algorithm: HashAlgorithm = hash_algorithm
         if not os.path.exists(self.tracked_file_path):
             open(self.tracked_file_path, "w").close()
 
-        self.tracked_files = self._load_tracked_files()
+        # 0 means only flush when explicitly asked to (e.g. at the end of a run)
+        self.checkpoint_interval = checkpoint_interval
+        self.pending_changes = 0
+
+        self.index = self._load_tracked_files()
+
+        # the stat cache only makes sense for the local file system, keep it out of the manifest
+        _, self.stat_cache_path, self.git_state_path, self.chunk_ids_path = (
+            self.get_files(tracked_file_path)
+        )
+        self.stat_cache = self._load_stat_cache()
+        self.stat_cache_changed = False
+
+        git_state = self._load_json(self.git_state_path)
+        self.last_commit: str | None = git_state.get("commit")
+        self.blobs: Dict[str, str] = git_state.get("blobs", {})
+        self.git_state_changed = False
+
+        self.chunk_ids: Dict[str, List[str]] = self._load_json(self.chunk_ids_path)
+        self.chunk_ids_changed = False
+
+    @staticmethod
+    def get_files(tracked_file_path: str) -> List[str]:
+        """The manifest and the files next to it (stat cache, git state and chunk ids)"""
+        base = os.path.splitext(tracked_file_path)[0]
+        return [
+            tracked_file_path,
+            f"{base}.stat.json",
+            f"{base}.git.json",
+            f"{base}.chunks.json",
+        ]
+
+    @property
+    def tracked_files(self) -> List[str]:
+        return [f"{file}@{hash}" for file, hash in self.index.items()]
 
-    def _load_tracked_files(self) -> List[str]:
+    def _load_tracked_files(self) -> Dict[str, str]:
+        index: Dict[str, str] = {}
         with open(self.tracked_file_path, "r", encoding="utf-8") as f:
-            return [line.strip() for line in f]
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+
+                file, _, hash = line.rpartition("@")
+                index[file] = hash
+
+        return index
+
+    def _load_stat_cache(self) -> Dict[str, List]:
+        return self._load_json(self.stat_cache_path)
+
+    @staticmethod
+    def _load_json(path: str) -> Dict:
+        if not os.path.exists(path):
+            return {}
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # the state is only an optimization, start fresh if it is broken
+            return {}
 
     def _save_tracked_files(self) -> None:
-        with open(self.tracked_file_path, "w", encoding="utf-8") as f:
-            f.write("\n".join(sorted(self.tracked_files)))
+        write_atomic(self.tracked_file_path, "\n".join(sorted(self.tracked_files)))
+
+    def _save_stat_cache(self) -> None:
+        write_atomic(self.stat_cache_path, json.dumps(self.stat_cache))
+
+    def _save_git_state(self) -> None:
+        # this file is committed, so keep it stable and readable for diffs
+        git_state = {"commit": self.last_commit, "blobs": self.blobs}
+        write_atomic(
+            self.git_state_path, json.dumps(git_state, indent=2, sort_keys=True)
+        )
+
+    def _mark_changed(self) -> None:
+        self.pending_changes += 1
+        if (
+            self.checkpoint_interval
+            and self.pending_changes >= self.checkpoint_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Persist all pending changes of the in-memory index to disk"""
+        if self.pending_changes:
+            self._save_tracked_files()
+            self.pending_changes = 0
+
+        if self.stat_cache_changed:
+            self._save_stat_cache()
+            self.stat_cache_changed = False
+
+        if self.git_state_changed:
+            self._save_git_state()
+            self.git_state_changed = False
+
+        if self.chunk_ids_changed:
+            # this file is committed as well, one id per line keeps diffs small
+            write_atomic(
+                self.chunk_ids_path,
+                json.dumps(self.chunk_ids, indent=1, sort_keys=True),
+            )
+            self.chunk_ids_changed = False
 
     def get_dangling_files(self) -> List[str]:
         """Cleanup tracked files that do not exist anymore"""
-        tracked_files = self._load_tracked_files()
-        files = [f.split("@")[0] for f in tracked_files]
+        return [f for f in self.index if not os.path.exists(f)]
+
+    def get_hash_algorithm(self, file: str) -> HashAlgorithm:
+        """Algorithm of the tracked hash of the file, new files use the configured one"""
+        tracked_hash = self.index.get(file)
+        if tracked_hash is None:
+            return self.hash_algorithm
+
+        return self._get_algorithm(tracked_hash)
+
+    @classmethod
+    def _get_algorithm(cls, hash: str) -> HashAlgorithm:
+        for algorithm in HASH_PREFIXES:
+            if cls._has_algorithm(hash, algorithm):
+                return algorithm
 
-        return [f for f in files if not os.path.exists(f)]
+        raise ValueError(f"Unknown hash algorithm of tracked file: {hash}")
 
-    def should_skip(self, file: str) -> bool:
+    def _get_cached_hash(
+        self, file: str, algorithm: HashAlgorithm
+    ) -> tuple[str | None, List[int]]:
+        stat = os.stat(file)
+        fingerprint = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+        cached = self.stat_cache.get(file)
+        if (
+            cached
+            and cached[:3] == fingerprint
+            and self._has_algorithm(cached[3], algorithm)
+        ):
+            return cached[3], fingerprint
+
+        return None, fingerprint
+
+    def _cache_hash(self, file: str, fingerprint: List[int], hash: str) -> None:
+        self.stat_cache[file] = [*fingerprint, hash]
+        self.stat_cache_changed = True
+
+    @staticmethod
+    def _has_algorithm(hash: str, algorithm: HashAlgorithm) -> bool:
+        prefix = HASH_PREFIXES[algorithm]
+        return hash.startswith(prefix) if prefix else ":" not in hash
+
+    def get_current_hash(
+        self, file: str, algorithm: HashAlgorithm | None = None
+    ) -> str:
+        """
+        Hash of the current content of the file.
+
+        Files are only read when their size, mtime or inode changed since they were last hashed.
+        Without an explicit algorithm, the one of the tracked hash is used to allow comparing them.
+        """
+        algorithm = algorithm or self.get_hash_algorithm(file)
+        hash, fingerprint = self._get_cached_hash(file, algorithm)
+        if hash is None:
+            hash = self.get_file_hash(file, algorithm)
+            self._cache_hash(file, fingerprint, hash)
+
+        return hash
+
+    def get_current_hashes(self, files: List[str], workers: int = 8) -> Dict[str, str]:
+        """
+        Bulk version of `get_current_hash`, all files that need to be read are hashed concurrently.
+        """
+        hashes: Dict[str, str] = {}
+        to_hash: List[tuple[str, HashAlgorithm, List[int]]] = []
+        for file in files:
+            algorithm = self.get_hash_algorithm(file)
+            hash, fingerprint = self._get_cached_hash(file, algorithm)
+            if hash is None:
+                to_hash.append((file, algorithm, fingerprint))
+            else:
+                hashes[file] = hash
+
+        # hashlib and file reads release the GIL, so threads are enough to use multiple cores
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            computed_hashes = executor.map(
+                lambda item: self.get_file_hash(item[0], item[1]), to_hash
+            )
+            for (file, _, fingerprint), hash in zip(to_hash, computed_hashes):
+                self._cache_hash(file, fingerprint, hash)
+                hashes[file] = hash
+
+        return hashes
+
+    def get_dangling_files_by_hash(self) -> Dict[str, str]:
+        """Dangling files by their hash, to detect files that were only moved or renamed"""
+        return {self.index[f]: f for f in self.get_dangling_files()}
+
+    def pop_renamed_file(
+        self, file: str, renamed_candidates: Dict[str, str]
+    ) -> tuple[str, str] | None:
+        """
+        Dangling file with the same content as the file and its tracked hash, removed from the candidates.
+
+        Every candidate is compared with the algorithm of its own hash (e.g. sha256 entries of a blake2b run).
+        """
+        algorithms = {self._get_algorithm(hash) for hash in renamed_candidates}
+        # the configured algorithm first, the file was already hashed with it
+        for algorithm in sorted(algorithms, key=lambda a: a != self.hash_algorithm):
+            hash = self.get_current_hash(file, algorithm)
+            old_file = renamed_candidates.pop(hash, None)
+            if old_file is not None:
+                return old_file, hash
+
+        return None
+
+    def rename_tracked_file(self, old_file: str, new_file: str) -> str | None:
+        """Move the tracking of a file to a new path, returns the replaced hash of the new path"""
+        hash = self.index.pop(old_file)
+        replaced_hash = self.index.pop(new_file, None)
+        self.index[new_file] = hash
+        self._mark_changed()
+
+        if self.stat_cache.pop(old_file, None) is not None:
+            self.stat_cache_changed = True
+
+        # same content means same blob id
+        blob = self.blobs.pop(old_file, None)
+        if blob is not None:
+            self.track_blob(new_file, blob)
+
+        # the records are moved as well and keep their ids
+        chunk_ids = self.chunk_ids.pop(old_file, None)
+        if chunk_ids is not None:
+            self.set_chunk_ids(new_file, chunk_ids)
+
+        return replaced_hash
+
+    def get_chunk_ids(self, file: str) -> List[str] | None:
+        """Ids of the uploaded records of the file, `None` if they are unknown (e.g. random ids)"""
+        return self.chunk_ids.get(file)
+
+    def set_chunk_ids(self, file: str, chunk_ids: List[str]) -> None:
+        if self.chunk_ids.get(file) != chunk_ids:
+            self.chunk_ids[file] = chunk_ids
+            self.chunk_ids_changed = True
+
+    def is_tracked_blob(self, file: str, blob: str) -> bool:
+        """Check via the git blob id if the tracked version of the file is still current"""
+        return file in self.index and self.blobs.get(file) == blob
+
+    def track_blob(self, file: str, blob: str) -> None:
+        if self.blobs.get(file) != blob:
+            self.blobs[file] = blob
+            self.git_state_changed = True
+
+    def set_last_commit(self, commit: str) -> None:
+        if self.last_commit != commit:
+            self.last_commit = commit
+            self.git_state_changed = True
+
+    def should_skip(self, file: str, file_hash: str | None = None) -> bool:
         # check if file exists (in case its not yet committed etc.)
         if not os.path.exists(file):
             return True
 
-        hash = self.get_file_hash(file)
-        return f"{file}@{hash}" in self.tracked_files
+        hash = file_hash or self.get_current_hash(file)
+        return self.index.get(file) == hash
+
+    def upsert_tracked_file(
+        self, file: str, file_hash: str | None = None
+    ) -> str | None:
+        """Track the given hash (or the current one) of the file, returns the replaced hash"""
+        if not os.path.exists(file):
+            return
 
-    def upsert_tracked_file(self, file: str) -> str | None:
-        if self.should_skip(file):
+        hash = file_hash or self.get_current_hash(file)
+        if self.index.get(file) == hash:
             return
 
-        # tracked file needs to update -> delete old tracked file
-        old_tracked_file = self.delete_tracked_file(file)
+        # tracked file needs to update -> replace old tracked file
+        old_tracked_file = self.index.pop(file, None)
 
-        # update internal list and sync to files
-        self.tracked_files.append(f"{file}@{self.get_file_hash(file)}")
-        self._save_tracked_files()
+        # update internal index, syncing to the file happens on flush/checkpoints
+        self.index[file] = hash
+        self._mark_changed()
 
         return old_tracked_file
 
     def delete_tracked_file(self, file: str) -> str | None:
-        for file_with_track in self.tracked_files:
-            if file_with_track.startswith(f"{file}@"):
-                # updated internal list and sync to files
-                self.tracked_files.remove(file_with_track)
-                self._save_tracked_files()
+        if self.stat_cache.pop(file, None) is not None:
+            self.stat_cache_changed = True
+
+        if self.blobs.pop(file, None) is not None:
+            self.git_state_changed = True
+
+        if self.chunk_ids.pop(file, None) is not None:
+            self.chunk_ids_changed = True
+
+        old_hash = self.index.pop(file, None)
+        if old_hash is not None:
+            self._mark_changed()
 
-                # return old tracked file for others to use
-                return file_with_track.split("@")[1]
+        # return old tracked file for others to use
+        return old_hash
 
     @staticmethod
-    def get_file_hash(file_path: str) -> str:
-        hasher = hashlib.sha256()
+    def get_file_hash(file_path: str, algorithm: HashAlgorithm = "sha256") -> str:
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hasher.update(chunk)
+            # reads into a large reused buffer, without copying chunks around
+            hasher = hashlib.file_digest(f, HASHERS[algorithm])
 
-        return hasher.hexdigest()
+        return f"{HASH_PREFIXES[algorithm]}{hasher.hexdigest()}"
@@ -130,3 +130,223 @@ def test_hash_function_is_consistent(tmp_path):
     write_to_file(file, "different data")
     hash3 = TrackedFileHandler.get_file_hash(str(file))
     assert hash1 != hash3
+
+
+def test_changes_are_only_saved_on_flush(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    test_file = tmp_path / "a.txt"
+    write_to_file(test_file, "some content")
+
+    handler = TrackedFileHandler(str(tracked_file))
+    handler.upsert_tracked_file(str(test_file))
+    assert tracked_file.read_text(encoding="utf-8") == ""
+
+    handler.flush()
+    assert tracked_file.read_text(encoding="utf-8") == handler.tracked_files[0]
+
+    # a new handler should pick up the saved state
+    assert TrackedFileHandler(str(tracked_file)).should_skip(str(test_file))
+
+    # no temporary files should be left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "a.txt",
+        "tracked.stat.json",
+        "tracked.txt",
+    ]
+
+
+def test_checkpoint_interval_saves_changes(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    files = [tmp_path / f"{name}.txt" for name in ("a", "b", "c")]
+    for file in files:
+        write_to_file(file, f"content of {file.name}")
+
+    handler = TrackedFileHandler(str(tracked_file), checkpoint_interval=2)
+    handler.upsert_tracked_file(str(files[0]))
+    assert tracked_file.read_text(encoding="utf-8") == ""
+
+    handler.upsert_tracked_file(str(files[1]))
+    assert len(tracked_file.read_text(encoding="utf-8").splitlines()) == 2
+
+    handler.upsert_tracked_file(str(files[2]))
+    assert len(tracked_file.read_text(encoding="utf-8").splitlines()) == 2
+
+    handler.flush()
+    assert len(tracked_file.read_text(encoding="utf-8").splitlines()) == 3
+
+
+def test_flush_does_not_load_the_state_again(tmp_path, monkeypatch):
+    tracked_file = tmp_path / "tracked.txt"
+    handler = TrackedFileHandler(str(tracked_file), checkpoint_interval=1)
+
+    loaded = []
+    monkeypatch.setattr(
+        TrackedFileHandler, "_load_json", staticmethod(lambda path: loaded.append(path))
+    )
+    handler.set_chunk_ids("a.md", ["id"])
+    handler.flush()
+
+    assert loaded == []
+    assert handler.get_chunk_ids("a.md") == ["id"]
+
+
+def test_unchanged_files_are_not_hashed_again(tmp_path, monkeypatch):
+    tracked_file = tmp_path / "tracked.txt"
+    test_file = tmp_path / "a.txt"
+    write_to_file(test_file, "some content")
+
+    handler = TrackedFileHandler(str(tracked_file))
+    hash = handler.get_current_hash(str(test_file))
+    handler.upsert_tracked_file(str(test_file), hash)
+    handler.flush()
+
+    hashed_files = []
+    original_get_file_hash = TrackedFileHandler.get_file_hash
+
+    def counting_get_file_hash(file_path: str, algorithm="sha256") -> str:
+        hashed_files.append(file_path)
+        return original_get_file_hash(file_path, algorithm)
+
+    monkeypatch.setattr(
+        TrackedFileHandler, "get_file_hash", staticmethod(counting_get_file_hash)
+    )
+
+    # the stat cache is persisted, so even a new handler does not need to read the file
+    handler = TrackedFileHandler(str(tracked_file))
+    assert handler.should_skip(str(test_file))
+    assert handler.get_current_hash(str(test_file)) == hash
+    assert hashed_files == []
+
+    write_to_file(test_file, "some other content")
+    assert not handler.should_skip(str(test_file))
+    handler.upsert_tracked_file(str(test_file))
+    assert hashed_files == [str(test_file)]
+
+
+def test_git_state_is_persisted(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    test_file = tmp_path / "a.txt"
+    write_to_file(test_file, "some content")
+
+    handler = TrackedFileHandler(str(tracked_file))
+    handler.upsert_tracked_file(str(test_file))
+    # blob ids are only valid for tracked files
+    assert not handler.is_tracked_blob(str(tmp_path / "b.txt"), "blob-b")
+
+    handler.track_blob(str(test_file), "blob-a")
+    handler.set_last_commit("commit-a")
+    handler.flush()
+
+    handler = TrackedFileHandler(str(tracked_file))
+    assert handler.last_commit == "commit-a"
+    assert handler.is_tracked_blob(str(test_file), "blob-a")
+    assert not handler.is_tracked_blob(str(test_file), "blob-b")
+
+    handler.delete_tracked_file(str(test_file))
+    assert not handler.is_tracked_blob(str(test_file), "blob-a")
+
+
+def test_rename_tracked_file(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    old_file = tmp_path / "old.txt"
+    new_file = tmp_path / "new.txt"
+    write_to_file(old_file, "some content")
+
+    handler = TrackedFileHandler(str(tracked_file))
+    handler.upsert_tracked_file(str(old_file))
+    hash = handler.get_file_hash(str(old_file))
+
+    old_file.rename(new_file)
+    assert handler.get_dangling_files_by_hash() == {hash: str(old_file)}
+
+    replaced_hash = handler.rename_tracked_file(str(old_file), str(new_file))
+    assert replaced_hash is None
+    assert handler.tracked_files == [f"{new_file}@{hash}"]
+    assert handler.should_skip(str(new_file))
+    assert handler.get_dangling_files_by_hash() == {}
+
+
+def test_bulk_hashing_matches_single_hashing(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    files = [tmp_path / f"{i}.txt" for i in range(20)]
+    for i, file in enumerate(files):
+        write_to_file(file, f"content {i}" * i)
+
+    handler = TrackedFileHandler(str(tracked_file))
+    hashes = handler.get_current_hashes([str(f) for f in files], workers=4)
+
+    assert hashes == {str(f): handler.get_file_hash(str(f)) for f in files}
+
+
+def test_hash_algorithms_can_coexist(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    old_file = tmp_path / "old.txt"
+    new_file = tmp_path / "new.txt"
+    write_to_file(old_file, "old content")
+    write_to_file(new_file, "new content")
+
+    # entry created with the default algorithm
+    handler = TrackedFileHandler(str(tracked_file))
+    handler.upsert_tracked_file(str(old_file))
+    handler.flush()
+
+    handler = TrackedFileHandler(str(tracked_file), hash_algorithm="blake2b")
+    handler.upsert_tracked_file(str(new_file))
+
+    new_hash = handler.index[str(new_file)]
+    assert new_hash.startswith("blake2b:")
+    assert new_hash == handler.get_file_hash(str(new_file), "blake2b")
+
+    # old entries are still compared with their own algorithm
+    assert handler.get_hash_algorithm(str(old_file)) == "sha256"
+    assert handler.should_skip(str(old_file))
+    assert handler.should_skip(str(new_file))
+
+
+def test_renamed_files_are_found_with_the_algorithm_of_their_entry(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    old_file = tmp_path / "old.txt"
+    new_file = tmp_path / "new.txt"
+    write_to_file(old_file, "some content")
+
+    handler = TrackedFileHandler(str(tracked_file))
+    handler.upsert_tracked_file(str(old_file))
+    old_hash = handler.index[str(old_file)]
+    handler.flush()
+    old_file.rename(new_file)
+
+    handler = TrackedFileHandler(str(tracked_file), hash_algorithm="blake2b")
+    candidates = handler.get_dangling_files_by_hash()
+    assert handler.pop_renamed_file(str(new_file), candidates) == (
+        str(old_file),
+        old_hash,
+    )
+    assert candidates == {}
+
+    write_to_file(new_file, "other content")
+    assert handler.pop_renamed_file(str(new_file), {old_hash: str(old_file)}) is None
+
+
+def test_chunk_ids_are_persisted_and_follow_the_file(tmp_path):
+    tracked_file = tmp_path / "tracked.txt"
+    old_file = tmp_path / "old.txt"
+    new_file = tmp_path / "new.txt"
+    write_to_file(old_file, "some content")
+
+    handler = TrackedFileHandler(str(tracked_file))
+    assert handler.get_chunk_ids(str(old_file)) is None
+
+    handler.upsert_tracked_file(str(old_file))
+    handler.set_chunk_ids(str(old_file), ["a", "b"])
+    handler.flush()
+
+    handler = TrackedFileHandler(str(tracked_file))
+    assert handler.get_chunk_ids(str(old_file)) == ["a", "b"]
+
+    old_file.rename(new_file)
+    handler.rename_tracked_file(str(old_file), str(new_file))
+    assert handler.get_chunk_ids(str(old_file)) is None
+    assert handler.get_chunk_ids(str(new_file)) == ["a", "b"]
+
+    handler.delete_tracked_file(str(new_file))
+    assert handler.get_chunk_ids(str(new_file)) is None
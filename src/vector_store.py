@@ -0,0 +1,251 @@
+import os
+import time
+from typing import TYPE_CHECKING, Any, Literal, Protocol, TypedDict, cast
+
+from client_state import ClientState, IndexDescription
+from config import CYAN, LOCAL_STORE_PATH, MAGENTA, PINECONE_API_KEY, RESET
+from embedder import (
+    PINECONE_EMBED_DIMENSION,
+    PINECONE_EMBED_MODEL,
+    Embedder,
+    EmbedderType,
+)
+
+if TYPE_CHECKING:
+    # the sdk takes a while to import, it is only imported once it is used
+    from pinecone import Pinecone
+
+StoreType = Literal["pinecone", "local"]
+
+
+class Match(TypedDict):
+    id: str
+    score: float
+    metadata: dict[str, Any]
+
+
+class VectorStore(Protocol):
+    """
+    Storage and search of records, a record being an id, a `text` that is embedded and metadata.
+    Filters follow the Pinecone metadata filter syntax (e.g. `{"hash": {"$in": [...]}}`).
+    """
+
+    @property
+    def dimension(self) -> int: ...
+
+    def upsert_records(self, namespace: str, records: list[dict]) -> None: ...
+
+    def update(self, id: str, set_metadata: dict[str, Any], namespace: str) -> None: ...
+
+    def delete(
+        self,
+        namespace: str,
+        ids: list[str] | None = None,
+        filter: dict[str, Any] | None = None,
+    ) -> None: ...
+
+    def delete_namespace(self, namespace: str) -> None: ...
+
+    def query(
+        self,
+        namespace: str,
+        vector: list[float],
+        top_k: int,
+        filter: dict[str, Any] | None = None,
+    ) -> list[Match]: ...
+
+    def count(self, namespace: str) -> int: ...
+
+    def list_ids(self, namespace: str) -> list[str]: ...
+
+    def fetch_metadata(
+        self, namespace: str, ids: list[str]
+    ) -> dict[str, dict[str, Any]]: ...
+
+
+class PineconeVectorStore:
+    """
+    Pinecone index of vectors, texts are embedded by the given embedder before they are upserted
+    (e.g. a cached one, so unchanged texts are not embedded again).
+
+    The host and dimension of the index are cached in the client state (if given),
+    so opening a known index does not need any request.
+    """
+
+    def __init__(
+        self,
+        pc: "Pinecone",
+        index_name: str,
+        embedder: Embedder,
+        create: bool = False,
+        state: ClientState | None = None,
+    ):
+        self.pc = pc
+        self.index_name = index_name
+        self.embedder = embedder
+
+        description = state.get_index(index_name) if state else None
+        if description is None:
+            description = self._describe(create)
+            if state:
+                state.set_index(index_name, description)
+
+        self.description = description
+        self.index = self.pc.Index(host=description["host"])
+
+    def _describe(self, create: bool) -> IndexDescription:
+        if create and not self.pc.has_index(self.index_name):
+            from pinecone import AwsRegion, CloudProvider, Metric, ServerlessSpec
+
+            print(
+                f"\n{MAGENTA}Creating{RESET} index{RESET} - {CYAN}{self.index_name}{RESET}"
+            )
+            self.pc.create_index(
+                name=self.index_name,
+                dimension=PINECONE_EMBED_DIMENSION,
+                metric=Metric.COSINE,
+                spec=ServerlessSpec(
+                    cloud=CloudProvider.AWS, region=AwsRegion.US_EAST_1
+                ),
+            )
+            time.sleep(1)
+
+        description = self.pc.describe_index(self.index_name)
+        return {"host": description.host, "dimension": description.dimension}
+
+    @property
+    def dimension(self) -> int:
+        return self.description["dimension"]
+
+    def upsert_records(self, namespace: str, records: list[dict]) -> None:
+        if not records:
+            return
+
+        # the text is kept as metadata, it is the context of the matches
+        vectors = self.embedder.embed([r["text"] for r in records], "passage")
+        self.index.upsert(
+            vectors=[
+                {
+                    "id": record["id"],
+                    "values": values,
+                    "metadata": {k: v for k, v in record.items() if k != "id"},
+                }
+                for record, values in zip(records, vectors)
+            ],
+            namespace=namespace,
+        )
+
+    def update(self, id: str, set_metadata: dict[str, Any], namespace: str) -> None:
+        self.index.update(id=id, set_metadata=set_metadata, namespace=namespace)
+
+    def delete(
+        self,
+        namespace: str,
+        ids: list[str] | None = None,
+        filter: dict[str, Any] | None = None,
+    ) -> None:
+        self.index.delete(namespace=namespace, ids=ids, filter=filter)
+
+    def delete_namespace(self, namespace: str) -> None:
+        from pinecone.exceptions import NotFoundException
+
+        try:
+            self.index.delete(namespace=namespace, delete_all=True)
+        except NotFoundException:
+            # e.g. deleted by hand already
+            pass
+
+    def query(
+        self,
+        namespace: str,
+        vector: list[float],
+        top_k: int,
+        filter: dict[str, Any] | None = None,
+    ) -> list[Match]:
+        from pinecone import QueryResponse
+
+        results = cast(
+            QueryResponse,
+            self.index.query(
+                vector=vector,
+                top_k=top_k,
+                include_values=False,
+                include_metadata=True,
+                namespace=namespace,
+                filter=filter,
+            ),
+        )
+
+        return [
+            {"id": m["id"], "score": m["score"], "metadata": m["metadata"] or {}}
+            for m in results["matches"]
+        ]
+
+    def count(self, namespace: str) -> int:
+        # the stats are eventually consistent, recent changes might be missing
+        namespaces = self.index.describe_index_stats().namespaces or {}
+        summary = namespaces.get(namespace)
+
+        return summary.vector_count if summary else 0
+
+    def list_ids(self, namespace: str) -> list[str]:
+        # listed in pages of up to 100 ids
+        return [id for ids in self.index.list(namespace=namespace) for id in ids]
+
+    def fetch_metadata(
+        self, namespace: str, ids: list[str]
+    ) -> dict[str, dict[str, Any]]:
+        metadata: dict[str, dict[str, Any]] = {}
+        # ids are part of the url, so only fetch a few at once
+        for i in range(0, len(ids), 100):
+            response = self.index.fetch(ids=ids[i : i + 100], namespace=namespace)
+            for id, vector in response.vectors.items():
+                metadata[id] = vector.metadata or {}
+
+        return metadata
+
+
+def create_pinecone_client(
+    store: StoreType, embedder: EmbedderType
+) -> "Pinecone | None":
+    """The pinecone client is only needed, when pinecone is used as store or embedder"""
+    if store != "pinecone" and embedder != "pinecone":
+        return None
+
+    from pinecone import Pinecone
+
+    return Pinecone(api_key=PINECONE_API_KEY)
+
+
+def get_local_store_path(index_name: str, model: str) -> str:
+    """Every embedding model gets a store of its own, as their vectors can not be mixed"""
+    return os.path.join(LOCAL_STORE_PATH, index_name, model)
+
+
+def open_vector_store(
+    store: StoreType,
+    index_name: str,
+    embedder: Embedder,
+    pc: "Pinecone | None" = None,
+    create: bool = False,
+    state: ClientState | None = None,
+) -> VectorStore:
+    """
+    Open the given store of the index, the local one is created when it does not exist.
+    Lookups of the pinecone index are cached in `state` (if given).
+    """
+    if store == "local":
+        # imported here, as the local store depends on this module
+        from local_vector_store import LocalVectorStore
+
+        return LocalVectorStore(
+            get_local_store_path(index_name, embedder.model), embedder
+        )
+
+    # the vectors of the pinecone index are of this model, records and queries need to be embedded with it
+    if pc is None or embedder.model != PINECONE_EMBED_MODEL:
+        raise ValueError(
+            f"The pinecone store needs a pinecone client and the {PINECONE_EMBED_MODEL} embedder"
+        )
+
+    return PineconeVectorStore(pc, index_name, embedder, create=create, state=state)
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from embedder import HashingEmbedder
+from embedding_cache import CachedEmbedder, EmbeddingCache
+from vector_store import PineconeVectorStore
+
+
+class FakeIndex:
+    def __init__(self):
+        self.upserts: list[dict] = []
+
+    def upsert(self, vectors: list[dict], namespace: str) -> None:
+        self.upserts.append({"vectors": vectors, "namespace": namespace})
+
+
+class FakePinecone:
+    def __init__(self):
+        self.index = FakeIndex()
+
+    def has_index(self, name: str) -> bool:
+        return True
+
+    def describe_index(self, name: str):
+        return SimpleNamespace(host=f"{name}-abc.svc.pinecone.io", dimension=1024)
+
+    def Index(self, host: str):
+        return self.index
+
+
+def test_records_are_embedded_via_the_given_embedder(tmp_path):
+    pc = FakePinecone()
+    embedder = CachedEmbedder(HashingEmbedder(), EmbeddingCache(str(tmp_path), 10))
+    store = PineconeVectorStore(pc, "notes", embedder)  # type: ignore[arg-type]
+
+    record = {"id": "a#section#1", "text": "# A\n\nsome text", "hash": "h"}
+    store.upsert_records("default", [record])
+    store.upsert_records("default", [record])
+    store.upsert_records("default", [])
+
+    assert len(pc.index.upserts) == 2
+    vector = pc.index.upserts[0]["vectors"][0]
+    assert vector["id"] == "a#section#1"
+    assert len(vector["values"]) == 1024
+    assert vector["metadata"] == {"text": "# A\n\nsome text", "hash": "h"}
+    # unchanged texts come from the cache
+    assert (embedder.hits, embedder.misses) == (1, 1)